@@ -0,0 +1,36 @@
+"""Add indexes for hot queries
+
+Revision ID: a395075ff945
+Revises: 3165d5c2a401
+Create Date: 2026-10-18 19:40:12.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a395075ff945'
+down_revision = '3165d5c2a401'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # session auth check, history load and /session_history
+    op.create_index('ix_interactions_session_id_timestamp', 'interactions',
+                    ['session_id', 'timestamp'])
+    # /conversations
+    op.create_index('ix_interactions_user_id_timestamp', 'interactions',
+                    ['user_id', 'timestamp'])
+    op.create_index('ix_memory_user_id', 'memory', ['user_id'])
+    op.create_index('ix_quivr_info_user_id', 'quivr_info', ['user_id'])
+    op.create_index('ix_characters_author_id', 'characters', ['author_id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_characters_author_id', 'characters')
+    op.drop_index('ix_quivr_info_user_id', 'quivr_info')
+    op.drop_index('ix_memory_user_id', 'memory')
+    op.drop_index('ix_interactions_user_id_timestamp', 'interactions')
+    op.drop_index('ix_interactions_session_id_timestamp', 'interactions')
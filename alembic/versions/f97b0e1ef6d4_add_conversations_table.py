@@ -0,0 +1,51 @@
+"""Add conversations table
+
+Revision ID: f97b0e1ef6d4
+Revises: a395075ff945
+Create Date: 2026-10-18 19:52:37.904613
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f97b0e1ef6d4'
+down_revision = 'a395075ff945'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'conversations',
+        sa.Column('session_id', sa.String(50), primary_key=True),
+        sa.Column('user_id', sa.String(50), nullable=True),
+        sa.Column('character_id', sa.String(100), nullable=True),
+        sa.Column('last_message', sa.Unicode(200), nullable=True),
+        sa.Column('last_timestamp', sa.DateTime(), nullable=True),
+        sa.Column('turn_count', sa.Integer(), nullable=False, server_default='0'),
+    )
+    op.create_index('ix_conversations_user_id_last_timestamp', 'conversations',
+                    ['user_id', 'last_timestamp', 'session_id'])
+    # one row per existing session, from its latest interaction
+    op.execute("""
+        INSERT INTO conversations
+            (session_id, user_id, character_id, last_message, last_timestamp, turn_count)
+        SELECT session_id, user_id, character_id, substr(client_message_unicode, 1, 200),
+               timestamp, turn_count
+        FROM (
+            SELECT session_id, user_id, character_id, client_message_unicode, timestamp,
+                   row_number() OVER (PARTITION BY session_id
+                                      ORDER BY timestamp DESC, id DESC) AS rn,
+                   count(*) OVER (PARTITION BY session_id) AS turn_count
+            FROM interactions
+            WHERE session_id IS NOT NULL
+        ) AS latest
+        WHERE rn = 1
+    """)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_conversations_user_id_last_timestamp', 'conversations')
+    op.drop_table('conversations')
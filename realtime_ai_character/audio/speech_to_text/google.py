@@ -1,9 +1,14 @@
 #使用Goolge Cloud 语音识别,将语音转换为文本
 #导入相关库和模块
+import asyncio
+import queue
+import threading
 from google.cloud import speech # 导入google.cloud模块中的speech库
 import types                    # 导入types模块
 
 from realtime_ai_character.audio.speech_to_text.base import SpeechToText     #从base.py中导入SpeechToText类
+from realtime_ai_character.audio.speech_to_text.streaming import (
+    SpeechStream, TranscriptEvent, stable_words)
 from realtime_ai_character.logger import get_logger                          #日志
 from realtime_ai_character.utils import Singleton, timed                     # 导入 Singleton 和 timed 装饰器
 
@@ -37,12 +42,16 @@ class Google(Singleton, SpeechToText):
     @timed 
     #定义transcribe 方法 根据平台和其他参数配置语音识别
     def transcribe(
-        self, audio_bytes, platform, prompt="", language="en-US", suppress_tokens=[-1]
+        self, audio_bytes, platform, prompt="", language="en-US", suppress_tokens=[-1],
+        sample_rate=44100, channels=1
     ) -> str: #
         batch_config = speech.RecognitionConfig({
             'speech_contexts': [speech.SpeechContext(phrases=prompt.split(','))],
             **config.__dict__[platform]})
         batch_config.language_code = language
+        if platform != 'web': # 原始PCM音频使用客户端提供的采样率和声道数
+            batch_config.sample_rate_hertz = sample_rate
+            batch_config.audio_channel_count = channels
         if language != 'en-US': 
             batch_config.alternative_language_codes = ['en-US'] #如果指定的语言不是美式英文，那么将美式英文设置为备选语言
         response = self.client.recognize(
@@ -55,3 +64,108 @@ class Google(Singleton, SpeechToText):
         if not result.alternatives:
             return ''
         return result.alternatives[0].transcript
+
+    def create_stream(self, sample_rate=44100, channels=1, prompt="", language="en-US"):
+        # 使用Google原生的streaming_recognize,由Google负责端点检测
+        return GoogleStream(self, sample_rate=sample_rate, channels=channels, prompt=prompt,
+                            language=language)
+
+
+class GoogleStream(SpeechStream):
+    """
+    Streaming transcription with Google `streaming_recognize`.
+
+    One recognition call is opened per utterance with `single_utterance`, Google detects
+    the end of speech and returns the final result. The blocking gRPC stream runs in a
+    thread, audio is handed to it through a queue and interim results come back to the event
+    loop, tagged with the audio queue of the call they belong to. Final results go straight
+    to `finals`.
+    """
+
+    def __init__(self, google: Google, **kwargs):
+        super().__init__(google, **kwargs)
+        self.client = google.client
+        self._audio: queue.Queue | None = None
+        self._results: asyncio.Queue = asyncio.Queue()
+        self._interim = ''
+
+    async def feed(self, audio: bytes) -> list[TranscriptEvent]:
+        # read the results first, so a frame is never sent to a call that stopped listening
+        events = []
+        while not self._results.empty():
+            call, result = self._results.get_nowait()
+            current = call is self._audio
+            if result is None:
+                # the call stopped listening or ended, this frame opens a new one
+                if current:
+                    self._end_utterance()
+            elif current:
+                events.extend(self._interim_event(result.text))
+        if self._audio is None:
+            self._audio = queue.Queue()
+            threading.Thread(target=self._recognize,
+                             args=(self._audio, asyncio.get_running_loop()),
+                             daemon=True).start()
+        self._audio.put(audio)
+        return events
+
+    def flush(self):
+        # no more audio for this call, Google returns the final result of what it has
+        self._end_utterance()
+
+    async def close(self):
+        self._end_utterance()
+
+    def _end_utterance(self):
+        if self._audio is not None:
+            self._audio.put(None)
+            self._audio = None
+        self._interim = ''
+        self._emitted_words = 0
+
+    def _interim_event(self, text: str) -> list[TranscriptEvent]:
+        previous, self._interim = self._interim, text
+        words = stable_words(previous, text)
+        if len(words) <= self._emitted_words:
+            return []
+        prefix = ' ' if self._emitted_words else ''
+        new_words = ' '.join(words[self._emitted_words:])
+        self._emitted_words = len(words)
+        return [TranscriptEvent(text=prefix + new_words, is_final=False)]
+
+    def _recognize(self, audio: queue.Queue, loop: asyncio.AbstractEventLoop):
+        recognition_config = speech.RecognitionConfig({
+            'speech_contexts': [speech.SpeechContext(phrases=self.prompt.split(','))],
+            **config.terminal})
+        recognition_config.language_code = self.language
+        recognition_config.sample_rate_hertz = self.sample_rate
+        recognition_config.audio_channel_count = self.channels
+        streaming_config = speech.StreamingRecognitionConfig(
+            config=recognition_config, interim_results=True, single_utterance=True)
+        requests = (speech.StreamingRecognizeRequest(audio_content=chunk)
+                    for chunk in iter(audio.get, None))
+        end_of_utterance = (
+            speech.StreamingRecognizeResponse.SpeechEventType.END_OF_SINGLE_UTTERANCE)
+        try:
+            for response in self.client.streaming_recognize(config=streaming_config,
+                                                            requests=requests):
+                if response.speech_event_type == end_of_utterance:
+                    # stop sending audio, the final result follows. Tell feed at once, so the
+                    # next frames go to a new call instead of this queue nobody reads anymore
+                    audio.put(None)
+                    loop.call_soon_threadsafe(self._results.put_nowait, (audio, None))
+                for result in response.results:
+                    if not result.alternatives:
+                        continue
+                    event = TranscriptEvent(text=result.alternatives[0].transcript.strip(),
+                                            is_final=result.is_final)
+                    if result.is_final:
+                        # may come after the next call was opened, it still ends this one
+                        loop.call_soon_threadsafe(self.finals.put_nowait, event)
+                        loop.call_soon_threadsafe(self._results.put_nowait, (audio, None))
+                    else:
+                        loop.call_soon_threadsafe(self._results.put_nowait, (audio, event))
+        except Exception as e:
+            logger.error(f"Google streaming recognition failed: {e}")
+        finally:
+            loop.call_soon_threadsafe(self._results.put_nowait, (audio, None))
@@ -0,0 +1,40 @@
+# Conversions between the raw 16-bit PCM sent by clients and the float32 arrays used by the
+# speech models, done with numpy only (no WAV container, no subprocess).
+import numpy as np
+
+# Speech models (Whisper, VAD) take 16 kHz mono audio.
+SAMPLE_RATE = 16000
+
+
+def pcm16_to_float32(audio_bytes: bytes, sample_rate: int = SAMPLE_RATE,
+                     channels: int = 1) -> np.ndarray:
+    """Convert interleaved little-endian 16-bit PCM to 16 kHz mono float32 in [-1, 1]."""
+    # frombuffer does not copy, the only copy is the conversion to float32
+    samples = np.frombuffer(audio_bytes, dtype='<i2', count=len(audio_bytes) // 2)
+    audio = samples.astype(np.float32) / 32768.0
+    if channels > 1:
+        audio = audio[:len(audio) - len(audio) % channels].reshape(-1, channels).mean(axis=1)
+    return resample(audio, sample_rate)
+
+
+def float32_to_pcm16(audio: np.ndarray) -> bytes:
+    """Convert float32 audio in [-1, 1] back to little-endian 16-bit PCM."""
+    return (np.clip(audio, -1.0, 1.0) * 32767).astype('<i2').tobytes()
+
+
+def downmix_pcm16(audio_bytes: bytes, channels: int) -> bytes:
+    """Average interleaved 16-bit PCM channels into mono 16-bit PCM."""
+    if channels <= 1:
+        return audio_bytes
+    samples = np.frombuffer(audio_bytes, dtype='<i2', count=len(audio_bytes) // 2)
+    samples = samples[:len(samples) - len(samples) % channels].reshape(-1, channels)
+    return samples.mean(axis=1).astype('<i2').tobytes()
+
+
+def resample(audio: np.ndarray, sample_rate: int, target_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """Resample mono float32 audio with linear interpolation."""
+    if sample_rate == target_rate or not len(audio):
+        return audio
+    length = len(audio) * target_rate // sample_rate
+    positions = np.arange(length, dtype=np.float64) * (sample_rate / target_rate)
+    return np.interp(positions, np.arange(len(audio)), audio).astype(np.float32)
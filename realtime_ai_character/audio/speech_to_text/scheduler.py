@@ -0,0 +1,132 @@
+# This file schedules transcription requests onto a bounded pool of worker threads, so that
+# concurrent sessions queue for the speech model instead of oversubscribing the CPU.
+import asyncio
+import os
+import types
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from typing import Callable
+
+from realtime_ai_character.logger import get_logger
+
+logger = get_logger(__name__)
+
+config = types.SimpleNamespace(**{
+    # number of transcriptions running at the same time
+    'workers': int(os.getenv('STT_WORKERS', 2)),
+    # requests waiting for a worker beyond this number are rejected
+    'max_queue': int(os.getenv('STT_MAX_QUEUE', 16)),
+    # seconds a request may wait for a worker before it is dropped
+    'deadline': float(os.getenv('STT_QUEUE_DEADLINE', 10)),
+})
+
+# number of recent requests kept for the latency metrics
+LATENCY_WINDOW = 1000
+
+
+class TranscriptionRejected(Exception):
+    """Raised when a request is refused because the queue is full or its deadline passed."""
+
+
+def _percentile(samples, percent: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+class TranscriptionScheduler:
+    """
+    Bounded worker pool with admission control for blocking transcription calls.
+
+    :transcribe: the blocking function doing the transcription.
+    :workers: number of worker threads, should match the model's own worker count.
+    :max_queue: maximum number of requests waiting for a worker.
+    :deadline: default seconds a request may wait in the queue.
+    """
+
+    def __init__(self, transcribe: Callable, workers: int = config.workers,
+                 max_queue: int = config.max_queue, deadline: float = config.deadline):
+        self.transcribe = transcribe
+        self.workers = workers
+        self.max_queue = max_queue
+        self.deadline = deadline
+        self.executor = ThreadPoolExecutor(max_workers=workers,
+                                           thread_name_prefix='transcription')
+        self._slots = None
+        self.waiting = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.expired = 0
+        self.wait_times = deque(maxlen=LATENCY_WINDOW)
+        self.run_times = deque(maxlen=LATENCY_WINDOW)
+
+    async def submit(self, *args, deadline: float = None, **kwargs):
+        """Run the transcription on a worker once one is free, within the queue deadline."""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+        enqueued = perf_counter()
+        if not self._slots.locked():
+            # a worker is free, take it without queueing
+            await self._slots.acquire()
+        else:
+            await self._wait_for_slot(deadline or self.deadline)
+
+        started = perf_counter()
+        self.wait_times.append(started - enqueued)
+        self.running += 1
+        future = asyncio.get_running_loop().run_in_executor(
+            self.executor, lambda: self.transcribe(*args, **kwargs))
+        # the slot is held until the model call returns, even if the caller is cancelled,
+        # so the pool never runs more than `workers` calls at once
+        future.add_done_callback(self._release)
+        try:
+            result = await asyncio.shield(future)
+        except Exception:
+            self.failed += 1
+            raise
+        self.completed += 1
+        self.run_times.append(perf_counter() - started)
+        return result
+
+    async def _wait_for_slot(self, deadline: float):
+        if self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise TranscriptionRejected(f'transcription queue is full ({self.waiting} waiting)')
+        self.waiting += 1
+        try:
+            # acquire in this task: a cancelled acquire gives the permit back, while wait_for
+            # could time out after the acquire had already succeeded and leak the permit
+            async with asyncio.timeout(deadline):
+                await self._slots.acquire()
+        except TimeoutError:
+            self.expired += 1
+            raise TranscriptionRejected(
+                f'transcription waited more than {deadline}s for a worker')
+        finally:
+            self.waiting -= 1
+
+    def _release(self, _future):
+        self.running -= 1
+        self._slots.release()
+
+    def stats(self) -> dict:
+        return {
+            'workers': self.workers,
+            'queue_depth': self.waiting,
+            'running': self.running,
+            'completed': self.completed,
+            'failed': self.failed,
+            'rejected': self.rejected,
+            'expired': self.expired,
+            'wait_p50': _percentile(self.wait_times, 50),
+            'wait_p95': _percentile(self.wait_times, 95),
+            'run_p50': _percentile(self.run_times, 50),
+            'run_p95': _percentile(self.run_times, 95),
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
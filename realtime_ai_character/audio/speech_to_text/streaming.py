@@ -0,0 +1,267 @@
+# This file implements streaming speech to text: the client sends small raw PCM frames while
+# the user talks, a voice activity detector finds the end of speech, partial transcripts are
+# emitted while the user is still talking and the final transcript is ready right after they
+# stop, instead of after the whole utterance has been uploaded and decoded.
+import asyncio
+import os
+import types
+from collections import deque
+from contextlib import suppress
+from typing import Optional
+
+import numpy as np
+from pydantic.dataclasses import dataclass
+
+from realtime_ai_character.audio.speech_to_text.pcm import (
+    SAMPLE_RATE, float32_to_pcm16, pcm16_to_float32)
+from realtime_ai_character.logger import get_logger
+
+logger = get_logger(__name__)
+
+config = types.SimpleNamespace(**{
+    # length of the frames the voice activity detector looks at
+    'frame_ms': 30,
+    # a frame is speech when its energy is this many times above the noise floor
+    'vad_threshold': float(os.getenv('STT_VAD_THRESHOLD', 3.0)),
+    # frames quieter than this (RMS of [-1, 1] samples) are never speech
+    'vad_min_rms': float(os.getenv('STT_VAD_MIN_RMS', 0.01)),
+    # voiced audio needed to start an utterance
+    'speech_start_ms': int(os.getenv('STT_SPEECH_START_MS', 90)),
+    # silence needed to end an utterance
+    'speech_end_ms': int(os.getenv('STT_SPEECH_END_MS', 300)),
+    # audio kept from before the start of speech so the first syllable is not cut
+    'preroll_ms': int(os.getenv('STT_PREROLL_MS', 300)),
+    # seconds of new audio between two partial transcriptions
+    'partial_interval': float(os.getenv('STT_PARTIAL_INTERVAL', 0.6)),
+    # utterances longer than this are finalized even if the user keeps talking
+    'max_utterance': float(os.getenv('STT_MAX_UTTERANCE', 30)),
+})
+
+FRAME_SAMPLES = SAMPLE_RATE * config.frame_ms // 1000
+
+
+@dataclass
+class TranscriptEvent:
+    text: str
+    # partial events carry only the newly stable words, final events the whole utterance
+    is_final: bool
+
+
+class EnergyVAD:
+    """Frame energy voice activity detector with an adaptive noise floor."""
+
+    def __init__(self, threshold: float = config.vad_threshold,
+                 min_rms: float = config.vad_min_rms,
+                 start_frames: int = config.speech_start_ms // config.frame_ms,
+                 end_frames: int = config.speech_end_ms // config.frame_ms):
+        self.threshold = threshold
+        self.min_rms = min_rms
+        self.start_frames = max(1, start_frames)
+        self.end_frames = max(1, end_frames)
+        self.noise_floor = min_rms
+        self.speaking = False
+        self.voiced = False
+        self._voiced_run = 0
+        self._silent_run = 0
+
+    def update(self, frame: np.ndarray) -> Optional[str]:
+        """Process a frame, returns 'start' or 'end' when the speech state changes."""
+        rms = float(np.sqrt(np.mean(frame * frame)))
+        self.voiced = rms > max(self.min_rms, self.noise_floor * self.threshold)
+        if not self.voiced and not self.speaking:
+            # only adapt to the background noise while nobody is talking
+            self.noise_floor = max(self.min_rms / self.threshold,
+                                   0.95 * self.noise_floor + 0.05 * rms)
+        if self.voiced:
+            self._voiced_run += 1
+            self._silent_run = 0
+        else:
+            self._voiced_run = 0
+            self._silent_run += 1
+        if not self.speaking and self._voiced_run >= self.start_frames:
+            self.speaking = True
+            return 'start'
+        if self.speaking and self._silent_run >= self.end_frames:
+            self.speaking = False
+            return 'end'
+        return None
+
+
+def stable_words(previous: str, current: str) -> list[str]:
+    """Words two consecutive hypotheses agree on, these are unlikely to change anymore."""
+    stable = []
+    for a, b in zip(previous.split(), current.split()):
+        if a != b:
+            break
+        stable.append(b)
+    return stable
+
+
+class SpeechStream:
+    """
+    Streaming transcription of one session's raw 16-bit PCM frames.
+
+    Frames go through the voice activity detector into a rolling utterance buffer. While
+    the user talks the buffer is transcribed every `partial_interval` seconds in the
+    background and the words two consecutive hypotheses agree on are emitted as partial
+    transcripts. A hypothesis is also started as soon as the user pauses, so when the end
+    of speech is confirmed it usually already covers the whole utterance and becomes the
+    final transcript without another decode. The final transcription also runs in the
+    background, so the caller keeps receiving audio meanwhile; final transcripts are put in
+    the `finals` queue in the order of the utterances, they do not wait for more audio.
+    `flush` ends the current utterance when the client says the user stopped talking, as
+    with push-to-talk.
+
+    Works with any engine through `SpeechToText.atranscribe`, engines with a native
+    streaming API can override `feed`.
+    """
+
+    def __init__(self, speech_to_text, sample_rate: int = 44100, channels: int = 1,
+                 prompt: str = '', language: str = 'en-US'):
+        self.speech_to_text = speech_to_text
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.prompt = prompt
+        self.language = language
+        self.vad = EnergyVAD()
+        self._pending = np.zeros(0, dtype=np.float32)
+        self._preroll = deque(maxlen=max(1, config.preroll_ms // config.frame_ms))
+        # final transcriptions of the finished utterances, in order
+        self._final_tasks: deque[asyncio.Task] = deque()
+        self.finals: asyncio.Queue[TranscriptEvent] = asyncio.Queue()
+        self._reset_utterance()
+
+    def _reset_utterance(self):
+        self._frames: list[np.ndarray] = []
+        self._samples = 0
+        self._voiced_end = 0
+        self._partial_task: Optional[asyncio.Task] = None
+        self._partial_task_end = 0
+        # latest finished hypothesis and the number of samples it covers
+        self._hypothesis = ''
+        self._hypothesis_end = 0
+        self._emitted_words = 0
+
+    async def feed(self, audio: bytes) -> list[TranscriptEvent]:
+        """Add PCM frames, returns the partial transcripts available now."""
+        events = []
+        # finals finish in order, the done ones are at the front
+        while self._final_tasks and self._final_tasks[0].done():
+            self._final_tasks.popleft()
+        audio = pcm16_to_float32(audio, self.sample_rate, self.channels)
+        if len(self._pending):
+            audio = np.concatenate([self._pending, audio])
+        frame_count = len(audio) // FRAME_SAMPLES
+        self._pending = audio[frame_count * FRAME_SAMPLES:]
+        for frame in audio[:frame_count * FRAME_SAMPLES].reshape(-1, FRAME_SAMPLES):
+            state = self.vad.update(frame)
+            if state == 'start':
+                self._frames = list(self._preroll)
+                self._samples = len(self._frames) * FRAME_SAMPLES
+                self._preroll.clear()
+            elif not self.vad.speaking and state != 'end':
+                self._preroll.append(frame)
+                continue
+            self._frames.append(frame)
+            self._samples += FRAME_SAMPLES
+            if self.vad.voiced:
+                self._voiced_end = self._samples
+            if state == 'end' or self._samples >= config.max_utterance * SAMPLE_RATE:
+                self._start_final()
+        if self.vad.speaking and self._frames:
+            # partials of the next utterance wait for the final transcript of the previous one
+            if not self._final_tasks:
+                events.extend(self._collect_partial())
+            self._schedule_partial()
+        return events
+
+    def flush(self):
+        """End the current utterance without waiting for the silence after it."""
+        if self.vad.speaking and self._frames:
+            self.vad.speaking = False
+            self._start_final()
+
+    async def close(self):
+        await self._cancel_partial()
+        for task in self._final_tasks:
+            task.cancel()
+        self._final_tasks.clear()
+        self._reset_utterance()
+
+    async def transcribe(self, audio: np.ndarray) -> str:
+        return (await self.speech_to_text.atranscribe(
+            float32_to_pcm16(audio), platform='terminal', prompt=self.prompt,
+            language=self.language, sample_rate=SAMPLE_RATE, channels=1)).strip()
+
+    def _schedule_partial(self):
+        if self._partial_task is not None:
+            return
+        paused = not self.vad.voiced and self._partial_task_end < self._voiced_end
+        new_samples = self._samples - self._partial_task_end
+        if paused or new_samples >= config.partial_interval * SAMPLE_RATE:
+            self._partial_task_end = self._samples
+            self._partial_task = asyncio.create_task(
+                self.transcribe(np.concatenate(self._frames)))
+
+    def _collect_partial(self) -> list[TranscriptEvent]:
+        task = self._partial_task
+        if task is None or not task.done():
+            return []
+        self._partial_task = None
+        if task.cancelled() or task.exception() is not None:
+            return []
+        previous, self._hypothesis = self._hypothesis, task.result()
+        self._hypothesis_end = self._partial_task_end
+        words = stable_words(previous, self._hypothesis)
+        if len(words) <= self._emitted_words:
+            return []
+        new_words = ' '.join(words[self._emitted_words:])
+        prefix = ' ' if self._emitted_words else ''
+        self._emitted_words = len(words)
+        return [TranscriptEvent(text=prefix + new_words, is_final=False)]
+
+    def _start_final(self):
+        previous = self._final_tasks[-1] if self._final_tasks else None
+        self._final_tasks.append(asyncio.create_task(self._finalize(
+            previous, self._frames, self._voiced_end, self._partial_task,
+            self._partial_task_end, self._hypothesis, self._hypothesis_end)))
+        # the next frames start a new utterance right away
+        self._reset_utterance()
+
+    async def _finalize(self, previous: Optional[asyncio.Task], *args):
+        try:
+            event = await self._final_transcript(*args)
+        except Exception as e:
+            logger.error(f'Final transcription failed: {e}')
+            event = None
+        if previous is not None:
+            # deliver the finals in the order of the utterances
+            await asyncio.wait([previous])
+        if event is not None:
+            self.finals.put_nowait(event)
+
+    async def _final_transcript(self, frames: list[np.ndarray], voiced_end: int,
+                        partial_task: Optional[asyncio.Task], partial_task_end: int,
+                        hypothesis: str, hypothesis_end: int) -> Optional[TranscriptEvent]:
+        # reuse the background hypothesis when it already covers every voiced frame
+        if partial_task is not None:
+            if partial_task_end >= voiced_end:
+                with suppress(Exception):
+                    hypothesis, hypothesis_end = await partial_task, partial_task_end
+            else:
+                partial_task.cancel()
+        if hypothesis_end >= voiced_end and hypothesis_end:
+            text = hypothesis
+        else:
+            text = await self.transcribe(np.concatenate(frames))
+        if not text:
+            return None
+        return TranscriptEvent(text=text, is_final=True)
+
+    async def _cancel_partial(self):
+        task = self._partial_task
+        self._partial_task = None
+        if task is not None and not task.done():
+            task.cancel()
+            with suppress(asyncio.CancelledError, Exception):
+                await task
@@ -3,13 +3,20 @@ import os
 import types
 import wave
 
+import av
+import numpy as np
 import speech_recognition as sr
 from faster_whisper import WhisperModel
 from pydub import AudioSegment
 from torch.cuda import is_available as is_cuda_available
 
 from realtime_ai_character.audio.speech_to_text.base import SpeechToText
+from realtime_ai_character.audio.speech_to_text.pcm import (
+    SAMPLE_RATE, downmix_pcm16, pcm16_to_float32)
+from realtime_ai_character.audio.speech_to_text.scheduler import (
+    TranscriptionRejected, TranscriptionScheduler, config as scheduler_config)
 from realtime_ai_character.logger import get_logger
+from realtime_ai_character.tracing import get_metrics
 from realtime_ai_character.utils import Singleton, timed
 
 DEBUG = False
@@ -20,6 +27,8 @@ config = types.SimpleNamespace(**{
     'model': os.getenv("LOCAL_WHISPER_MODEL", "base"),
     'language': 'en',
     'api_key': os.getenv("OPENAI_API_KEY"),
+    # threads used by each model worker on CPU, 0 lets CTranslate2 decide
+    'cpu_threads': int(os.getenv("WHISPER_CPU_THREADS", 0)),
 })
 
 # Whisper use a shorter version for language code. Provide a mapping to convert
@@ -38,6 +47,34 @@ WHISPER_LANGUAGE_CODE_MAPPING = {
     'ko-KR': 'ko',
 }
 
+# 将webm解码为16kHz单声道float32数组,在进程内用PyAV解码,不启动ffmpeg子进程也不生成中间wav
+def decode_webm(webm_data: bytes) -> np.ndarray:
+    resampler = av.audio.resampler.AudioResampler(format="flt", layout="mono",
+                                                  rate=SAMPLE_RATE)
+    chunks = []
+    with av.open(io.BytesIO(webm_data), metadata_errors="ignore") as container:
+        packets = container.demux(audio=0)
+        while True:
+            try:
+                packet = next(packets)
+            except StopIteration:
+                break
+            except av.error.InvalidDataError:
+                break  # stop at a damaged container, e.g. a truncated last cluster
+            try:
+                frames = packet.decode()
+            except av.error.InvalidDataError:
+                continue  # skip a corrupted packet, the following ones still decode
+            for frame in frames:
+                frame.pts = None
+                chunks.extend(f.to_ndarray().reshape(-1) for f in resampler.resample(frame))
+    # flush the samples buffered by the resampler
+    chunks.extend(f.to_ndarray().reshape(-1) for f in resampler.resample(None))
+    if not chunks:
+        return np.zeros(0, dtype=np.float32)
+    return np.concatenate(chunks)
+
+
 # 创建一个class to transcribe speech to text using the Whisper model.
 class Whisper(Singleton, SpeechToText): 
     
@@ -52,10 +89,15 @@ class Whisper(Singleton, SpeechToText):
                 model_size_or_path=config.model,
                 device="auto",
                 download_root=None,
+                cpu_threads=config.cpu_threads,
+                # one model worker per scheduler slot so concurrent calls run in parallel
+                num_workers=scheduler_config.workers,
             )                                                   
                                                              
         self.recognizer = sr.Recognizer()      # 初始化语音识别器 speech_recognition库中的 Recognizer 类，用于语音识别
         self.use = use                           # use which model:local or api
+        self.scheduler = TranscriptionScheduler(self.transcribe)  # 转录请求的有界工作池
+        get_metrics().register_stats('stt', self.scheduler.stats)
         
         if DEBUG:                                   # 如果是debug模式
             self.wf = wave.open("output.wav", "wb")
@@ -67,17 +109,34 @@ class Whisper(Singleton, SpeechToText):
     # 定义transcribe方法，将语音转为文本,参数有 audio_bytes转录的语音数据的字节, platform默认的平台是web, prompt提示,默认空, 
     # language默认的语言是en-US suppress_tokens: a list of tokens to suppress from the transcription;
    
-    def transcribe(self, audio_bytes, platform, prompt="", language="en-US", suppress_tokens=[-1]):
+    def transcribe(self, audio_bytes, platform, prompt="", language="en-US", suppress_tokens=[-1],
+                   sample_rate=44100, channels=1):
         logger.info("Transcribing audio...") # 记录日志
-        if platform == "web": # web平台
-            audio = self._convert_webm_to_wav(audio_bytes, self.use == "local") # 将webm格式的音频转换为wav格式
-        else: 
-            audio = self._convert_bytes_to_wav(audio_bytes, self.use == "local") 
+        if platform == "web" and self.use == "local": # web平台, 直接在内存中解码为模型需要的数组
+            audio = decode_webm(audio_bytes)
+        elif platform == "web":
+            audio = self._convert_webm_to_wav(audio_bytes, local=False) # 将webm格式的音频转换为wav格式
+        elif self.use == "local": # 原始PCM直接转换为模型需要的数组
+            audio = self._convert_pcm(audio_bytes, sample_rate, channels)
+        else:
+            audio = self._convert_bytes_to_wav(audio_bytes, sample_rate, channels)
         if self.use == "local": # local模式
             return self._transcribe(audio, prompt, suppress_tokens=suppress_tokens) # transcribe Audio using local model
         elif self.use == "api": # api模式
             return self._transcribe_api(audio, prompt) # transcribe Audio using API
 
+    async def atranscribe(self, audio_bytes, platform="web", prompt="", language="en-US",
+                          suppress_tokens=[-1], sample_rate=44100, channels=1) -> str:
+        # 通过调度器排队转录, 队列满或超时则丢弃该请求
+        try:
+            return await self.scheduler.submit(audio_bytes, platform, prompt=prompt,
+                                               language=language,
+                                               suppress_tokens=suppress_tokens,
+                                               sample_rate=sample_rate, channels=channels)
+        except TranscriptionRejected as e:
+            logger.warning(f"Dropped transcription request: {e}")
+            return ""
+
 #transcribe Audio using local whisper model,参数有 audio转录的语音数据, prompt提示,默认空, language默认的语言是en-US 
 # suppress_tokens: a list of tokens to suppress from the transcription; return:转成文本
     def _transcribe(self, audio, prompt="", language="en-US", suppress_tokens=[-1]):
@@ -108,9 +167,10 @@ class Whisper(Singleton, SpeechToText):
         with sr.AudioFile(wav_data) as source:  # 记录音频
             audio = self.recognizer.record(source)  
         return audio 
-#将bytes转换为wav格式,参数有 audio_bytes转录的语音数据, return:wav格式的音频
-    def _convert_bytes_to_wav(self, audio_bytes, local=True):
-        if local:
-            audio = io.BytesIO(sr.AudioData(audio_bytes, 44100, 2).get_wav_data()) 
-            return audio
-        return sr.AudioData(audio_bytes, 44100, 2) # 创建一个AudioData对象
\ No newline at end of file
+# 将16位PCM转换为16kHz单声道float32数组,参数有 audio_bytes原始PCM数据, sample_rate采样率, channels声道数
+    def _convert_pcm(self, audio_bytes, sample_rate=44100, channels=1) -> np.ndarray:
+        return pcm16_to_float32(audio_bytes, sample_rate, channels)
+#将bytes转换为AudioData,用于whisper API,参数有 audio_bytes转录的语音数据, return:AudioData
+    def _convert_bytes_to_wav(self, audio_bytes, sample_rate=44100, channels=1):
+        # AudioData只支持单声道,先混合为单声道
+        return sr.AudioData(downmix_pcm16(audio_bytes, channels), sample_rate, 2) # 创建一个AudioData对象
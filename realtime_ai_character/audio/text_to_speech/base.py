@@ -1,14 +1,142 @@
+import asyncio
+import os
+import types
 from abc import ABC, abstractmethod #导入 abc 模块中的Abstract Base Class module,抽象基类模块
+from contextlib import asynccontextmanager, suppress
+from typing import AsyncIterator, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from realtime_ai_character.logger import get_logger
 from realtime_ai_character.utils import timed #从realtime_ai_character.utils中导入timed decorator
 
+logger = get_logger(__name__)
+
+# Connection pool settings shared by every text to speech engine.
+http_config = types.SimpleNamespace(**{
+    'max_connections': int(os.getenv('TTS_HTTP_MAX_CONNECTIONS', 100)),
+    'max_keepalive_connections': int(os.getenv('TTS_HTTP_MAX_KEEPALIVE_CONNECTIONS', 20)),
+    'max_connections_per_host': int(os.getenv('TTS_HTTP_MAX_CONNECTIONS_PER_HOST', 20)),
+    'keepalive_expiry': float(os.getenv('TTS_HTTP_KEEPALIVE_EXPIRY', 60)),
+    'timeout': float(os.getenv('TTS_HTTP_TIMEOUT', 30)),
+    'connect_timeout': float(os.getenv('TTS_HTTP_CONNECT_TIMEOUT', 5)),
+    'http2': os.getenv('TTS_HTTP2', 'true').lower() in ('true', '1'),
+})
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
 #定义ABC for TextToSpeech功能,子类继承时重写方法
 # 定义TextToSpeech类，该类是抽象类，用于生成音频
-class TextToSpeech(ABC): 
-    
+class TextToSpeech(ABC):
+    # Process-wide pooled HTTP client, shared by all engines so that every sentence
+    # reuses a warm TCP/TLS connection to the vendor instead of opening a new one.
+    _http_client: Optional[httpx.AsyncClient] = None
+    _host_semaphores: dict[str, asyncio.Semaphore] = {}
+
+    @classmethod
+    def get_http_client(cls) -> httpx.AsyncClient:
+        """Return the shared async HTTP client, creating it on first use."""
+        client = TextToSpeech._http_client
+        if client is None or client.is_closed:
+            http2 = http_config.http2 and _http2_available()
+            logger.info(f"Creating pooled TTS HTTP client (http2={http2})")
+            client = httpx.AsyncClient(
+                http2=http2,
+                limits=httpx.Limits(
+                    max_connections=http_config.max_connections,
+                    max_keepalive_connections=http_config.max_keepalive_connections,
+                    keepalive_expiry=http_config.keepalive_expiry,
+                ),
+                timeout=httpx.Timeout(http_config.timeout,
+                                      connect=http_config.connect_timeout),
+            )
+            TextToSpeech._http_client = client
+            TextToSpeech._host_semaphores = {}
+        return client
+
+    @classmethod
+    async def close_http_client(cls) -> None:
+        """Close the shared HTTP client. Called on application shutdown."""
+        client = TextToSpeech._http_client
+        TextToSpeech._http_client = None
+        TextToSpeech._host_semaphores = {}
+        if client is not None and not client.is_closed:
+            await client.aclose()
+
+    @classmethod
+    def _host_semaphore(cls, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc
+        if host not in TextToSpeech._host_semaphores:
+            TextToSpeech._host_semaphores[host] = asyncio.Semaphore(
+                http_config.max_connections_per_host)
+        return TextToSpeech._host_semaphores[host]
+
+    @asynccontextmanager
+    async def http_stream(self, method: str, url: str, **kwargs):
+        """Open a streaming request on the shared client, capped per vendor host."""
+        client = self.get_http_client()
+        async with self._host_semaphore(url):
+            async with client.stream(method, url, **kwargs) as response:
+                yield response
+
+    async def http_request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Send a buffered request on the shared client, capped per vendor host."""
+        client = self.get_http_client()
+        async with self._host_semaphore(url):
+            return await client.request(method, url, **kwargs)
+
+    async def forward_audio(self, chunks: AsyncIterator[bytes], websocket,
+                            tts_event: asyncio.Event, chunk_size: int) -> None:
+        """
+        Forward streamed audio to the websocket as fast as the socket accepts it.
+
+        The first chunk is sent as soon as it arrives to keep first-audio latency low,
+        later chunks are coalesced up to `chunk_size` bytes per frame. Barge-in is
+        handled by racing `tts_event` against the next chunk, so a set event stops the
+        stream immediately instead of after the next read.
+        """
+        iterator = chunks.__aiter__()
+        stop = asyncio.ensure_future(tts_event.wait())
+        next_chunk = None
+        buffer = bytearray()
+        first_chunk = True
+        try:
+            while True:
+                next_chunk = asyncio.ensure_future(iterator.__anext__())
+                await asyncio.wait({next_chunk, stop}, return_when=asyncio.FIRST_COMPLETED)
+                if stop.done():
+                    # stop streaming audio
+                    next_chunk.cancel()
+                    with suppress(asyncio.CancelledError, StopAsyncIteration):
+                        await next_chunk
+                    return
+                try:
+                    buffer.extend(next_chunk.result())
+                except StopAsyncIteration:
+                    break
+                if first_chunk or len(buffer) >= chunk_size:
+                    await websocket.send_bytes(bytes(buffer))
+                    buffer.clear()
+                    first_chunk = False
+            if buffer and not tts_event.is_set():
+                await websocket.send_bytes(bytes(buffer))
+        finally:
+            stop.cancel()
+            if next_chunk is not None and not next_chunk.done():
+                next_chunk.cancel()
+
     # 定义一个抽象方法，用于 streaming aduio and generate aduio
     @abstractmethod
     @timed
-    async def stream(self, *args, **kwargs): 
+    async def stream(self, *args, **kwargs):
         pass
 
     async def generate_audio(self,  *args, **kwargs):
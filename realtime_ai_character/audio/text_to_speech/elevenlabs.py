@@ -1,7 +1,6 @@
 import asyncio
 import os
 import types
-import httpx
 
 from realtime_ai_character.logger import get_logger
 from realtime_ai_character.utils import Singleton, timed
@@ -16,7 +15,7 @@ ELEVEN_LABS_MULTILINGUAL_MODEL = 'eleven_multilingual_v2' if os.getenv(
     'false').lower() in ('true', '1') else 'eleven_multilingual_v1'
 
 config = types.SimpleNamespace(**{
-    'chunk_size': 1024,
+    'chunk_size': int(os.getenv('TTS_CHUNK_SIZE', 4096)),
     'url': 'https://api.elevenlabs.io/v1/text-to-speech/{voice_id}/stream',
     'headers': {
         'Accept': 'audio/mpeg',
@@ -57,17 +56,13 @@ class ElevenLabs(Singleton, TextToSpeech):
         url = config.url.format(voice_id=voice_id)
         if first_sentence:
             url = url + '?optimize_streaming_latency=4'
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, json=data, headers=headers)
+        async with self.http_stream('POST', url, json=data, headers=headers) as response:
             if response.status_code != 200:
                 logger.error(
                     f"ElevenLabs returns response {response.status_code}")
-            async for chunk in response.aiter_bytes():
-                await asyncio.sleep(0.1)
-                if tts_event.is_set():
-                    # stop streaming audio
-                    break
-                await websocket.send_bytes(chunk)
+                return
+            await self.forward_audio(response.aiter_bytes(), websocket, tts_event,
+                                     config.chunk_size)
 
     async def generate_audio(self, text, voice_id = "", language='en-US') -> bytes:
         if DEBUG:
@@ -84,9 +79,8 @@ class ElevenLabs(Singleton, TextToSpeech):
         }
         # Change to non-streaming endpoint
         url = config.url.format(voice_id=voice_id).replace('/stream', '')
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, json=data, headers=headers)
-            if response.status_code != 200:
-                logger.error(f"ElevenLabs returns response {response.status_code}")
-            # Get audio/mpeg from the response and return it
-            return response.content
+        response = await self.http_request('POST', url, json=data, headers=headers)
+        if response.status_code != 200:
+            logger.error(f"ElevenLabs returns response {response.status_code}")
+        # Get audio/mpeg from the response and return it
+        return response.content
@@ -1,7 +1,6 @@
 import asyncio
 import os
 import types
-import httpx
 import base64
 from google.oauth2 import service_account
 import google.auth.transport.requests
@@ -77,16 +76,15 @@ class GoogleCloudTTS(Singleton, TextToSpeech):
             if voice_id == "en-US-Studio-O":
                 data["voice"]["ssmlGender"] = 'FEMALE'
         url = config.url
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, json=data, headers=headers)
-            # Google Cloud TTS API does not support streaming, we send the whole content at once
-            if response.status_code != 200:
-                logger.error(f"Google Cloud TTS returns response {response.status_code}")
-            else:
-                audio_content = response.content
-                # Decode the base64-encoded audio content
-                audio_content = base64.b64decode(audio_content)
-                await websocket.send_bytes(audio_content)
+        response = await self.http_request('POST', url, json=data, headers=headers)
+        # Google Cloud TTS API does not support streaming, we send the whole content at once
+        if response.status_code != 200:
+            logger.error(f"Google Cloud TTS returns response {response.status_code}")
+        else:
+            audio_content = response.content
+            # Decode the base64-encoded audio content
+            audio_content = base64.b64decode(audio_content)
+            await websocket.send_bytes(audio_content)
 
 
     async def generate_audio(self, text, voice_id = "", language='en-US') -> bytes:
@@ -107,12 +105,11 @@ class GoogleCloudTTS(Singleton, TextToSpeech):
             data["voice"]["name"] = voice_id
             if voice_id == "en-US-Studio-O":
                 data["voice"]["ssmlGender"] = 'FEMALE'
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, json=data, headers=headers)
-            if response.status_code != 200:
-                logger.error(f"Google Cloud TTS returns response {response.status_code}")
-            else:
-                audio_content = response.content
-                # Decode the base64-encoded audio content
-                audio_content = base64.b64decode(audio_content)
-                return audio_content
+        response = await self.http_request('POST', url, json=data, headers=headers)
+        if response.status_code != 200:
+            logger.error(f"Google Cloud TTS returns response {response.status_code}")
+        else:
+            audio_content = response.content
+            # Decode the base64-encoded audio content
+            audio_content = base64.b64decode(audio_content)
+            return audio_content
@@ -0,0 +1,176 @@
+# Split a streamed LLM reply into chunks that can be sent to text to speech as soon as possible.
+import os
+import types
+
+config = types.SimpleNamespace(**{
+    # chunks shorter than this are merged into the following text
+    'min_chars': int(os.getenv('TTS_SEGMENT_MIN_CHARS', 2)),
+    # chunks are force split (at a clause break or space) once they reach this length
+    'max_chars': int(os.getenv('TTS_SEGMENT_MAX_CHARS', 300)),
+    # the first chunk may end at a clause break once it reaches this length
+    'first_min_chars': int(os.getenv('TTS_SEGMENT_FIRST_MIN_CHARS', 24)),
+    # the first chunk is force split once it reaches this length
+    'first_max_chars': int(os.getenv('TTS_SEGMENT_FIRST_MAX_CHARS', 80)),
+})
+
+# Terminators that only end a sentence when followed by whitespace (or the end of the reply).
+TERMINATORS = '.!?'
+# CJK terminators end a sentence immediately, no whitespace follows them.
+CJK_TERMINATORS = '。！？…｡'
+CLAUSE_BREAKS = ',;:'
+CJK_CLAUSE_BREAKS = '，、；：'
+# Closing quotes and brackets that belong to the sentence they follow.
+CLOSERS = '"\'”’)」』》）'
+# Emotion cues such as [pauses] are never split.
+CUE_OPEN, CUE_CLOSE = '[', ']'
+
+ABBREVIATIONS = {
+    'mr', 'mrs', 'ms', 'dr', 'prof', 'sr', 'jr', 'st', 'mt', 'vs', 'etc', 'e.g', 'i.e',
+    'inc', 'ltd', 'co', 'corp', 'no', 'vol', 'fig', 'approx', 'dept', 'u.s', 'u.k', 'a.m',
+    'p.m',
+}
+
+
+def _is_cjk(char: str) -> bool:
+    return ('぀' <= char <= 'ヿ' or '㐀' <= char <= '鿿'
+            or '가' <= char <= '힯' or '＀' <= char <= '￯')
+
+
+class SentenceSegmenter:
+    """
+    Incremental sentence segmenter for streamed tokens.
+
+    Tokens are fed one by one and complete chunks are returned as soon as their end is
+    known. Handles punctuation glued to words, CJK punctuation, ellipses, newlines,
+    abbreviations ("Mr."), decimal numbers ("3.5") and emotion cues ("[pauses]"). The
+    first chunk of a reply is allowed to end at a clause break so audio starts early.
+    """
+
+    def __init__(self, min_chars: int = config.min_chars, max_chars: int = config.max_chars,
+                 first_min_chars: int = config.first_min_chars,
+                 first_max_chars: int = config.first_max_chars):
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self.first_min_chars = first_min_chars
+        self.first_max_chars = first_max_chars
+        self.is_first_chunk = True
+        self._buffer = ''
+        self._reset_scan()
+
+    def feed(self, token: str) -> list[str]:
+        """Add a token and return the chunks completed by it."""
+        self._buffer += token
+        return self._drain(final=False)
+
+    def flush(self) -> list[str]:
+        """Return all remaining text as chunks at the end of the reply."""
+        chunks = self._drain(final=True)
+        rest = self._buffer.strip()
+        self._buffer = ''
+        self._reset_scan()
+        if rest:
+            chunks.append(rest)
+        return chunks
+
+    def _reset_scan(self):
+        # The buffer is scanned incrementally, each character is inspected once
+        # unless its meaning depends on a character that has not arrived yet.
+        self._scan_pos = 0
+        self._cue_depth = 0
+        self._clause_end = None
+        self._space_end = None
+
+    def _drain(self, final: bool) -> list[str]:
+        chunks = []
+        while True:
+            end = self._find_end(final)
+            if end is None:
+                return chunks
+            chunk = self._buffer[:end].strip()
+            self._buffer = self._buffer[end:].lstrip()
+            self._reset_scan()
+            if chunk:
+                chunks.append(chunk)
+                self.is_first_chunk = False
+
+    def _find_end(self, final: bool):
+        """Return the end index of the next complete chunk in the buffer, if any."""
+        buffer = self._buffer
+        i = self._scan_pos
+        while i < len(buffer):
+            char = buffer[i]
+            if char == CUE_OPEN:
+                self._cue_depth += 1
+            elif char == CUE_CLOSE:
+                self._cue_depth = max(0, self._cue_depth - 1)
+            elif self._cue_depth:
+                pass
+            elif char == '\n':
+                if self._long_enough(i):
+                    return i + 1
+            elif char in CJK_TERMINATORS:
+                end = self._skip_closers(i + 1, CJK_TERMINATORS)
+                if self._long_enough(end):
+                    return end
+                i = end
+                continue
+            elif char in TERMINATORS:
+                end = self._skip_closers(i + 1, TERMINATORS)
+                if end == len(buffer) and not final:
+                    # the next character decides, e.g. "3." + "5" or "Hi." + " there",
+                    # unless the buffer is already too long to wait for it
+                    self._scan_pos = i
+                    return self._force_split()
+                if ((end == len(buffer) or buffer[end].isspace() or _is_cjk(buffer[end]))
+                        and not self._is_abbreviation(i) and self._long_enough(end)):
+                    return end
+                i = end
+                continue
+            elif char in CLAUSE_BREAKS or char in CJK_CLAUSE_BREAKS:
+                end = i + 1
+                if char in CLAUSE_BREAKS:
+                    if end == len(buffer) and not final:
+                        self._scan_pos = i
+                        return self._force_split()
+                    if end < len(buffer) and not buffer[end].isspace():
+                        # e.g. "1,000" or "12:30"
+                        i = end
+                        continue
+                self._clause_end = end
+                if self.is_first_chunk and end >= self.first_min_chars:
+                    return end
+            elif char.isspace():
+                self._space_end = i
+            i += 1
+        self._scan_pos = i
+        return self._force_split()
+
+    def _force_split(self):
+        limit = self.first_max_chars if self.is_first_chunk else self.max_chars
+        if len(self._buffer) < limit:
+            return None
+        for end in (self._clause_end, self._space_end):
+            if end and self._long_enough(end):
+                return end
+        return limit
+
+    def _skip_closers(self, i: int, terminators: str) -> int:
+        while i < len(self._buffer) and (self._buffer[i] in terminators
+                                         or self._buffer[i] in CLOSERS):
+            i += 1
+        return i
+
+    def _long_enough(self, end: int) -> bool:
+        return len(self._buffer[:end].strip()) >= self.min_chars
+
+    def _is_abbreviation(self, i: int) -> bool:
+        """Whether the '.' at index i ends an abbreviation or an initial rather than a sentence."""
+        if self._buffer[i] != '.' or self._buffer[i + 1:i + 2] == '.':
+            return False
+        start = i
+        while start > 0 and (self._buffer[start - 1].isalpha() or self._buffer[start - 1] == '.'):
+            start -= 1
+        word = self._buffer[start:i]
+        if len(word) == 1 and word.isupper() and word != 'I':
+            return True
+        return word.lower() in ABBREVIATIONS
@@ -1,6 +1,6 @@
 import asyncio
+import os
 import types
-import httpx
 
 from realtime_ai_character.logger import get_logger
 from realtime_ai_character.utils import Singleton, timed
@@ -11,7 +11,7 @@ logger = get_logger(__name__)
 DEBUG = False
 
 config = types.SimpleNamespace(**{
-    'chunk_size': 1024,
+    'chunk_size': int(os.getenv('TTS_CHUNK_SIZE', 4096)),
     'url': 'https://lab.api.unrealspeech.com/stream',
     'headers': {
         'Accept': 'audio/mpeg',
@@ -39,17 +39,13 @@ class UnrealSpeech(Singleton, TextToSpeech):
             **config.data,
         }
 
-        async with httpx.AsyncClient() as client:
-            response = await client.get(config.url, params=params)
+        async with self.http_stream('GET', config.url, params=params) as response:
             if response.status_code != 200:
                 logger.error(
                     f"Unreal Speech returns response {response.status_code}")
-            async for chunk in response.aiter_bytes():
-                await asyncio.sleep(0.1)
-                if tts_event.is_set():
-                    # stop streaming audio
-                    break
-                await websocket.send_bytes(chunk)
+                return
+            await self.forward_audio(response.aiter_bytes(), websocket, tts_event,
+                                     config.chunk_size)
 
     async def generate_audio(self, text, voice_id=5, *args, **kwargs) -> bytes:
         params = {
@@ -58,10 +54,8 @@ class UnrealSpeech(Singleton, TextToSpeech):
             **config.data,
         }
 
-        async with httpx.AsyncClient() as client:
-            response = await client.get(config.url, params=params)
-            if response.status_code != 200:
-                logger.error(
-                    f"Unreal Speech returns response {response.status_code}")
-            audio_bytes = await response.aread()
-            return audio_bytes
+        response = await self.http_request('GET', config.url, params=params)
+        if response.status_code != 200:
+            logger.error(
+                f"Unreal Speech returns response {response.status_code}")
+        return response.content
@@ -3,21 +3,25 @@
 # there are several methods in the class, the most important one is load_characters, which is used to load characters from the character_catalog directory
 # the load_characters_from_community method is used to load characters from the community directory
 # catalogmanager uses several external libraries
+import hashlib
 import os
 import threading
 import time
 import yaml
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from contextlib import ExitStack
 
 from dotenv import load_dotenv
 from firebase_admin import auth
 from llama_index import SimpleDirectoryReader
+from langchain.schema import Document
 from langchain.text_splitter import CharacterTextSplitter
 
 from realtime_ai_character.logger import get_logger
 from realtime_ai_character.utils import Singleton, Character
-from realtime_ai_character.database.chroma import get_chroma
+from realtime_ai_character.database.chroma import get_chroma, get_chroma_collection
 from readerwriterlock import rwlock
 from realtime_ai_character.database.connection import get_db
 from realtime_ai_character.models.character import Character as CharacterModel
@@ -25,6 +29,10 @@ from realtime_ai_character.models.character import Character as CharacterModel
 load_dotenv()
 logger = get_logger(__name__)
 
+# chunks embedded per request, and number of embedding requests in flight during ingestion
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', 256))
+EMBEDDING_CONCURRENCY = int(os.getenv('EMBEDDING_CONCURRENCY', 4))
+
 
 # catalogmanager is a singleton class that is used to manage character catalog;
 # it can load characters from the character_catalog directory; 
@@ -37,27 +45,31 @@ logger = get_logger(__name__)
 #sql_load_lock: A reader-writer lock used to synchronize access to the SQL database.
 #characters: A dictionary of characters, index keyed by character ID.
 #author_name_cache: A dictionary of author names, index keyed by author ID.
+#data_paths: A dictionary of character data directories, index keyed by character name.
 class CatalogManager(Singleton): 
     #create a singleton instance of the class
-    #Args: overwrite: if True, overwrite existing data in the chroma.
-    def __init__(self, overwrite=True):   
+    #Args: overwrite: if True, (re)load character data into the chroma.
+    #      incremental: if True, only embed changed chunks instead of rebuilding the chroma.
+    def __init__(self, overwrite=True, incremental=True):
         super().__init__()
         self.db = get_chroma() 
         self.sql_db = next(get_db())
         self.sql_load_interval = 30
         self.sql_load_lock = rwlock.RWLockFair()
-        #如果overwrite为True,则删除chroma中的所有数据
-        if overwrite:
+        #如果overwrite为True且不是增量模式,则删除chroma中的所有数据
+        if overwrite and not incremental:
             logger.info('Overwriting existing data in the chroma.')
             self.db.delete_collection()
             self.db = get_chroma()
         # create a dictionary of characters
         self.characters = {}
         self.author_name_cache = {}  
+        self.data_paths = {}
         self.load_characters_from_community(overwrite)    # load characters from the community directory
         self.load_characters(overwrite)                   
-      # 如果overwrite为True,则将数据persist到chroma中
+      # 如果overwrite为True,则将数据同步并persist到chroma中
         if overwrite:
+            self.sync_data()
             logger.info('Persisting data in the chroma.')
             self.db.persist()
         logger.info(
@@ -127,8 +139,7 @@ class CatalogManager(Singleton):
         for directory in directories:   
             character_name = self.load_character(directory) # load the character from the directory
             if overwrite:                                    # if overwrite is True       
-                self.load_data(character_name, directory / 'data')  # load data for the character
-                logger.info('Loaded data for character: ' + character_name) # log the message and the character name
+                self.data_paths[character_name] = directory / 'data'  # sync data for the character
         logger.info(
             f'Loaded {len(self.characters)} characters: IDs {list(self.characters.keys())}')   #load the number of characters and their ids
     # load characters from the community directory
@@ -161,10 +172,9 @@ class CatalogManager(Singleton):
                 self.characters[character_id].avatar_id = yaml_content["avatar_id"]
 
             if overwrite:
-                self.load_data(character_name, directory / 'data')
-                logger.info('Loaded data for character: ' + character_name)
-   # add a new character to the catalog
-    def load_data(self, character_name: str, data_path: str): 
+                self.data_paths[character_name] = directory / 'data'
+    # split the data of a character into chunks, each chunk is identified by its content hash
+    def load_data(self, character_name: str, data_path: str) -> list[Document]:
         loader = SimpleDirectoryReader(Path(data_path))
         documents = loader.load_data()
         text_splitter = CharacterTextSplitter(
@@ -177,7 +187,119 @@ class CatalogManager(Singleton):
                 'character_name': character_name,
                 'id': d.id_,
             } for d in documents])
-        self.db.add_documents(docs)
+        for doc in docs:
+            doc.metadata['hash'] = hashlib.sha256(
+                f'{character_name}\0{doc.page_content}'.encode()).hexdigest()
+        return docs
+
+    def sync_data(self):
+        """
+        Bring the chroma in line with the data directories in self.data_paths.
+
+        Chunks are stored with their content hash as id, so only new or changed chunks are
+        embedded and chunks of removed files are deleted. Every chunk also records a hash of
+        its whole data directory, characters whose data did not change are skipped without
+        reading or splitting their files. The hash is only written once every new chunk of
+        the character is stored, so a character whose embedding failed or was interrupted is
+        synced again next time.
+        """
+        start = time.perf_counter()
+        existing = self.db.get(include=['metadatas'])
+        indexed = defaultdict(dict)  # character name -> {chunk id: data directory hash}
+        for chunk_id, metadata in zip(existing['ids'], existing['metadatas']):
+            indexed[metadata.get('character_name')][chunk_id] = metadata.get('data_hash')
+
+        # chunks of characters which no longer have a data directory
+        stale_ids = [chunk_id for character_name in indexed.keys() - self.data_paths.keys()
+                     for chunk_id in indexed[character_name]]
+        reused, unchanged = 0, 0
+        changed = {}  # character name -> (data path, data directory hash)
+        for character_name, data_path in self.data_paths.items():
+            data_hash = hash_directory(data_path)
+            current = indexed.get(character_name, {})
+            if current and all(h == data_hash for h in current.values()):
+                reused += len(current)
+                unchanged += 1
+            else:
+                changed[character_name] = (data_path, data_hash)
+
+        # read and split the changed characters in parallel
+        with ThreadPoolExecutor(max_workers=EMBEDDING_CONCURRENCY) as pool:
+            loaded = pool.map(lambda item: self.load_data(item[0], item[1][0]), changed.items())
+            new_docs = []
+            character_chunks = {}  # character name -> {chunk id: chunk} of its data
+            for character_name, character_docs in zip(changed, loaded):
+                current = indexed.get(character_name, {})
+                docs = character_chunks[character_name] = {}
+                for doc in character_docs:
+                    docs.setdefault(doc.metadata['hash'], doc)  # drop duplicated chunks
+                stale_ids.extend(chunk_id for chunk_id in current if chunk_id not in docs)
+                # chunks already stored only need the new directory hash, no need to embed them
+                kept = sum(1 for chunk_id in docs if chunk_id in current)
+                character_new_docs = [doc for chunk_id, doc in docs.items()
+                                      if chunk_id not in current]
+                new_docs.extend(character_new_docs)
+                reused += kept
+                logger.info(f'Loaded data for character: {character_name} '
+                            f'({len(character_new_docs)} new chunks, {kept} reused)')
+
+        # new chunks are stored without the directory hash
+        written = self.add_documents(new_docs)
+        added = len(written)
+        collection = get_chroma_collection(self.db)
+        for character_name, docs in character_chunks.items():
+            if any(chunk_id not in written and chunk_id not in indexed.get(character_name, {})
+                   for chunk_id in docs):
+                logger.error(f'Data of character {character_name} is incomplete, '
+                             f'it will be synced again on the next start')
+                continue
+            data_hash = changed[character_name][1]
+            collection.update(
+                ids=list(docs),
+                metadatas=[{**doc.metadata, 'data_hash': data_hash} for doc in docs.values()])
+
+        if stale_ids:
+            self.db.delete(ids=stale_ids)
+        logger.info(
+            f'Chroma sync finished in {time.perf_counter() - start:.1f}s: {added} chunks added, '
+            f'{len(stale_ids)} removed, {reused} reused, '
+            f'{unchanged}/{len(self.data_paths)} characters unchanged')
+
+    def add_documents(self, docs: list[Document]) -> set[str]:
+        """
+        Embed chunks in batches of EMBEDDING_BATCH_SIZE, with up to EMBEDDING_CONCURRENCY
+        batches in flight, and write each batch to the chroma as soon as it is embedded.
+        A failed batch does not stop the others. Returns the ids of the chunks written.
+        """
+        written = set()
+        if not docs:
+            return written
+        batches = [docs[i:i + EMBEDDING_BATCH_SIZE]
+                   for i in range(0, len(docs), EMBEDDING_BATCH_SIZE)]
+        embed_documents = self.db.embeddings.embed_documents
+        collection = get_chroma_collection(self.db)
+        failed = 0
+        with ThreadPoolExecutor(max_workers=EMBEDDING_CONCURRENCY) as pool:
+            futures = {pool.submit(embed_documents, [doc.page_content for doc in batch]): batch
+                       for batch in batches}
+            for future in as_completed(futures):
+                batch = futures[future]
+                ids = [doc.metadata['hash'] for doc in batch]
+                try:
+                    # chroma writes stay on this thread
+                    collection.add(
+                        ids=ids,
+                        embeddings=future.result(),
+                        metadatas=[doc.metadata for doc in batch],
+                        documents=[doc.page_content for doc in batch])
+                except Exception as e:
+                    failed += 1
+                    logger.error(f'Failed to embed a batch of {len(batch)} chunks: {e}')
+                    continue
+                written.update(ids)
+        logger.info(f'Embedded {len(written)} chunks in {len(batches) - failed} batches'
+                    + (f', {failed} batches failed' if failed else ''))
+        return written
 
     # load characters from the sql database
     def load_character_from_sql_database(self):
@@ -224,6 +346,15 @@ class CatalogManager(Singleton):
                 # TODO: load context data from storage           # load context data from storage
         logger.info(
             f'Loaded {len(character_models)} characters from sql database')  
+# hash the content of a data directory, used to skip characters whose data did not change
+def hash_directory(data_path) -> str:
+    sha = hashlib.sha256()
+    for file in sorted(Path(data_path).rglob('*')):
+        if file.is_file():
+            sha.update(str(file.relative_to(data_path)).encode())
+            sha.update(file.read_bytes())
+    return sha.hexdigest()
+
 # get the catalog manager
 def get_catalog_manager():   
     return CatalogManager.get_instance() # get the singleton instance of the class
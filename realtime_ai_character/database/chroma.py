@@ -4,7 +4,9 @@ import os
 from dotenv import load_dotenv #loan environment variables from .env file
 from langchain.vectorstores import Chroma 
 from langchain.embeddings import OpenAIEmbeddings
+from realtime_ai_character.database.embedding_cache import CachedEmbeddings
 from realtime_ai_character.logger import get_logger  
+from realtime_ai_character.tracing import get_metrics
 
 load_dotenv() #加载环境变量
 logger = get_logger(__name__) #初始化logger对象,用于记录日志
@@ -15,6 +17,21 @@ if os.getenv('OPENAI_API_TYPE') == 'azure': # 如果使用的是 Azure,使用 Az
     embedding = OpenAIEmbeddings(openai_api_key=os.getenv("OPENAI_API_KEY"), deployment=os.getenv(
         "OPENAI_API_EMBEDDING_DEPLOYMENT_NAME", "text-embedding-ada-002"), chunk_size=1)  
 
+# Cache query embeddings so repeated questions skip the embedding API round trip.
+# Set EMBEDDING_CACHE_PATH to also persist the cache to a SQLite file.
+embedding = CachedEmbeddings(
+    embedding,
+    model=embedding.deployment if os.getenv('OPENAI_API_TYPE') == 'azure' else embedding.model,
+    max_size=int(os.getenv('EMBEDDING_CACHE_SIZE', 1024)),
+    ttl=float(os.getenv('EMBEDDING_CACHE_TTL', 86400)),
+    persist_path=os.getenv('EMBEDDING_CACHE_PATH') or None)
+get_metrics().register_stats('embedding_cache', embedding.stats)
+
+# Retrieval settings: number of chunks returned for the active character, and the minimum
+# relevance score (0 to 1) a chunk needs to be used as context. Leave empty to disable.
+RETRIEVAL_K = int(os.getenv('RETRIEVAL_K', 4))
+RETRIEVAL_SCORE_THRESHOLD = float(os.getenv('RETRIEVAL_SCORE_THRESHOLD') or 0) or None
+
 # 创建一个chroma instance,参数有collection_name,embedding_function,persist_directory
 def get_chroma(): # 定义get_chroma函数,创建并返回一个chroma实例
     
@@ -23,4 +40,11 @@ def get_chroma(): # 定义get_chroma函数,创建并返回一个chroma实例
         embedding_function=embedding, # embedding_function 为 embedding
         persist_directory='./chroma.db' # persist_directory 为 ./chroma.db
     ) 
-    return chroma # 返回 chroma 实例
\ No newline at end of file
+    return chroma # 返回 chroma 实例
+
+
+# LangChain 0.0.308 (pinned in requirements.txt) can neither write precomputed embeddings nor
+# update metadata alone through Chroma, so the underlying chroma collection is used for these,
+# and only reached through here. Check it when upgrading LangChain.
+def get_chroma_collection(chroma: Chroma):
+    return chroma._collection
@@ -0,0 +1,130 @@
+# This file wraps an embedding model with an LRU + TTL cache for query embeddings, so repeated
+# questions (greetings, common questions) skip the embedding API round trip. The cache can
+# optionally be persisted to a SQLite file shared by the workers of a host.
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+from langchain.schema.embeddings import Embeddings
+
+from realtime_ai_character.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def normalize_query(text: str) -> str:
+    """Normalize a query so that trivially different spellings share a cache entry."""
+    return ' '.join(text.lower().split())
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper caching `embed_query` results keyed by model and normalized text.
+
+    :embedding: the embedding model to wrap.
+    :model: name of the embedding model, part of the cache key.
+    :max_size: maximum number of entries kept in memory.
+    :ttl: seconds an entry stays valid, 0 to never expire.
+    :persist_path: optional SQLite file used as a second level cache.
+    """
+
+    def __init__(self, embedding: Embeddings, model: str, max_size: int = 1024,
+                 ttl: float = 86400, persist_path: Optional[str] = None):
+        self.embedding = embedding
+        self.model = model
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._cache: OrderedDict[str, tuple[float, List[float]]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if persist_path:
+            self._db = sqlite3.connect(persist_path, check_same_thread=False)
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS query_embeddings ('
+                'key TEXT PRIMARY KEY, created_at REAL NOT NULL, vector TEXT NOT NULL)')
+            self._db.commit()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embedding.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        key = f'{self.model}:{normalize_query(text)}'
+        vector = self._get(key)
+        if vector is not None:
+            return vector
+        vector = self.embedding.embed_query(text)
+        self._put(key, vector)
+        return vector
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits, misses, size = self.hits, self.misses, len(self._cache)
+        total = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / total if total else 0.0,
+            'size': size,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            if self._db is not None:
+                self._db.execute('DELETE FROM query_embeddings')
+                self._db.commit()
+
+    def _expired(self, created_at: float) -> bool:
+        return self.ttl > 0 and time.time() - created_at > self.ttl
+
+    def _get(self, key: str) -> Optional[List[float]]:
+        # counted under the lock, embed_query runs on several threads
+        with self._lock:
+            vector = self._lookup(key)
+            if vector is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return vector
+
+    def _lookup(self, key: str) -> Optional[List[float]]:
+        entry = self._cache.get(key)
+        if entry is not None:
+            if not self._expired(entry[0]):
+                self._cache.move_to_end(key)
+                return entry[1]
+            del self._cache[key]
+        if self._db is None:
+            return None
+        row = self._db.execute(
+            'SELECT created_at, vector FROM query_embeddings WHERE key = ?',
+            (key,)).fetchone()
+        if row is None or self._expired(row[0]):
+            return None
+        vector = json.loads(row[1])
+        self._remember(key, row[0], vector)
+        return vector
+
+    def _put(self, key: str, vector: List[float]):
+        created_at = time.time()
+        with self._lock:
+            self._remember(key, created_at, vector)
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        'INSERT OR REPLACE INTO query_embeddings VALUES (?, ?, ?)',
+                        (key, created_at, json.dumps(vector)))
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    logger.warning(f'Failed to persist query embedding: {e}')
+
+    def _remember(self, key: str, created_at: float, vector: List[float]):
+        self._cache[key] = (created_at, vector)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
@@ -4,6 +4,7 @@ from functools import cache  # 缓存函数的返回值,避免重复计算
 from langchain.chat_models.base import BaseChatModel # 从base.py中导入BaseChatModel类
 
 from realtime_ai_character.llm.base import LLM # realtime_ai_character.llm.base module中导入LLM类语言模型
+from realtime_ai_character.llm.context_window import ContextWindow, get_token_counter
 
 # 从环境变量中获取llm模型,并根据model的值,选择使用哪个llm模型
 def get_llm(model="gpt-3.5-turbo-16k") -> LLM: 
@@ -13,24 +14,27 @@ def get_llm(model="gpt-3.5-turbo-16k") -> LLM:
 
     if model.startswith('gpt'): 
         from realtime_ai_character.llm.openai_llm import OpenaiLlm # 从openai_llm.py中导入OpenaiLlm类
-        return OpenaiLlm(model=model) # 返回一个OpenaiLlm的实例
+        llm = OpenaiLlm(model=model) # 创建一个OpenaiLlm的实例
     elif model.startswith('claude'):   # 如果model以claude开头,则使用AnthropicLlm 
         from realtime_ai_character.llm.anthropic_llm import AnthropicLlm # 从anthropic_llm.py中导入AnthropicLlm类
-        return AnthropicLlm(model=model) # 返回一个AnthropicLlm的实例
+        llm = AnthropicLlm(model=model) # 创建一个AnthropicLlm的实例
     elif "localhost" in model:
         # Currently use llama2-wrapper to run local llama models
         local_llm_url = os.getenv('LOCAL_LLM_URL', '')
         if local_llm_url:
             from realtime_ai_character.llm.local_llm import LocalLlm
-            return LocalLlm(url=local_llm_url)
+            llm = LocalLlm(url=local_llm_url)
         else:
             raise ValueError('LOCAL_LLM_URL not set')
     elif "llama" in model:
         # Currently use Anyscale to support llama models
         from realtime_ai_character.llm.anyscale_llm import AnysacleLlm
-        return AnysacleLlm(model=model)
+        llm = AnysacleLlm(model=model)
     else:
         raise ValueError(f'Invalid llm model: {model}')
+    # the tokenizer is loaded once per model and shared by the sessions using it
+    llm.context_window = ContextWindow(get_token_counter(model))
+    return llm
 
 
 @cache # 缓存函数的返回值,避免重复计算
@@ -1,13 +1,16 @@
+import asyncio
 from typing import List
 
 from langchain.callbacks.streaming_stdout import StreamingStdOutCallbackHandler
 from langchain.chat_models import ChatAnthropic
 from langchain.schema import BaseMessage, HumanMessage
 
-from realtime_ai_character.database.chroma import get_chroma
+from realtime_ai_character.database.chroma import get_chroma, RETRIEVAL_K, \
+    RETRIEVAL_SCORE_THRESHOLD
 from realtime_ai_character.llm.base import AsyncCallbackAudioHandler, \
-    AsyncCallbackTextHandler, LLM, QuivrAgent, SearchAgent
+    AsyncCallbackTextHandler, LLM, QuivrAgent, SearchAgent, run_context_source
 from realtime_ai_character.logger import get_logger
+from realtime_ai_character.tracing import span
 from realtime_ai_character.utils import Character, timed
 
 logger = get_logger(__name__)
@@ -32,6 +35,10 @@ class AnthropicLlm(LLM):
     def get_config(self):
         return self.config
 
+    @property
+    def chat_model(self):
+        return self.chat_anthropic
+
     @timed
     async def achat(self,
                     history: List[BaseMessage],
@@ -46,24 +53,30 @@ class AnthropicLlm(LLM):
                     quivrBrainId: str = None,
                     metadata: dict = None,
                     *args, **kwargs) -> str:
-        # 1. Generate context
-        context = self._generate_context(user_input, character)
+        # 1. Generate context, the sources run concurrently without blocking the event loop
+        sources = [run_context_source('character data', self._generate_context,
+                                      user_input, character)]
+        # Get search result if enabled
+        if useSearch:
+            sources.append(run_context_source('search', self.search_agent.search, user_input))
+        if useQuivr and quivrApiKey is not None and quivrBrainId is not None:
+            sources.append(run_context_source('quivr', self.quivr_agent.question,
+                                              user_input, quivrApiKey, quivrBrainId))
+        with span('context_build'):
+            context, *extra_contexts = await asyncio.gather(*sources)
         memory_context = self._generate_memory_context(user_id='', query=user_input)
         if memory_context:
             context += ("Information regarding this user based on previous chat: " 
             + memory_context + '\n')
-        # Get search result if enabled
-        if useSearch:
-            context += self.search_agent.search(user_input)
-        if useQuivr and quivrApiKey is not None and quivrBrainId is not None:
-            context += self.quivr_agent.question(
-                user_input, quivrApiKey, quivrBrainId)
+        context += ''.join(extra_contexts)
 
-        # 2. Add user input to history
-        history.append(HumanMessage(content=user_input_template.format(
-            context=context, query=user_input)))
+        # 2. Add user input to the prompt, the history list is shared and not modified
+        message = HumanMessage(content=user_input_template.format(
+            context=context, query=user_input))
 
         # 3. Generate response
+        # Keep the prompt within the token budget of the model
+        history = self.fit_context(history, message)
         response = await self.chat_anthropic.agenerate(
             [history], callbacks=[callback, audioCallback, StreamingStdOutCallbackHandler()],
             metadata=metadata)
@@ -71,11 +84,13 @@ class AnthropicLlm(LLM):
         return response.generations[0][0].text
 
     def _generate_context(self, query, character: Character) -> str:
-        docs = self.db.similarity_search(query)
-        docs = [d for d in docs if d.metadata['character_name'] == character.name]
+        # Only search the chunks of the active character
+        docs = self.db.similarity_search_with_relevance_scores(
+            query, k=RETRIEVAL_K, filter={'character_name': character.name},
+            score_threshold=RETRIEVAL_SCORE_THRESHOLD)
         logger.info(f'Found {len(docs)} documents')
 
-        context = '\n'.join([d.page_content for d in docs])
+        context = '\n'.join([d.page_content for d, _ in docs])
         return context
 
     def _generate_memory_context(self, user_id: str, query: str) -> str:
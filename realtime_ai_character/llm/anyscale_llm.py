@@ -1,3 +1,4 @@
+import asyncio
 import os
 from typing import List
 
@@ -5,10 +6,12 @@ from langchain.callbacks.streaming_stdout import StreamingStdOutCallbackHandler
 from langchain.chat_models import ChatOpenAI
 from langchain.schema import BaseMessage, HumanMessage
 
-from realtime_ai_character.database.chroma import get_chroma
+from realtime_ai_character.database.chroma import get_chroma, RETRIEVAL_K, \
+    RETRIEVAL_SCORE_THRESHOLD
 from realtime_ai_character.llm.base import AsyncCallbackAudioHandler, AsyncCallbackTextHandler, \
-    LLM, SearchAgent
+    LLM, SearchAgent, run_context_source
 from realtime_ai_character.logger import get_logger
+from realtime_ai_character.tracing import span
 from realtime_ai_character.utils import Character, timed
 
 logger = get_logger(__name__)
@@ -46,21 +49,27 @@ class AnysacleLlm(LLM):
                     useSearch: bool = False,
                     metadata: dict = None,
                     *args, **kwargs) -> str:
-        # 1. Generate context
-        context = self._generate_context(user_input, character)
+        # 1. Generate context, the sources run concurrently without blocking the event loop
+        sources = [run_context_source('character data', self._generate_context,
+                                      user_input, character)]
+        # Get search result if enabled
+        if useSearch:
+            sources.append(run_context_source('search', self.search_agent.search, user_input))
+        with span('context_build'):
+            context, *extra_contexts = await asyncio.gather(*sources)
         memory_context = self._generate_memory_context(user_id='', query=user_input)
         if memory_context:
             context += ("Information regarding this user based on previous chat: "
             + memory_context + '\n')
-        # Get search result if enabled
-        if useSearch:
-            context += self.search_agent.search(user_input)
+        context += ''.join(extra_contexts)
 
-        # 2. Add user input to history
-        history.append(HumanMessage(content=user_input_template.format(
-            context=context, query=user_input)))
+        # 2. Add user input to the prompt, the history list is shared and not modified
+        message = HumanMessage(content=user_input_template.format(
+            context=context, query=user_input))
 
         # 3. Generate response
+        # Keep the prompt within the token budget of the model
+        history = self.fit_context(history, message)
         response = await self.chat_open_ai.agenerate(
             [history], callbacks=[callback, audioCallback, StreamingStdOutCallbackHandler()],
             metadata=metadata)
@@ -68,11 +77,13 @@ class AnysacleLlm(LLM):
         return response.generations[0][0].text
 
     def _generate_context(self, query, character: Character) -> str:
-        docs = self.db.similarity_search(query)
-        docs = [d for d in docs if d.metadata['character_name'] == character.name]
+        # Only search the chunks of the active character
+        docs = self.db.similarity_search_with_relevance_scores(
+            query, k=RETRIEVAL_K, filter={'character_name': character.name},
+            score_threshold=RETRIEVAL_SCORE_THRESHOLD)
         logger.info(f'Found {len(docs)} documents')
 
-        context = '\n'.join([d.page_content for d in docs])
+        context = '\n'.join([d.page_content for d, _ in docs])
         return context
 
     def _generate_memory_context(self, user_id: str, query: str) -> str:
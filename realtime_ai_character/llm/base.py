@@ -1,5 +1,7 @@
 import os
 from abc import ABC, abstractmethod
+from collections import deque
+from typing import Sequence
 import requests
 import multion
 import asyncio
@@ -8,16 +10,39 @@ from langchain.callbacks.base import AsyncCallbackHandler
 from langchain.callbacks.streaming_stdout import StreamingStdOutCallbackHandler
 from langchain.utilities import GoogleSerperAPIWrapper, SerpAPIWrapper, GoogleSearchAPIWrapper
 
+from realtime_ai_character.audio.text_to_speech.sentence_segmenter import SentenceSegmenter
 from realtime_ai_character.logger import get_logger
-from realtime_ai_character.utils import get_timer, timed
+from realtime_ai_character.tracing import end_span, start_span
+from realtime_ai_character.utils import timed
 
 logger = get_logger(__name__)
 
-timer = get_timer()
+
+# number of sentences that may be synthesized ahead of the one being played
+TTS_LOOKAHEAD = int(os.getenv('TTS_LOOKAHEAD', 2))
+# seconds a context source (character data, search, quivr) may take before it is skipped
+CONTEXT_SOURCE_TIMEOUT = float(os.getenv('CONTEXT_SOURCE_TIMEOUT', 5))
+# MultiOn runs a browser action before the reply, it may take longer than the other sources
+MULTION_TIMEOUT = float(os.getenv('MULTION_TIMEOUT', 30))
 
 StreamingStdOutCallbackHandler.on_chat_model_start = lambda *args, **kwargs: None
 
 
+async def run_context_source(name: str, func, *args,
+                             timeout: float = CONTEXT_SOURCE_TIMEOUT, fallback: str = '') -> str:
+    """
+    Run a blocking context source in a worker thread so it never stalls the event loop.
+    Returns `fallback` if the source fails or takes longer than `timeout` seconds.
+    """
+    try:
+        return await asyncio.wait_for(asyncio.to_thread(func, *args), timeout) or ''
+    except asyncio.TimeoutError:
+        logger.warning(f'Context source {name} timed out after {timeout}s')
+    except Exception as e:
+        logger.error(f'Error when generating context from {name}: {e}')
+    return fallback
+
+
 class AsyncCallbackTextHandler(AsyncCallbackHandler):
     def __init__(self, on_new_token=None, token_buffer=None, on_llm_end=None, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -39,59 +64,156 @@ class AsyncCallbackTextHandler(AsyncCallbackHandler):
             self.token_buffer.clear()
 
 
+class _SentenceAudio:
+    """Websocket stand-in that buffers the audio of one sentence until it is its turn to play."""
+
+    def __init__(self):
+        self.chunks: asyncio.Queue = asyncio.Queue()
+        # set when the sentence may be synthesized
+        self.may_start = asyncio.Event()
+
+    async def send_bytes(self, data: bytes):
+        await self.chunks.put(data)
+
+    def close(self):
+        self.chunks.put_nowait(None)
+
+
 class AsyncCallbackAudioHandler(AsyncCallbackHandler):
     def __init__(self, text_to_speech=None, websocket=None, tts_event=None, voice_id="",
-                 language="en-US", *args, **kwargs):
+                 language="en-US", lookahead=TTS_LOOKAHEAD, *args, **kwargs):
         super().__init__(*args, **kwargs)
         if text_to_speech is None:
             def text_to_speech(token): return print(
                 f'New audio token: {token}')
         self.text_to_speech = text_to_speech
         self.websocket = websocket
-        self.current_sentence = ""
+        self.segmenter = SentenceSegmenter()
         self.voice_id = voice_id
         self.language = language
         self.is_reply = False  # the start of the reply. i.e. the substring after '>'
-        self.tts_event = tts_event
+        self.tts_event = tts_event or asyncio.Event()
         # optimization: trade off between latency and quality for the first sentence
         self.is_first_sentence = True
+        # Finished sentences are synthesized by background tasks so the token stream never
+        # waits on TTS. A sentence starts once it is at most `lookahead` sentences ahead of
+        # the one being played, and the player task forwards their audio to the websocket
+        # strictly in order.
+        self.lookahead = max(1, lookahead)
+        self.waiting: deque[_SentenceAudio] = deque()
+        self.ahead = 0  # sentences started but not playing yet
+        self.playback_queue: asyncio.Queue = asyncio.Queue()
+        self.synthesis_tasks: set[asyncio.Task] = set()
+        self.player_task = None
 
     async def on_chat_model_start(self, *args, **kwargs):
         pass
 
     async def on_llm_new_token(self, token: str, *args, **kwargs):
-        timer.log("LLM First Token", lambda: timer.start("LLM First Sentence"))
+        if end_span('llm_first_token'):
+            start_span('llm_first_sentence')
         if (
             not self.is_reply and ">" in token
         ):  # small models might not give ">" (e.g. llama2-7b gives ">:" as a token)
             self.is_reply = True
         elif self.is_reply:
-            if token not in {'.', '?', '!'}:
-                self.current_sentence += token
-            else:
-                if self.is_first_sentence:
-                    timer.log("LLM First Sentence", lambda: timer.start("TTS First Sentence"))
+            for sentence in self.segmenter.feed(token):
+                if self.is_first_sentence and end_span('llm_first_sentence'):
+                    start_span('tts_first_byte')
+                self._enqueue_sentence(sentence)
+
+    async def on_llm_end(self, *args, **kwargs):
+        for sentence in self.segmenter.flush():
+            self._enqueue_sentence(sentence)
+        if self.player_task is None:
+            return
+        # wait for the remaining audio so the turn ends after the last sentence is sent
+        self.playback_queue.put_nowait(None)
+        try:
+            await self.player_task
+        except asyncio.CancelledError:
+            self.cancel()
+            raise
+
+    async def on_llm_error(self, *args, **kwargs):
+        self.cancel()
+
+    def cancel(self):
+        """Stop synthesizing and playing any pending sentences of this turn."""
+        for task in list(self.synthesis_tasks):
+            task.cancel()
+        if self.player_task is not None:
+            self.player_task.cancel()
+
+    def _enqueue_sentence(self, sentence: str):
+        audio = _SentenceAudio()
+        task = asyncio.create_task(self._synthesize(sentence, audio, self.is_first_sentence))
+        self.synthesis_tasks.add(task)
+        task.add_done_callback(self.synthesis_tasks.discard)
+        self.waiting.append(audio)
+        self._start_sentences()
+        self.playback_queue.put_nowait(audio)
+        self.is_first_sentence = False
+        if self.player_task is None:
+            self.player_task = asyncio.create_task(self._play())
+
+    def _start_sentences(self):
+        while self.waiting and self.ahead < self.lookahead:
+            self.waiting.popleft().may_start.set()
+            self.ahead += 1
+
+    async def _synthesize(self, sentence: str, audio: _SentenceAudio, first_sentence: bool):
+        try:
+            await audio.may_start.wait()
+            if not self.tts_event.is_set():
                 await self.text_to_speech.stream(
-                    self.current_sentence,
-                    self.websocket,
+                    sentence,
+                    audio,
                     self.tts_event,
                     self.voice_id,
-                    self.is_first_sentence,
+                    first_sentence,
                     self.language)
-                self.current_sentence = ""
-                if self.is_first_sentence:
-                    self.is_first_sentence = False
-                timer.log("TTS First Sentence")
+        except Exception as e:
+            logger.error(f'Error when synthesizing sentence: {e}')
+        finally:
+            audio.close()
 
-    async def on_llm_end(self, *args, **kwargs):
-        if self.current_sentence != "":
-            await self.text_to_speech.stream(
-                self.current_sentence,
-                self.websocket,
-                self.tts_event,
-                self.voice_id,
-                self.is_first_sentence,
-                self.language)
+    async def _play(self):
+        first_sentence = True
+        while True:
+            audio = await self._get_unless_stopped(self.playback_queue)
+            if audio is None:
+                return
+            # sentences start in order, this one started before all that are ahead of it
+            self.ahead -= 1
+            self._start_sentences()
+            while True:
+                chunk = await self._get_unless_stopped(audio.chunks)
+                if chunk is None:
+                    break
+                if first_sentence:
+                    end_span('tts_first_byte')
+                    end_span('reply_first_audio')
+                    first_sentence = False
+                await self.websocket.send_bytes(chunk)
+
+    async def _get_unless_stopped(self, queue: asyncio.Queue):
+        """Get the next item from the queue, or None as soon as tts_event is set."""
+        if self.tts_event.is_set():
+            return None
+        if not queue.empty():
+            return queue.get_nowait()
+        get = asyncio.ensure_future(queue.get())
+        stop = asyncio.ensure_future(self.tts_event.wait())
+        try:
+            await asyncio.wait({get, stop}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            stop.cancel()
+            if not get.done():
+                get.cancel()
+        if self.tts_event.is_set() or get.cancelled():
+            return None
+        return get.result()
 
 class SearchAgent:
 
@@ -137,7 +259,8 @@ class QuivrAgent:
                 "question": query,
             }
 
-            response = requests.post(url, headers=headers, json=data)
+            response = requests.post(url, headers=headers, json=data,
+                                     timeout=CONTEXT_SOURCE_TIMEOUT)
             response.raise_for_status()
             quivr_result = response.json()["context"]
 
@@ -156,26 +279,31 @@ class QuivrAgent:
         return ''
 
 class MultiOnAgent:
+    FAILED = ("The query was attempted by a MutliOn agent, but failed. Inform user about "
+              "this failure.")
+
     def __init__(self):
         self.init = False
 
-    async def action(self, query: str) -> str:
-        if not self.init:
-            logger.info("Initializing multion agent...")
-            multion.login()
-            self.init = True
+    # blocking, run it with run_context_source
+    def action(self, query: str) -> str:
         try:
-            await asyncio.wait_for(asyncio.to_thread(multion.new_session, {"input": query}),
-                                   timeout=30)
+            if not self.init:
+                logger.info("Initializing multion agent...")
+                multion.login()
+                self.init = True
+            multion.new_session({"input": query})
             return ("This query has been handled by a MutliOn agent successfully. "
                     "The result has been delivered to the user. Do not try to complete this "
                     "request. Instead, inform user about the successful execution.")
         except Exception as e:
             logger.error(f'Error when querying multion: {e}')
-            return ("The query was attempted by a MutliOn agent, but failed. Inform user about "
-                    "this failure.")
+            return self.FAILED
 
 class LLM(ABC):
+    # keeps the prompt within the token budget, set by get_llm
+    context_window = None
+
     @abstractmethod
     @timed
     async def achat(self, *args, **kwargs):
@@ -183,4 +311,15 @@ class LLM(ABC):
 
     @abstractmethod
     def get_config(self):
-        pass
\ No newline at end of file
+        pass
+
+    @property
+    def chat_model(self):
+        """The LangChain chat model used for the replies."""
+        return self.chat_open_ai
+
+    def fit_context(self, history: Sequence, message) -> list:
+        """The prompt for the new user `message`, as a new list."""
+        if self.context_window is None:
+            return [*history, message]
+        return self.context_window.fit(history, message)
\ No newline at end of file
@@ -0,0 +1,158 @@
+# This file keeps the prompt within a token budget. The system prompt and the new user input
+# (with the retrieved context) are always sent, then as many recent turns as fit. Optionally,
+# turns that no longer fit are folded into a rolling summary, generated in the background
+# after a reply so it never delays one.
+import asyncio
+import os
+import types
+from contextlib import suppress
+from functools import cache
+from typing import Callable, List, Optional, Sequence
+
+from langchain.schema import BaseMessage, HumanMessage, SystemMessage
+
+from realtime_ai_character.logger import get_logger
+from realtime_ai_character.utils import ConversationHistory
+
+logger = get_logger(__name__)
+
+config = types.SimpleNamespace(**{
+    # tokens of the prompt sent to the LLM, 0 sends the whole history
+    'budget': int(os.getenv('CONTEXT_TOKEN_BUDGET', 4000)),
+    # fold the turns that no longer fit into a summary
+    'summary': os.getenv('CONTEXT_SUMMARY', '').lower() in ('true', '1'),
+    # tokens of recent turns kept word for word, older turns are summarized
+    'recent_tokens': int(os.getenv('CONTEXT_RECENT_TOKENS', 2000)),
+    # turns summarized at once, so the summary is not regenerated after every reply
+    'summary_min_turns': int(os.getenv('CONTEXT_SUMMARY_MIN_TURNS', 4)),
+})
+
+# tokens added by the chat format around each message
+MESSAGE_OVERHEAD = 4
+
+SUMMARY_PROMPT = """Summarize the conversation below between a user and an AI character in a \
+few sentences, keeping names, facts and promises the character should remember. Extend the \
+existing summary rather than repeating it.
+
+Existing summary:
+{summary}
+
+Conversation:
+{conversation}
+
+Summary:"""
+
+
+def estimate_tokens(text: str) -> int:
+    # about 4 bytes per token for English, CJK characters are 3 bytes
+    return (len(text.encode('utf-8')) + 3) // 4
+
+
+@cache
+def get_token_counter(model: str) -> Callable[[str], int]:
+    """Token counting function for `model`, the tokenizer is loaded once per model."""
+    try:
+        import tiktoken
+    except ImportError:
+        logger.warning('tiktoken is not installed, estimating tokens from the text length')
+        return estimate_tokens
+    try:
+        encoding = tiktoken.encoding_for_model(model)
+    except KeyError:
+        # models without a tiktoken encoding (claude, llama) are close enough for a budget
+        encoding = tiktoken.get_encoding('cl100k_base')
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+
+class ContextWindow:
+    def __init__(self, count_tokens: Callable[[str], int], budget: int = config.budget):
+        self.count_tokens = count_tokens
+        self.budget = budget
+
+    def message_tokens(self, message: BaseMessage) -> int:
+        return self.count_tokens(message.content) + MESSAGE_OVERHEAD
+
+    def fit(self, history: Sequence[BaseMessage], message: BaseMessage) -> List[BaseMessage]:
+        """
+        The prompt for the new user `message`: the leading system messages of `history`, the
+        most recent turns that fit in the budget, then `message`. Turns are only cut at a user
+        message. `history` is not modified, the prompt is a new list.
+        """
+        if self.budget <= 0:
+            return [*history, message]
+        head = 0
+        while head < len(history) and isinstance(history[head], SystemMessage):
+            head += 1
+        used = sum(self.message_tokens(item) for item in history[:head])
+        used += self.message_tokens(message)
+        start = len(history)
+        # only walks the messages that end up in the prompt, not the whole session
+        while start > head:
+            tokens = self.message_tokens(history[start - 1])
+            if used + tokens > self.budget:
+                break
+            used += tokens
+            start -= 1
+        while start < len(history) and not isinstance(history[start], HumanMessage):
+            start += 1
+        if used > self.budget:
+            logger.warning(f'Prompt needs {used} tokens even without history, '
+                           f'budget is {self.budget}')
+        return [*history[:head], *history[start:], message]
+
+
+class RollingSummary:
+    """
+    Folds the turns older than the recent window into `history.summary`. `update` returns at
+    once, the summary is generated by a background task and used from the next reply on.
+    """
+
+    def __init__(self, chat_model, count_tokens: Callable[[str], int],
+                 enabled: bool = config.summary, recent_tokens: int = config.recent_tokens,
+                 min_turns: int = config.summary_min_turns):
+        self.chat_model = chat_model
+        self.count_tokens = count_tokens
+        self.enabled = enabled
+        self.recent_tokens = recent_tokens
+        self.min_turns = min_turns
+        self.task: Optional[asyncio.Task] = None
+
+    def update(self, history: ConversationHistory):
+        if not self.enabled or (self.task is not None and not self.task.done()):
+            return
+        # walk back from the newest turn until the recent window is full
+        end = min(len(history.user), len(history.ai))
+        used = 0
+        while end > history.summarized:
+            used += (self.count_tokens(history.user[end - 1]) +
+                     self.count_tokens(history.ai[end - 1]) + 2 * MESSAGE_OVERHEAD)
+            if used > self.recent_tokens:
+                break
+            end -= 1
+        if end - history.summarized < self.min_turns:
+            return
+        self.task = asyncio.create_task(self._summarize(history, history.summarized, end))
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self.task
+
+    async def _summarize(self, history: ConversationHistory, start: int, end: int):
+        conversation = '\n'.join(
+            f'User: {user}\nCharacter: {ai}'
+            for user, ai in zip(history.user[start:end], history.ai[start:end]))
+        prompt = SUMMARY_PROMPT.format(summary=history.summary or '(none)',
+                                       conversation=conversation)
+        try:
+            result = await self.chat_model.agenerate([[HumanMessage(content=prompt)]])
+        except Exception as e:
+            logger.error(f'Error when summarizing the conversation: {e}')
+            return
+        if history.summarized != start:
+            # the history was replaced in the meantime, e.g. reloaded
+            return
+        history.summary = result.generations[0][0].text.strip()
+        history.summarized = end
+        logger.info(f'Summarized turns {start} to {end}')
@@ -1,17 +1,21 @@
+import asyncio
 from typing import List, Union
 # from langchain.callbacks.streaming_stdout import 与streaming和聊天模型有关的类和model
 from langchain.callbacks.streaming_stdout import StreamingStdOutCallbackHandler
 from langchain.chat_models import ChatOpenAI
 from langchain.schema import BaseMessage, HumanMessage
 #导入其他模块中数据库,搜索代理,多代理,计时,日志,角色,语言模型类
-from realtime_ai_character.database.chroma import get_chroma
+from realtime_ai_character.database.chroma import get_chroma, RETRIEVAL_K, \
+    RETRIEVAL_SCORE_THRESHOLD
 from realtime_ai_character.llm.base import (
     AsyncCallbackAudioHandler,
     AsyncCallbackTextHandler,
     LLM,
     SearchAgent,
+    run_context_source,
 )
 from realtime_ai_character.logger import get_logger
+from realtime_ai_character.tracing import span
 from realtime_ai_character.utils import Character, timed
 
 
@@ -50,20 +54,23 @@ class LocalLlm(LLM):
         *args,
         **kwargs,
     ) -> str:
-        # 1. Generate context
-        context = self._generate_context(user_input, character)
+        # 1. Generate context, the sources run concurrently without blocking the event loop
+        sources = [run_context_source('character data', self._generate_context,
+                                      user_input, character)]
         # Get search result if enabled, and append to context
         if useSearch:
-            context += self.search_agent.search(user_input)
-        
-        # 2. Add user input to history
-        history.append(
-            HumanMessage(
-                content=user_input_template.format(context=context, query=user_input)
-            )
+            sources.append(run_context_source('search', self.search_agent.search, user_input))
+        with span('context_build'):
+            context = ''.join(await asyncio.gather(*sources))
+
+        # 2. Add user input to the prompt, the history list is shared and not modified
+        message = HumanMessage(
+            content=user_input_template.format(context=context, query=user_input)
         )
 
         # 3. Generate response by calling LLM
+        # Keep the prompt within the token budget of the model
+        history = self.fit_context(history, message)
         response = await self.chat_open_ai.agenerate(
             [history],
             callbacks=[callback, audioCallback, StreamingStdOutCallbackHandler()],
@@ -73,9 +80,11 @@ class LocalLlm(LLM):
         return response.generations[0][0].text                          #返回responsed text
 
     def _generate_context(self, query, character: Character) -> str:    #定义_generate_context函数,用于生成与character相关的上下文
-        docs = self.db.similarity_search(query)                         #调用similarity_search函数,返回与query相关的文档
-        docs = [d for d in docs if d.metadata["character_name"] == character.name] #如果文档的metadata中的character_name与character的name相同,则将该文档添加到docs中
+        # Only search the chunks of the active character
+        docs = self.db.similarity_search_with_relevance_scores(
+            query, k=RETRIEVAL_K, filter={'character_name': character.name},
+            score_threshold=RETRIEVAL_SCORE_THRESHOLD)
         logger.info(f"Found {len(docs)} documents")                     #记录找到的文档数量
 
-        context = "\n".join([d.page_content for d in docs])             #将docs中的文档内容连接起来
+        context = "\n".join([d.page_content for d, _ in docs])             #将docs中的文档内容连接起来
         return context                                                  #返回context
@@ -1,3 +1,4 @@
+import asyncio
 import os
 from typing import List 
 
@@ -9,10 +10,13 @@ else:
     from langchain.chat_models import ChatOpenAI # 否则使用 OpenAI 的 StreamingStdOutCallbackHandler
 from langchain.schema import BaseMessage, HumanMessage #导入BaseMessage,HumanMessage
 #从其他模块导入所需要的类和函数
-from realtime_ai_character.database.chroma import get_chroma
+from realtime_ai_character.database.chroma import get_chroma, RETRIEVAL_K, \
+    RETRIEVAL_SCORE_THRESHOLD
 from realtime_ai_character.llm.base import AsyncCallbackAudioHandler, \
-    AsyncCallbackTextHandler, LLM, QuivrAgent, SearchAgent, MultiOnAgent
+    AsyncCallbackTextHandler, LLM, QuivrAgent, SearchAgent, MultiOnAgent, MULTION_TIMEOUT, \
+    run_context_source
 from realtime_ai_character.logger import get_logger
+from realtime_ai_character.tracing import span
 from realtime_ai_character.utils import Character, timed
 
 logger = get_logger(__name__) #初始化logger记录日志
@@ -67,29 +71,36 @@ class OpenaiLlm(LLM):
                     quivrBrainId: str = None,
                     metadata: dict = None,
                     *args, **kwargs) -> str:
-        #  Generate context
-        context = self._generate_context(user_input, character)
-        memory_context = self._generate_memory_context(user_id='', query=user_input)
-        if memory_context:
-            context += ("Information regarding this user based on previous chat: "
-            + memory_context + '\n')
+        #  Generate context, the sources run concurrently without blocking the event loop
+        sources = [run_context_source('character data', self._generate_context,
+                                      user_input, character)]
         # Get search result if enabled
         if useSearch:
-            context += self.search_agent.search(user_input)
+            sources.append(run_context_source('search', self.search_agent.search, user_input))
         if useQuivr and quivrApiKey is not None and quivrBrainId is not None:
-            context += self.quivr_agent.question(
-                user_input, quivrApiKey, quivrBrainId)
+            sources.append(run_context_source('quivr', self.quivr_agent.question,
+                                              user_input, quivrApiKey, quivrBrainId))
         if useMultiOn:
             if (user_input.lower().startswith("multi_on") or 
                 user_input.lower().startswith("multion")):
-                response = await self.multion_agent.action(user_input)
-                context += response
+                sources.append(run_context_source(
+                    'multion', self.multion_agent.action, user_input,
+                    timeout=MULTION_TIMEOUT, fallback=MultiOnAgent.FAILED))
+        with span('context_build'):
+            context, *extra_contexts = await asyncio.gather(*sources)
+        memory_context = self._generate_memory_context(user_id='', query=user_input)
+        if memory_context:
+            context += ("Information regarding this user based on previous chat: "
+            + memory_context + '\n')
+        context += ''.join(extra_contexts)
 
-        #  Add user input to history
-        history.append(HumanMessage(content=user_input_template.format(
-            context=context, query=user_input)))
+        #  Add user input to the prompt, the history list is shared and not modified
+        message = HumanMessage(content=user_input_template.format(
+            context=context, query=user_input))
 
         # Generate response from OPENAI API
+        # Keep the prompt within the token budget of the model
+        history = self.fit_context(history, message)
         response = await self.chat_open_ai.agenerate(
             [history], callbacks=[callback, audioCallback, StreamingStdOutCallbackHandler()],
             metadata=metadata)
@@ -97,12 +108,13 @@ class OpenaiLlm(LLM):
         return response.generations[0][0].text  
     # 定义_generate_context函数,用于生成上下文
     def _generate_context(self, query, character: Character) -> str:
-        # Search for similar documents
-        docs = self.db.similarity_search(query)
-        docs = [d for d in docs if d.metadata['character_name'] == character.name]
+        # Search for similar documents, only among the chunks of the active character
+        docs = self.db.similarity_search_with_relevance_scores(
+            query, k=RETRIEVAL_K, filter={'character_name': character.name},
+            score_threshold=RETRIEVAL_SCORE_THRESHOLD)
         logger.info(f'Found {len(docs)} documents')
         # Get the context from the documents
-        context = '\n'.join([d.page_content for d in docs])
+        context = '\n'.join([d.page_content for d, _ in docs])
         return context  #返回上下文
     #定义_generate_memory_context函数,用于生成记忆上下文
     def _generate_memory_context(self, user_id: str, query: str) -> str:
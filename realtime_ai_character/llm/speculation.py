@@ -0,0 +1,215 @@
+# Speculative replies: the LLM starts generating from a stable interim transcript while the
+# user is still talking. The reply is held back (no text, no audio) until the final transcript
+# arrives; if it matches the interim one closely enough the reply is committed and its
+# buffered tokens are replayed, otherwise it is cancelled and a normal reply is generated.
+import asyncio
+import os
+import re
+import types
+from collections import deque
+from contextlib import suppress
+from difflib import SequenceMatcher
+from time import perf_counter
+from typing import List, Optional
+
+from langchain.callbacks.base import AsyncCallbackHandler
+
+from realtime_ai_character.llm.base import LLM
+from realtime_ai_character.logger import get_logger
+from realtime_ai_character.tracing import get_metrics
+from realtime_ai_character.utils import Singleton
+
+logger = get_logger(__name__)
+
+config = types.SimpleNamespace(**{
+    'enabled': os.getenv('SPECULATIVE_LLM', '').lower() in ('true', '1'),
+    # similarity between the interim and the final transcript needed to keep the reply
+    'match_ratio': float(os.getenv('SPECULATIVE_MATCH_RATIO', 0.9)),
+    # interim transcripts shorter than this are not worth a speculative reply
+    'min_words': int(os.getenv('SPECULATIVE_MIN_WORDS', 3)),
+    # speculative replies started at most per utterance
+    'max_attempts': int(os.getenv('SPECULATIVE_MAX_ATTEMPTS', 3)),
+})
+
+# number of recent hits kept for the latency metrics
+SAVED_WINDOW = 1000
+
+
+def normalize_transcript(text: str) -> str:
+    """Lower case and strip punctuation so that 'Hello there.' matches 'hello there'."""
+    return ' '.join(re.sub(r'[^\w\s]', ' ', text.lower()).split())
+
+
+def transcripts_match(interim: str, final: str, ratio: float = config.match_ratio) -> bool:
+    return interim == final or SequenceMatcher(None, interim, final).ratio() >= ratio
+
+
+class SpeculationStats(Singleton):
+    def __init__(self):
+        self.attempts = 0
+        self.hits = 0
+        self.misses = 0
+        self.cancelled = 0
+        self.saved = deque(maxlen=SAVED_WINDOW)
+        get_metrics().register_stats('speculation', self.stats)
+
+    def stats(self) -> dict:
+        claimed = self.hits + self.misses
+        saved = sorted(self.saved)
+        return {
+            'attempts': self.attempts,
+            'hits': self.hits,
+            'misses': self.misses,
+            'cancelled': self.cancelled,
+            'hit_rate': self.hits / claimed if claimed else 0.0,
+            'saved_avg': sum(saved) / len(saved) if saved else 0.0,
+            'saved_p50': saved[len(saved) // 2] if saved else 0.0,
+        }
+
+
+def get_speculation_stats() -> SpeculationStats:
+    return SpeculationStats.get_instance()
+
+
+class SpeculativeCallbackHandler(AsyncCallbackHandler):
+    """Buffers the tokens of a speculative reply until it is committed to real handlers."""
+
+    def __init__(self):
+        super().__init__()
+        self.tokens: List[str] = []
+        self.handlers: Optional[List[AsyncCallbackHandler]] = None
+        self.first_token_at = None
+        self.end_args = None
+
+    async def on_chat_model_start(self, *args, **kwargs):
+        pass
+
+    async def on_llm_new_token(self, token: str, *args, **kwargs):
+        if self.first_token_at is None:
+            self.first_token_at = perf_counter()
+        if self.handlers is None:
+            self.tokens.append(token)
+            return
+        for handler in self.handlers:
+            await handler.on_llm_new_token(token, *args, **kwargs)
+
+    async def on_llm_end(self, *args, **kwargs):
+        if self.handlers is None:
+            self.end_args = (args, kwargs)
+            return
+        for handler in self.handlers:
+            await handler.on_llm_end(*args, **kwargs)
+
+    async def on_llm_error(self, *args, **kwargs):
+        for handler in self.handlers or []:
+            await handler.on_llm_error(*args, **kwargs)
+
+    async def commit(self, handlers: List[AsyncCallbackHandler]):
+        """Replay the buffered tokens to `handlers` and forward everything after them."""
+        replayed = 0
+        while replayed < len(self.tokens):
+            for handler in handlers:
+                await handler.on_llm_new_token(self.tokens[replayed])
+            replayed += 1
+        # no await between the last check and the switch, so no token can be missed
+        self.handlers = handlers
+        if self.end_args is not None:
+            args, kwargs = self.end_args
+            for handler in handlers:
+                await handler.on_llm_end(*args, **kwargs)
+
+
+class SpeculativeReply:
+    def __init__(self, transcript: str, handler: SpeculativeCallbackHandler,
+                 task: asyncio.Task):
+        self.transcript = transcript
+        self.handler = handler
+        self.task = task
+        self.started_at = perf_counter()
+
+    async def commit(self, callback: AsyncCallbackHandler,
+                     audioCallback: AsyncCallbackHandler) -> str:
+        """Deliver the reply through the turn's callbacks, returns the full response."""
+        try:
+            await self.handler.commit([callback, audioCallback])
+            return await self.task
+        except asyncio.CancelledError:
+            self.task.cancel()
+            raise
+
+
+class Speculator:
+    """
+    Speculative execution of LLM replies for one session.
+
+    `speculate` starts a text only reply from an interim transcript, `claim` is called with
+    the final transcript and returns the reply if it can be committed. `will_speculate` tells
+    beforehand whether `speculate` starts a reply. Replies are never speculated with MultiOn
+    enabled, since its actions have side effects.
+    """
+
+    def __init__(self, llm: LLM, enabled: bool = config.enabled):
+        self.llm = llm
+        self.enabled = enabled
+        self.reply: Optional[SpeculativeReply] = None
+        self.attempts = 0
+        self.stats = get_speculation_stats()
+
+    def will_speculate(self, transcript: str, useMultiOn: bool = False) -> bool:
+        if not self.enabled or useMultiOn:
+            return False
+        normalized = normalize_transcript(transcript)
+        if len(normalized.split()) < config.min_words:
+            return False
+        if self.reply is not None and transcripts_match(self.reply.transcript, normalized):
+            return False
+        return self.attempts < config.max_attempts
+
+    def speculate(self, transcript: str, **chat_kwargs) -> bool:
+        """Start a reply from the interim transcript, returns whether one was started."""
+        if not self.will_speculate(transcript, chat_kwargs.get('useMultiOn', False)):
+            return False
+        normalized = normalize_transcript(transcript)
+        self.cancel()
+        self.attempts += 1
+        self.stats.attempts += 1
+        handler = SpeculativeCallbackHandler()
+        task = asyncio.create_task(self.llm.achat(
+            user_input=transcript, callback=handler, audioCallback=AsyncCallbackHandler(),
+            **chat_kwargs))
+        self.reply = SpeculativeReply(normalized, handler, task)
+        logger.info(f'Speculative reply started for: {transcript}')
+        return True
+
+    def claim(self, transcript: str) -> Optional[SpeculativeReply]:
+        reply, self.reply = self.reply, None
+        self.attempts = 0
+        if reply is None:
+            return None
+        failed = reply.task.done() and (reply.task.cancelled() or reply.task.exception())
+        if failed or not transcripts_match(reply.transcript, normalize_transcript(transcript)):
+            self.stats.misses += 1
+            reply.task.cancel()
+            logger.info(f'Speculative reply discarded, final transcript: {transcript}')
+            return None
+        now = perf_counter()
+        # the work already done: up to the first token, or everything if it has not arrived
+        saved = min(now, reply.handler.first_token_at or now) - reply.started_at
+        self.stats.hits += 1
+        self.stats.saved.append(saved)
+        logger.info(f'Speculative reply committed, saved {saved:.3f}s')
+        return reply
+
+    def cancel(self):
+        if self.reply is None:
+            return
+        self.reply.task.cancel()
+        self.stats.cancelled += 1
+        self.reply = None
+
+    async def close(self):
+        reply = self.reply
+        self.cancel()
+        if reply is not None:
+            with suppress(asyncio.CancelledError, Exception):
+                await reply.task
@@ -10,10 +10,12 @@ from fastapi.responses import FileResponse, RedirectResponse # 从fastapi.respon
 #从项目中的其他模块导入需要的类和函数
 from realtime_ai_character.audio.speech_to_text import get_speech_to_text
 from realtime_ai_character.audio.text_to_speech import get_text_to_speech
+from realtime_ai_character.audio.text_to_speech.base import TextToSpeech
 from realtime_ai_character.character_catalog.catalog_manager import CatalogManager
 from realtime_ai_character.memory.memory_manager import MemoryManager
 from realtime_ai_character.restful_routes import router as restful_router
 from realtime_ai_character.utils import ConnectionManager
+from realtime_ai_character.warmup import LAZY_STARTUP, get_warmup_manager
 from realtime_ai_character.websocket_routes import router as websocket_router
 
 load_dotenv() # 加载环境变量
@@ -66,11 +68,27 @@ else:
 
 # initializations: initialize the catalog, connection, and memory managers
 overwrite_chroma = os.getenv("OVERWRITE_CHROMA", 'True').lower() in ('true', '1')
-CatalogManager.initialize(overwrite=overwrite_chroma)
+incremental_chroma = os.getenv("INCREMENTAL_CHROMA", 'True').lower() in ('true', '1')
 ConnectionManager.initialize()
-MemoryManager.initialize() 
-get_text_to_speech() # initialize the text to speech engine
-get_speech_to_text() # initialize the speech to text engine
-  
+warmup_manager = get_warmup_manager()
+warmup_manager.add('catalog', lambda: CatalogManager.initialize(overwrite=overwrite_chroma,
+                                                                incremental=incremental_chroma))
+warmup_manager.add('memory', MemoryManager.initialize)
+warmup_manager.add('text_to_speech', get_text_to_speech) # initialize the text to speech engine
+warmup_manager.add('speech_to_text', get_speech_to_text) # initialize the speech to text engine
+if LAZY_STARTUP:
+    # serve requests right away, connections arriving early wait until the components are loaded
+    @app.on_event("startup")
+    async def startup():
+        warmup_manager.start()
+else:
+    warmup_manager.load()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    # release pooled connections held by the text to speech engines
+    await TextToSpeech.close_http_client()
+
 # suppress deprecation warnings from the whisper module
 warnings.filterwarnings("ignore", module="whisper")
@@ -15,7 +15,7 @@ class Character(Base):
     user_prompt = Column(String(262144), nullable=True)
     text_to_speech_use = Column(String(100), nullable=True)
     voice_id = Column(String(100), nullable=True)
-    author_id = Column(String(100), nullable=True)
+    author_id = Column(String(100), nullable=True, index=True)
     visibility = Column(String(100), nullable=True)
     data = Column(JSON(), nullable=True)
     created_at = Column(DateTime(), nullable=False)
@@ -0,0 +1,48 @@
+from sqlalchemy import Column, DateTime, Index, Integer, String, Unicode
+from sqlalchemy.inspection import inspect
+import datetime
+from realtime_ai_character.database.base import Base
+
+# characters of the last user message kept for the conversation list
+PREVIEW_LENGTH = 200
+
+
+# 定义了一个 Conversation 类, 每个session一行的对话摘要, 在保存 Interaction 时更新,
+# 避免每次请求 /conversations 都扫描用户的全部 interactions
+class Conversation(Base):
+    __tablename__ = "conversations"
+    __table_args__ = (
+        # recent conversations of a user, newest first
+        Index('ix_conversations_user_id_last_timestamp',
+              'user_id', 'last_timestamp', 'session_id'),
+    )
+
+    session_id = Column(String(50), primary_key=True)
+    user_id = Column(String(50))
+    character_id = Column(String(100))
+    last_message = Column(Unicode(PREVIEW_LENGTH))
+    last_timestamp = Column(DateTime)
+    turn_count = Column(Integer, nullable=False, default=0)
+#定义了一个to_dict方法,将对话摘要转换为字典
+    def to_dict(self):
+        return {
+            c.key:
+            getattr(self, c.key).isoformat() if isinstance(
+                getattr(self, c.key), datetime.datetime) else getattr(
+                    self, c.key)
+            for c in inspect(self).mapper.column_attrs
+        }
+#定义了record方法,把一条新的 Interaction 计入所属session的摘要, 由调用方commit
+    @classmethod
+    def record(cls, db, interaction):
+        conversation = db.get(cls, interaction.session_id)
+        if conversation is None:
+            conversation = cls(session_id=interaction.session_id, turn_count=1)
+            db.add(conversation)
+        else:
+            # incremented in SQL, so concurrent writers do not lose a turn
+            conversation.turn_count = cls.turn_count + 1
+        conversation.user_id = interaction.user_id
+        conversation.character_id = interaction.character_id
+        conversation.last_message = (interaction.client_message_unicode or '')[:PREVIEW_LENGTH]
+        conversation.last_timestamp = interaction.timestamp
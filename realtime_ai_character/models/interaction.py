@@ -1,11 +1,18 @@
-from sqlalchemy import Column, Integer, String, DateTime, Unicode, JSON
+from sqlalchemy import Column, Index, Integer, String, DateTime, Unicode, JSON
 from sqlalchemy.inspection import inspect
 import datetime
 from realtime_ai_character.database.base import Base
+from realtime_ai_character.models.conversation import Conversation
 
 # 定义了一个 Interaction 类，用于存储用户与角色的交互信息
 class Interaction(Base):
     __tablename__ = "interactions"
+    __table_args__ = (
+        # session auth check, history load and /session_history
+        Index('ix_interactions_session_id_timestamp', 'session_id', 'timestamp'),
+        # recent conversations of a user
+        Index('ix_interactions_user_id_timestamp', 'user_id', 'timestamp'),
+    )
 
     id = Column(Integer, primary_key=True, index=True, nullable=False)
     client_id = Column(Integer)  # deprecated, use user_id instead
@@ -35,7 +42,11 @@ class Interaction(Base):
                     self, c.key)
             for c in inspect(self).mapper.column_attrs
         }
-#定义了save方法,将用户与角色的交互信息保存到数据库中
+#定义了save方法,将用户与角色的交互信息保存到数据库中, 并在同一事务中更新对话摘要
     def save(self, db):
+        if self.timestamp is None:
+            self.timestamp = datetime.datetime.utcnow()
         db.add(self)
+        if self.session_id:
+            Conversation.record(db, self)
         db.commit()
@@ -11,7 +11,7 @@ class Memory(Base):
     __tablename__ = "memory"
 
     memory_id = Column(String(64), primary_key=True)
-    user_id = Column(String(50), nullable=True)
+    user_id = Column(String(50), nullable=True, index=True)
     source_session_id = Column(String(50), nullable=True)
     content = Column(Unicode(65535), nullable=True)
     created_at = Column(DateTime(), nullable=False)
@@ -8,7 +8,7 @@ class QuivrInfo(Base):
     __tablename__ = "quivr_info"
 
     id = Column(Integer, primary_key=True)
-    user_id = Column(String(50))
+    user_id = Column(String(50), index=True)
     quivr_api_key = Column(String)
     quivr_brain_id = Column(String)
 #定义了一个to_dict方法,将用户与Quivr的交互信息转换为字典
@@ -0,0 +1,187 @@
+# This file buffers the messages sent to one websocket. Token callbacks and TTS loops only
+# enqueue, a single writer task sends, so a slow client never stalls the LLM stream.
+import asyncio
+import os
+from collections import deque
+from contextlib import suppress
+from time import perf_counter
+
+from starlette.websockets import WebSocket, WebSocketState
+
+from realtime_ai_character.logger import get_logger
+
+logger = get_logger(__name__)
+
+DROP = 'drop'
+DISCONNECT = 'disconnect'
+
+# seconds tokens are held so that consecutive tokens are sent as one frame
+OUTBOUND_FLUSH_INTERVAL = float(os.getenv('OUTBOUND_FLUSH_INTERVAL', 0.02))
+# bytes a client may fall behind before the overflow policy applies
+OUTBOUND_MAX_BUFFER = int(os.getenv('OUTBOUND_MAX_BUFFER', 1024 * 1024))
+# "drop" discards the oldest queued audio, "disconnect" closes the connection. Text can not be
+# dropped, a client that falls behind on text alone is disconnected with either policy
+OUTBOUND_OVERFLOW_POLICY = os.getenv('OUTBOUND_OVERFLOW_POLICY', DROP)
+
+_TOKEN, _CONTROL = 0, 1
+
+
+class OutboundQueue:
+    """
+    Bounded outbound queue with a single writer task for one websocket.
+
+    Text keeps its order: LLM tokens are coalesced into fewer frames and may be sent ahead of
+    queued audio. Control frames (`[end]`, `[+]You said: ...`) flush the tokens before them
+    immediately, but are only sent after the audio queued before them, so `[end]` follows
+    the audio of the turn it ends. When more than `max_buffer` bytes are waiting the
+    overflow policy either drops the oldest audio or disconnects the client.
+
+    Has the `send_text`/`send_bytes` interface of a websocket, so it can be passed to the
+    text to speech engines in place of one.
+    """
+
+    def __init__(self, websocket: WebSocket, flush_interval: float = OUTBOUND_FLUSH_INTERVAL,
+                 max_buffer: int = OUTBOUND_MAX_BUFFER, policy: str = OUTBOUND_OVERFLOW_POLICY):
+        if policy not in (DROP, DISCONNECT):
+            raise ValueError(f'Unknown outbound overflow policy: {policy}')
+        self.websocket = websocket
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.policy = policy
+        self.closed = False
+        self.dropped_bytes = 0
+        # (kind, message, mark): the mark of a token is the time it was queued, the mark of a
+        # control frame is the number of audio chunks queued before it
+        self._text: deque[tuple[int, str, float]] = deque()
+        self._audio: deque[bytes] = deque()
+        self._controls = 0
+        self._buffered = 0
+        # audio chunks ever queued, and ever sent or discarded
+        self._audio_queued = 0
+        self._audio_done = 0
+        self._wakeup = asyncio.Event()
+        self._writer = None
+
+    @property
+    def application_state(self) -> WebSocketState:
+        if self.closed:
+            return WebSocketState.DISCONNECTED
+        return self.websocket.application_state
+
+    async def send_text(self, message: str):
+        """Enqueue a control frame, sent as soon as the text before it is out."""
+        self._put_text(_CONTROL, message)
+
+    async def send_token(self, token: str):
+        """Enqueue an LLM token, which may be merged with the tokens around it."""
+        self._put_text(_TOKEN, token)
+
+    async def send_bytes(self, data: bytes):
+        if self.closed:
+            return
+        self._audio.append(data)
+        self._audio_queued += 1
+        self._buffered += len(data)
+        self._check_overflow()
+        self._wake()
+
+    def clear_audio(self):
+        """Discard the queued audio, e.g. when the reply it belongs to is interrupted."""
+        self._buffered -= sum(len(data) for data in self._audio)
+        self._audio_done += len(self._audio)
+        self._audio.clear()
+
+    def close(self):
+        self.closed = True
+        self._text.clear()
+        self._audio.clear()
+        if self._writer is not None:
+            self._writer.cancel()
+
+    def _put_text(self, kind: int, message: str):
+        if self.closed:
+            return
+        if kind == _CONTROL:
+            self._controls += 1
+            mark = self._audio_queued
+        else:
+            mark = perf_counter()
+        self._text.append((kind, message, mark))
+        self._buffered += len(message)
+        self._check_overflow()
+        self._wake()
+
+    def _wake(self):
+        if self._writer is None:
+            self._writer = asyncio.create_task(self._write())
+        self._wakeup.set()
+
+    def _check_overflow(self):
+        if self._buffered <= self.max_buffer:
+            return
+        if self.policy == DROP:
+            while self._buffered > self.max_buffer and self._audio:
+                self.dropped_bytes += len(self._pop_audio())
+            if self._buffered <= self.max_buffer:
+                return
+        # dropping text would corrupt the reply, the client is too slow to keep
+        logger.warning(f'Client #{id(self.websocket)} fell {self._buffered} bytes behind, '
+                       f'disconnecting')
+        self.close()
+        asyncio.create_task(self._close_websocket())
+
+    async def _close_websocket(self):
+        with suppress(Exception):
+            await self.websocket.close(code=1008, reason='Client too slow')
+
+    async def _write(self):
+        try:
+            while not self.closed:
+                if not self._text and not self._audio:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                if self._text and self._text_ready():
+                    await self.websocket.send_text(self._pop_text())
+                elif self._audio:
+                    await self.websocket.send_bytes(self._pop_audio())
+                else:
+                    # give the next tokens a moment to arrive, a control frame ends the wait
+                    self._wakeup.clear()
+                    with suppress(asyncio.TimeoutError):
+                        await asyncio.wait_for(self._wakeup.wait(), self._token_wait())
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # the client went away, nothing more can be delivered
+            logger.info(f'Stopped sending to client #{id(self.websocket)}: {e}')
+            self.close()
+
+    def _text_ready(self) -> bool:
+        kind, _, mark = self._text[0]
+        if kind == _CONTROL:
+            # the audio queued before a control frame, e.g. of the turn it ends, goes first
+            return mark <= self._audio_done
+        return self._controls > 0 or self._token_wait() <= 0
+
+    def _token_wait(self) -> float:
+        # the oldest queued token is held at most flush_interval
+        return self._text[0][2] + self.flush_interval - perf_counter()
+
+    def _pop_audio(self) -> bytes:
+        data = self._audio.popleft()
+        self._buffered -= len(data)
+        self._audio_done += 1
+        return data
+
+    def _pop_text(self) -> str:
+        kind, message, _ = self._text.popleft()
+        self._buffered -= len(message)
+        if kind == _CONTROL:
+            self._controls -= 1
+            return message
+        parts = [message]
+        while self._text and self._text[0][0] == _TOKEN:
+            parts.append(self._text.popleft()[1])
+            self._buffered -= len(parts[-1])
+        return ''.join(parts)
@@ -0,0 +1,129 @@
+# This file provides the publish/subscribe layer used to deliver messages to connections that
+# may live in another worker or pod. The in-memory backend only reaches the current process,
+# the Redis backend reaches every worker connected to the same Redis.
+import asyncio
+import os
+from abc import ABC, abstractmethod
+from contextlib import suppress
+from typing import Awaitable, Callable, Optional
+
+from realtime_ai_character.logger import get_logger
+
+logger = get_logger(__name__)
+
+# "memory" (single worker) or "redis"
+PUBSUB_BACKEND = os.getenv('PUBSUB_BACKEND', 'memory')
+REDIS_URL = os.getenv('REDIS_URL') or 'redis://localhost:6379/0'
+# prefix of the channels and keys used in Redis, so several deployments can share one
+REDIS_PREFIX = os.getenv('REDIS_PREFIX', 'realchar:')
+
+Handler = Callable[[str], Awaitable]
+
+
+class PubSub(ABC):
+    @abstractmethod
+    async def publish(self, channel: str, message: str):
+        pass
+
+    @abstractmethod
+    async def subscribe(self, channel: str, handler: Handler):
+        """Call `handler` with every message published on `channel`, one handler per channel."""
+        pass
+
+    @abstractmethod
+    async def unsubscribe(self, channel: str):
+        pass
+
+    async def close(self):
+        pass
+
+
+class InMemoryPubSub(PubSub):
+    def __init__(self):
+        self.handlers: dict[str, Handler] = {}
+
+    async def publish(self, channel: str, message: str):
+        handler = self.handlers.get(channel)
+        if handler is not None:
+            await handler(message)
+
+    async def subscribe(self, channel: str, handler: Handler):
+        self.handlers[channel] = handler
+
+    async def unsubscribe(self, channel: str):
+        self.handlers.pop(channel, None)
+
+
+class RedisPubSub(PubSub):
+    """
+    Redis backed pub/sub. Needs the optional `redis` package, or any client with the
+    `redis.asyncio` interface (e.g. `fakeredis.aioredis.FakeRedis`) passed as `client`.
+    """
+
+    def __init__(self, url: str = REDIS_URL, client=None, prefix: str = REDIS_PREFIX):
+        if client is None:
+            import redis.asyncio as redis
+            client = redis.from_url(url, decode_responses=True)
+        self.client = client
+        self.prefix = prefix
+        self.pubsub = client.pubsub()
+        self.handlers: dict[str, Handler] = {}
+        self.listener: Optional[asyncio.Task] = None
+
+    async def publish(self, channel: str, message: str):
+        await self.client.publish(self.prefix + channel, message)
+
+    async def subscribe(self, channel: str, handler: Handler):
+        self.handlers[self.prefix + channel] = handler
+        await self.pubsub.subscribe(self.prefix + channel)
+        if self.listener is None:
+            self.listener = asyncio.create_task(self._listen())
+
+    async def unsubscribe(self, channel: str):
+        if self.handlers.pop(self.prefix + channel, None) is not None:
+            await self.pubsub.unsubscribe(self.prefix + channel)
+
+    async def close(self):
+        if self.listener is not None:
+            self.listener.cancel()
+            with suppress(asyncio.CancelledError):
+                await self.listener
+        await self.pubsub.close()
+
+    async def _listen(self):
+        while True:
+            try:
+                message = await self.pubsub.get_message(ignore_subscribe_messages=True,
+                                                        timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f'Error when reading from Redis pub/sub: {e}')
+                await asyncio.sleep(1)
+                continue
+            if message is None:
+                continue
+            channel, data = message['channel'], message['data']
+            if isinstance(channel, bytes):
+                channel, data = channel.decode(), data.decode()
+            handler = self.handlers.get(channel)
+            if handler is not None:
+                try:
+                    await handler(data)
+                except Exception as e:
+                    logger.error(f'Error when delivering message on {channel}: {e}')
+
+
+_pubsub: Optional[PubSub] = None
+
+
+def get_pubsub() -> PubSub:
+    global _pubsub
+    if _pubsub is None:
+        if PUBSUB_BACKEND == 'redis':
+            _pubsub = RedisPubSub()
+        elif PUBSUB_BACKEND == 'memory':
+            _pubsub = InMemoryPubSub()
+        else:
+            raise NotImplementedError(f'Unknown pub/sub backend: {PUBSUB_BACKEND}')
+    return _pubsub
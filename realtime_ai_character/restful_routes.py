@@ -5,14 +5,18 @@ import uuid
 import asyncio
 import httpx
 
-from fastapi import APIRouter, Depends, HTTPException, Request, \
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, \
     status as http_status, UploadFile, File, Form
+from fastapi.responses import StreamingResponse
 from google.cloud import storage
 import firebase_admin
 from firebase_admin import auth, credentials
 from firebase_admin.exceptions import FirebaseError
 from realtime_ai_character.audio.text_to_speech import get_text_to_speech
 from realtime_ai_character.database.connection import get_db
+from realtime_ai_character.models.conversation import Conversation
 from realtime_ai_character.models.interaction import Interaction
 from realtime_ai_character.models.feedback import Feedback, FeedbackRequest
 from realtime_ai_character.models.character import Character, CharacterRequest, \
@@ -20,8 +24,11 @@ from realtime_ai_character.models.character import Character, CharacterRequest,
 from realtime_ai_character.models.memory import Memory, EditMemoryRequest
 from realtime_ai_character.models.quivr_info import QuivrInfo, UpdateQuivrInfoRequest
 from realtime_ai_character.llm.system_prompt_generator import generate_system_prompt
+from realtime_ai_character.warmup import get_warmup_manager, wait_for_startup
+from realtime_ai_character.tracing import get_metrics
+from realtime_ai_character.utils import get_connection_manager
 from requests import Session
-from sqlalchemy import func
+from sqlalchemy import and_, or_
 
 #greenapi mudule 
 import json
@@ -84,7 +91,26 @@ async def status():
     return {"status": "ok", "message": "RealChar is running smoothly!"}
 
 
-@router.get("/characters") # 定义路由端点characters
+@router.get("/ready") # 定义路由端点ready, 返回启动进度
+async def ready(response: Response):
+    warmup_manager = get_warmup_manager()
+    if not warmup_manager.is_ready():
+        response.status_code = http_status.HTTP_503_SERVICE_UNAVAILABLE
+    return warmup_manager.progress()
+
+
+@router.get("/connections") # 定义路由端点connections, 返回当前的连接数, 用于自动扩缩容
+async def connections():
+    return get_connection_manager().counts()
+
+
+@router.get("/metrics") # 定义路由端点metrics, 以Prometheus格式返回延迟的p50/p95/p99和运行统计
+async def metrics():
+    return Response(content=get_metrics().render(),
+                    media_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@router.get("/characters", dependencies=[Depends(wait_for_startup)]) # 定义路由端点characters
 async def characters(user=Depends(get_current_user)): #使用depends来获取当前用户,如果用户不存在,则返回401错误
     def get_image_url(character):
         gcs_path = 'https://storage.googleapis.com/assistly'
@@ -115,14 +141,45 @@ async def configs():
         'llms': ['gpt-4', 'gpt-3.5-turbo-16k', 'claude-2', 'meta-llama/Llama-2-70b-chat-hf'],
     } # 返回一个字典,包含llms键,值为一个列表,列表中包含四个字符串
 
+# columns returned by session_history, llm_config and the deprecated columns are not read
+SESSION_HISTORY_COLUMNS = (
+    Interaction.id, Interaction.timestamp, Interaction.character_id,
+    Interaction.client_message_unicode, Interaction.server_message_unicode,
+    Interaction.action_type, Interaction.language, Interaction.message_id)
+SESSION_HISTORY_BATCH_SIZE = 100 # rows fetched from the database at a time
+
+
+def stream_json_rows(rows):
+    """Encode query rows as a JSON array, one row at a time."""
+    yield '['
+    for i, row in enumerate(rows):
+        item = row._asdict()
+        if isinstance(item.get('timestamp'), datetime.datetime):
+            item['timestamp'] = item['timestamp'].isoformat()
+        yield (',' if i else '') + json.dumps(item)
+    yield ']'
+
+
 @router.get("/session_history") # 定义路由端点session_history
-async def get_session_history(session_id: str, db: Session = Depends(get_db)): #使用depends来获取当前用户,如果用户不存在,则返回401错误
-    # Read session history from the database.
-    interactions = await asyncio.to_thread(
-        db.query(Interaction).filter(Interaction.session_id == session_id).all)
-    # return interactions in json format
-    interactions_json = [interaction.to_dict() for interaction in interactions]
-    return interactions_json
+async def get_session_history(session_id: str,
+                              after: Optional[int] = None,
+                              limit: Optional[int] = Query(default=None, ge=1, le=1000),
+                              db: Session = Depends(get_db)):
+    # Read session history from the database, oldest first. Pages are keyed on
+    # (timestamp, id): pass the id of the last interaction received as `after`.
+    query = db.query(*SESSION_HISTORY_COLUMNS).filter(Interaction.session_id == session_id)
+    if after is not None:
+        after_timestamp = (db.query(Interaction.timestamp)
+                           .filter(Interaction.id == after).scalar_subquery())
+        query = query.filter(or_(Interaction.timestamp > after_timestamp,
+                                 and_(Interaction.timestamp == after_timestamp,
+                                      Interaction.id > after)))
+    query = query.order_by(Interaction.timestamp, Interaction.id)
+    if limit is not None:
+        query = query.limit(limit)
+    # rows are encoded as they are read, in a worker thread, instead of building the list
+    return StreamingResponse(stream_json_rows(query.yield_per(SESSION_HISTORY_BATCH_SIZE)),
+                             media_type='application/json')
 
 @router.post("/feedback") # 定义路由端点feedback
 async def post_feedback(feedback_request: FeedbackRequest,
@@ -259,7 +316,7 @@ async def delete_character(delete_character_request: DeleteCharacterRequest,
     db.commit()
 
 
-@router.post("/generate_audio")
+@router.post("/generate_audio", dependencies=[Depends(wait_for_startup)])
 async def generate_audio(text: str, tts: str = None, user = Depends(get_current_user)):
     if not isinstance(text, str) or text == '':
         raise HTTPException(
@@ -473,7 +530,11 @@ async def system_prompt(request: GeneratePromptRequest, user = Depends(get_curre
 
 
 @router.get("/conversations", response_model=list[dict])
-async def get_recent_conversations(user = Depends(get_current_user), db: Session = Depends(get_db)):
+async def get_recent_conversations(before: Optional[datetime.datetime] = None,
+                                   before_session_id: Optional[str] = None,
+                                   limit: int = Query(default=20, ge=1, le=100),
+                                   user = Depends(get_current_user),
+                                   db: Session = Depends(get_db)):
     if not user:
         raise HTTPException(
                 status_code=http_status.HTTP_401_UNAUTHORIZED,
@@ -481,30 +542,28 @@ async def get_recent_conversations(user = Depends(get_current_user), db: Session
                 headers={'WWW-Authenticate': 'Bearer'},
             )
     user_id = user['uid']
-    stmt = (
-        db.query(
-            Interaction.session_id,
-            Interaction.client_message_unicode,
-            Interaction.timestamp,
-            func.row_number().over(
-                partition_by=Interaction.session_id,
-                order_by=Interaction.timestamp.desc()).label("rn")).filter(
-                    Interaction.user_id == user_id).subquery()
-    )
-
-    results = (
-        await asyncio.to_thread(db.query(stmt.c.session_id, stmt.c.client_message_unicode)
-        .filter(stmt.c.rn == 1)
-        .order_by(stmt.c.timestamp.desc())
-        .all)
-    )
+    # One row per session, kept up to date when interactions are saved. Newest first, pages
+    # are keyed on (timestamp, session_id) of the last conversation received.
+    query = db.query(Conversation).filter(Conversation.user_id == user_id)
+    if before is not None:
+        if before_session_id is not None:
+            query = query.filter(or_(Conversation.last_timestamp < before,
+                                     and_(Conversation.last_timestamp == before,
+                                          Conversation.session_id < before_session_id)))
+        else:
+            query = query.filter(Conversation.last_timestamp < before)
+    conversations = await asyncio.to_thread(
+        query.order_by(Conversation.last_timestamp.desc(), Conversation.session_id.desc())
+        .limit(limit).all)
 
     # Format the results to the desired output
     return [{
-        "session_id": r[0],
-        "client_message_unicode": r[1],
-        "timestamp": r[2]
-    } for r in results]
+        "session_id": conversation.session_id,
+        "character_id": conversation.character_id,
+        "client_message_unicode": conversation.last_message,
+        "timestamp": conversation.last_timestamp,
+        "turn_count": conversation.turn_count,
+    } for conversation in conversations]
 
 
 @router.get("/memory", response_model=list[dict])
@@ -0,0 +1,140 @@
+# This file keeps the conversation state of a session outside the websocket coroutine, so a
+# reconnect, possibly landing on another worker, resumes without reloading the history from
+# the database. It is off unless a backend is configured: the in-memory backend is per worker,
+# the Redis backend is shared. Only the turns a reload from the database would replay, and the
+# summary of the older ones, are stored.
+import json
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Optional
+
+from realtime_ai_character.logger import get_logger
+from realtime_ai_character.pubsub import REDIS_PREFIX, REDIS_URL
+from realtime_ai_character.utils import HISTORY_LOAD_TURNS, ConversationHistory
+
+logger = get_logger(__name__)
+
+# "redis", "memory" (single worker) or "none", defaults to "redis" when REDIS_URL is set
+SESSION_STORE_BACKEND = os.getenv('SESSION_STORE_BACKEND') or (
+    'redis' if os.getenv('REDIS_URL') else 'none')
+# seconds a session state is kept after its last update
+SESSION_STATE_TTL = int(os.getenv('SESSION_STATE_TTL', 86400))
+# sessions kept by the in-memory backend
+SESSION_STORE_MAX_SESSIONS = int(os.getenv('SESSION_STORE_MAX_SESSIONS', 10000))
+
+
+def dump_history(history: ConversationHistory, turns: int = HISTORY_LOAD_TURNS) -> str:
+    """
+    The last `turns` turns and the summary. The system prompt is not stored, it is set from
+    the character when the session is resumed.
+    """
+    complete = min(len(history.user), len(history.ai))
+    first = max(0, complete - turns)
+    return json.dumps({
+        'user': history.user[first:complete],
+        'ai': history.ai[first:complete],
+        'summary': history.summary,
+        'summarized': max(0, history.summarized - first),
+    })
+
+
+def parse_history(data: str) -> ConversationHistory:
+    return ConversationHistory(**json.loads(data))
+
+
+class SessionStore(ABC):
+    @abstractmethod
+    async def load(self, session_id: str) -> Optional[ConversationHistory]:
+        pass
+
+    @abstractmethod
+    async def save(self, session_id: str, history: ConversationHistory):
+        pass
+
+    @abstractmethod
+    async def delete(self, session_id: str):
+        pass
+
+
+class NullSessionStore(SessionStore):
+    """Stores nothing, sessions are resumed from the database."""
+
+    async def load(self, session_id: str) -> Optional[ConversationHistory]:
+        return None
+
+    async def save(self, session_id: str, history: ConversationHistory):
+        pass
+
+    async def delete(self, session_id: str):
+        pass
+
+
+class InMemorySessionStore(SessionStore):
+    def __init__(self, ttl: int = SESSION_STATE_TTL,
+                 max_sessions: int = SESSION_STORE_MAX_SESSIONS):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions: OrderedDict[str, tuple[float, str]] = OrderedDict()
+
+    async def load(self, session_id: str) -> Optional[ConversationHistory]:
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            return None
+        if time.time() - entry[0] > self.ttl:
+            del self._sessions[session_id]
+            return None
+        return parse_history(entry[1])
+
+    async def save(self, session_id: str, history: ConversationHistory):
+        # stored serialized, so later changes to the live history are not shared
+        self._sessions[session_id] = (time.time(), dump_history(history))
+        self._sessions.move_to_end(session_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    async def delete(self, session_id: str):
+        self._sessions.pop(session_id, None)
+
+
+class RedisSessionStore(SessionStore):
+    """Redis backed session state, accepts any `redis.asyncio` compatible `client`."""
+
+    def __init__(self, url: str = REDIS_URL, client=None, prefix: str = REDIS_PREFIX,
+                 ttl: int = SESSION_STATE_TTL):
+        if client is None:
+            import redis.asyncio as redis
+            client = redis.from_url(url, decode_responses=True)
+        self.client = client
+        self.prefix = prefix + 'session:'
+        self.ttl = ttl
+
+    async def load(self, session_id: str) -> Optional[ConversationHistory]:
+        data = await self.client.get(self.prefix + session_id)
+        if data is None:
+            return None
+        return parse_history(data)
+
+    async def save(self, session_id: str, history: ConversationHistory):
+        await self.client.set(self.prefix + session_id, dump_history(history), ex=self.ttl)
+
+    async def delete(self, session_id: str):
+        await self.client.delete(self.prefix + session_id)
+
+
+_session_store: Optional[SessionStore] = None
+
+
+def get_session_store() -> SessionStore:
+    global _session_store
+    if _session_store is None:
+        if SESSION_STORE_BACKEND == 'redis':
+            _session_store = RedisSessionStore()
+        elif SESSION_STORE_BACKEND == 'memory':
+            _session_store = InMemorySessionStore()
+        elif SESSION_STORE_BACKEND == 'none':
+            _session_store = NullSessionStore()
+        else:
+            raise NotImplementedError(f'Unknown session store backend: {SESSION_STORE_BACKEND}')
+    return _session_store
@@ -0,0 +1,166 @@
+# This file measures the latency of each reply. A Trace holds the spans of one turn (context
+# build, LLM first token, first sentence, TTS first byte, ...) and is carried to the tasks of
+# the turn by a context variable, so concurrent sessions never mix their timings. Finished
+# spans go into fixed size histograms exported by /metrics.
+import math
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Callable, Optional
+
+# histogram buckets grow by 10% from 1ms, so percentiles are within ~5% of the true value
+BUCKET_MIN = 0.001
+BUCKET_GROWTH = 1.1
+BUCKET_COUNT = 140  # up to ~10 minutes, slower samples go to the last bucket
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    """Log-bucketed latency histogram, its memory does not grow with the number of samples."""
+
+    def __init__(self):
+        self.buckets = [0] * (BUCKET_COUNT + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        if seconds <= BUCKET_MIN:
+            index = 0
+        else:
+            index = min(BUCKET_COUNT,
+                        1 + int(math.log(seconds / BUCKET_MIN, BUCKET_GROWTH)))
+        self.buckets[index] += 1
+        self.count += 1
+        self.sum += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    def percentile(self, quantile: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = quantile * self.count
+        seen = 0
+        for index, bucket in enumerate(self.buckets):
+            seen += bucket
+            if seen >= rank:
+                break
+        if index == 0:
+            value = BUCKET_MIN
+        else:
+            # geometric middle of the bucket
+            value = BUCKET_MIN * BUCKET_GROWTH ** (index - 0.5)
+        return min(max(value, self.min), self.max)
+
+
+class Metrics:
+    def __init__(self):
+        self.histograms: dict[str, Histogram] = {}
+        # name -> function returning a dict of numbers, e.g. the connection counts
+        self.stats_sources: dict[str, Callable[[], dict]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def register_stats(self, name: str, source: Callable[[], dict]):
+        self.stats_sources[name] = source
+
+    def latency(self) -> dict:
+        with self._lock:
+            return {
+                name: {
+                    'count': histogram.count,
+                    'sum': histogram.sum,
+                    **{f'p{int(q * 100)}': histogram.percentile(q) for q in QUANTILES},
+                }
+                for name, histogram in self.histograms.items()
+            }
+
+    def stats(self) -> dict:
+        results = {}
+        for name, source in list(self.stats_sources.items()):
+            try:
+                results[name] = source()
+            except Exception:
+                continue
+        return results
+
+    def render(self, prefix: str = 'realchar') -> str:
+        """Prometheus text format."""
+        lines = [f'# TYPE {prefix}_latency_seconds summary']
+        for name, summary in self.latency().items():
+            for q in QUANTILES:
+                lines.append(f'{prefix}_latency_seconds{{span="{name}",quantile="{q}"}} '
+                             f'{summary[f"p{int(q * 100)}"]:.6f}')
+            lines.append(f'{prefix}_latency_seconds_sum{{span="{name}"}} {summary["sum"]:.6f}')
+            lines.append(f'{prefix}_latency_seconds_count{{span="{name}"}} {summary["count"]}')
+        for name, values in self.stats().items():
+            for key, value in values.items():
+                metric = f'{prefix}_{name}_{key}'
+                if isinstance(value, dict):
+                    for label, item in value.items():
+                        lines.append(f'{metric}{{key="{label}"}} {item}')
+                elif isinstance(value, (int, float)):
+                    lines.append(f'{metric} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+_metrics = Metrics()
+
+
+def get_metrics() -> Metrics:
+    return _metrics
+
+
+class Trace:
+    """The open spans of one turn. A span is recorded once, when it is first ended."""
+
+    def __init__(self, *spans: str):
+        self._started: dict[str, float] = {}
+        for name in spans:
+            self.start(name)
+
+    def start(self, name: str):
+        self._started[name] = perf_counter()
+
+    def end(self, name: str) -> bool:
+        started = self._started.pop(name, None)
+        if started is None:
+            return False
+        _metrics.observe(name, perf_counter() - started)
+        return True
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar('trace', default=None)
+
+
+def use_trace(trace: Optional[Trace]):
+    """Make `trace` the trace of the current task and of the tasks it creates."""
+    _current_trace.set(trace)
+
+
+def start_span(name: str):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.start(name)
+
+
+def end_span(name: str) -> bool:
+    """End a span of the current trace, returns whether it was open."""
+    trace = _current_trace.get()
+    return trace is not None and trace.end(name)
+
+
+@contextmanager
+def span(name: str):
+    """Record the duration of a block, whether or not a trace is active."""
+    started = perf_counter()
+    yield
+    _metrics.observe(name, perf_counter() - started)
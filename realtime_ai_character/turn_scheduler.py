@@ -0,0 +1,90 @@
+# This file schedules the replies (turns) of one websocket session. Replies run as background
+# tasks so the session keeps reading messages while the character talks, and a new message
+# either interrupts the current reply (barge-in) or waits for it to finish (queue).
+import asyncio
+import os
+from collections import deque
+from contextlib import suppress
+from typing import Awaitable, Callable, Optional
+
+from realtime_ai_character.logger import get_logger
+
+logger = get_logger(__name__)
+
+BARGE_IN = 'barge_in'
+QUEUE = 'queue'
+
+# what happens to the current reply when the user sends a new message
+TURN_POLICY = os.getenv('TURN_POLICY', BARGE_IN)
+# replies waiting behind the current one with the queue policy, the oldest is dropped beyond
+MAX_PENDING_TURNS = int(os.getenv('MAX_PENDING_TURNS', 3))
+
+Turn = Callable[[], Awaitable]
+
+
+class TurnScheduler:
+    """
+    Owns the in-flight reply of a session.
+
+    A turn is a coroutine function producing one reply (LLM + TTS). Cancelling a turn sets
+    `tts_event` first, so audio stops at once, then cancels the task, which closes the
+    upstream LLM and TTS HTTP streams as their context managers unwind.
+    """
+
+    def __init__(self, tts_event: asyncio.Event, policy: str = TURN_POLICY,
+                 max_pending: int = MAX_PENDING_TURNS,
+                 on_interrupt: Optional[Callable[[], None]] = None):
+        if policy not in (BARGE_IN, QUEUE):
+            raise ValueError(f'Unknown turn policy: {policy}')
+        self.tts_event = tts_event
+        self.policy = policy
+        self.pending: deque[Turn] = deque()
+        self.max_pending = max_pending
+        self.current: Optional[asyncio.Task] = None
+        self.on_interrupt = on_interrupt
+
+    @property
+    def busy(self) -> bool:
+        return self.current is not None and not self.current.done()
+
+    async def submit(self, turn: Turn):
+        """Start a turn according to the policy. Returns without waiting for the reply."""
+        if self.policy == BARGE_IN:
+            await self.interrupt()
+        elif self.busy:
+            if len(self.pending) >= self.max_pending:
+                self.pending.popleft()
+                logger.warning('Too many pending turns, dropped the oldest one')
+            self.pending.append(turn)
+            return
+        self._start(turn)
+
+    async def interrupt(self):
+        """Stop the current reply and drop the pending ones."""
+        self.pending.clear()
+        task = self.current
+        if task is not None and not task.done():
+            self.tts_event.set()
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+            self.tts_event.clear()
+        # audio of a finished reply may still be waiting to be sent
+        if self.on_interrupt is not None:
+            self.on_interrupt()
+
+    async def close(self):
+        await self.interrupt()
+
+    def _start(self, turn: Turn):
+        self.current = asyncio.create_task(self._run(turn))
+
+    async def _run(self, turn: Turn):
+        try:
+            await turn()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f'Error when running turn: {e}')
+        if self.pending:
+            self._start(self.pending.popleft())
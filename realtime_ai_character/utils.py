@@ -1,14 +1,21 @@
 import asyncio
+import functools
+import os
+import threading
 from dataclasses import field
-from time import perf_counter
-from typing import List, Optional, Callable
+from typing import List, Optional, Sequence
 
 from langchain.schema import AIMessage, BaseMessage, HumanMessage, SystemMessage
 from pydantic.dataclasses import dataclass
 from starlette.websockets import WebSocket, WebSocketState
 from sqlalchemy.orm import Session
-from realtime_ai_character.models.interaction import Interaction
 from realtime_ai_character.logger import get_logger
+from realtime_ai_character.models.interaction import Interaction
+from realtime_ai_character.outbound_queue import OutboundQueue
+from realtime_ai_character.pubsub import get_pubsub
+from realtime_ai_character.tracing import get_metrics, span
+
+logger = get_logger(__name__)
 
 # 用于存储角色信息,包括id,name,llm_system_prompt,llm_user_prompt....
 @dataclass
@@ -27,45 +34,85 @@ class Character:
     tts: Optional[str] = ''
     data: Optional[dict] = None
 
+# turns loaded when a session is resumed from the database, older ones are outside the
+# token budget of the prompt anyway
+HISTORY_LOAD_TURNS = int(os.getenv('HISTORY_LOAD_TURNS', 200))
+
 # 用于存储对话历史信息,包括系统提示,用户信息,ai信息....
 @dataclass
 class ConversationHistory:
     system_prompt: str = ''
     user: list[str] = field(default_factory=list)
     ai: list[str] = field(default_factory=list)
+    # 较早对话的摘要, 以及摘要覆盖的对话轮数, 见llm/context_window.py
+    summary: str = ''
+    summarized: int = 0
+
+    def __post_init__(self):
+        # LangChain messages of the system prompt, the summary and the turns after it, extended
+        # as turns are added instead of being rebuilt for every request
+        self._messages: tuple[BaseMessage, ...] = ()
+        self._head = None  # (system prompt, summary, summarized) the messages were built from
+        self._synced = 0  # turns already in _messages
 # 构建函数用于迭代对话历史信息,返回系统提示,用户信息,ai信息
     def __iter__(self):
         yield self.system_prompt
         for user_message, ai_message in zip(self.user, self.ai):
             yield user_message
             yield ai_message
-# 构建函数用于将对话历史信息存储到数据库中
-    def load_from_db(self, session_id: str, db: Session):
-        conversations = db.query(Interaction).filter(Interaction.session_id == session_id).all() # 通过session_id获取数据库中的所有Interaction
-        for conversation in conversations: # 遍历所有Interaction,将用户信息和ai信息存储到数据库中
-            self.user.append(conversation.client_message_unicode)
-            self.ai.append(conversation.server_message_unicode)
+# 返回缓存的LangChain消息元组, 只为新增的对话创建消息
+    def messages(self) -> Sequence[BaseMessage]:
+        """
+        The cached messages, as a tuple so a request cannot change the history of the next one.
+        New turns are appended to it, it is rebuilt when the summary folds turns, or the lists
+        were replaced or shortened.
+        """
+        turns = min(len(self.user), len(self.ai))
+        first = min(self.summarized, turns)
+        head = (self.system_prompt, self.summary, first)
+        if head != self._head or turns < self._synced:
+            self._messages = (SystemMessage(content=self.system_prompt),)
+            if self.summary:
+                self._messages += (SystemMessage(
+                    content=f'Summary of the earlier conversation: {self.summary}'),)
+            self._head, self._synced = head, first
+        if turns > self._synced:
+            self._messages += tuple(
+                message
+                for user_message, ai_message in zip(self.user[self._synced:turns],
+                                                    self.ai[self._synced:turns])
+                for message in (HumanMessage(content=user_message), AIMessage(content=ai_message)))
+        self._synced = turns
+        return self._messages
+# 构建函数用于从数据库中加载最近的对话历史信息
+    def load_from_db(self, session_id: str, db: Session, limit: int = HISTORY_LOAD_TURNS):
+        # 只读取两个消息列, 按时间倒序取最近的limit轮, 再按时间顺序加入历史
+        conversations = (db.query(Interaction.client_message_unicode,
+                                  Interaction.server_message_unicode)
+                         .filter(Interaction.session_id == session_id)
+                         .order_by(Interaction.timestamp.desc(), Interaction.id.desc())
+                         .limit(limit)
+                         .all())
+        for client_message, server_message in reversed(conversations):
+            self.user.append(client_message)
+            self.ai.append(server_message)
 
 #构建一个basemessage list从对话历史信息中
-def build_history(conversation_history: ConversationHistory) -> List[BaseMessage]:
-    history = []
-    for i, message in enumerate(conversation_history): # 遍历对话历史信息,如果是第一次对话,则返回系统提示,否则返回对话历史信息
-        if i == 0: # 如果是第一次对话,则返回系统提示
-            history.append(SystemMessage(content=message))
-        elif i % 2 == 0: # 如果是偶数,则返回用户信息
-            history.append(AIMessage(content=message))
-        else: # 如果是奇数,则返回ai信息
-            history.append(HumanMessage(content=message))
-    return history  # 返回对话历史信息
+def build_history(conversation_history: ConversationHistory) -> Sequence[BaseMessage]:
+    return conversation_history.messages()
 #构建一个singleton类
 class Singleton:
     _instances = {}
+    # 每个类一把构造锁: 预热线程构造实例时, 同时到达的get_instance
+    # 等待它完成, 而不是再构造一个副本
+    _locks = {}
+    _locks_lock = threading.Lock()
 #使用static access method for getting a instance
     @classmethod
     def get_instance(cls, *args, **kwargs):
         """ Static access method. """
         if cls not in cls._instances:
-            cls._instances[cls] = cls(*args, **kwargs)
+            cls._create(*args, **kwargs)
 
         return cls._instances[cls]
 #使用static access method for initializing a instance
@@ -73,86 +120,145 @@ class Singleton:
     def initialize(cls, *args, **kwargs):
         """ Static access method. """
         if cls not in cls._instances:
-            cls._instances[cls] = cls(*args, **kwargs)
+            cls._create(*args, **kwargs)
+
+    @classmethod
+    def _create(cls, *args, **kwargs):
+        with Singleton._locks_lock:
+            lock = Singleton._locks.setdefault(cls, threading.Lock())
+        with lock:
+            if cls not in cls._instances:
+                cls._instances[cls] = cls(*args, **kwargs)
+
+# seconds a broadcast waits for one connection before skipping it
+SEND_TIMEOUT = float(os.getenv('WEBSOCKET_SEND_TIMEOUT', 5))
+
+
+def session_group(session_id: str) -> str:
+    return f'session:{session_id}'
+
+
+def user_group(user_id: str) -> str:
+    return f'user:{user_id}'
+
+
+def character_group(character_id: str) -> str:
+    return f'character:{character_id}'
 
 #构建一个connection manager类,用于管理websocket连接
 class ConnectionManager(Singleton):
     def __init__(self):
-        self.active_connections: List[WebSocket] = []
+        # 连接注册表: websocket -> 所属的分组, 添加和删除都是O(1)
+        self.connections: dict[WebSocket, set[str]] = {}
+        # 分组(session, user, character) -> websocket集合, 用于定向发送
+        self.groups: dict[str, set[WebSocket]] = {}
+        # 每个连接一个发送队列,由单独的writer task发送,慢客户端不会阻塞LLM
+        self.outbound: dict[WebSocket, OutboundQueue] = {}
+        # 跨worker的消息通道, 本worker订阅有本地成员的分组
+        self.pubsub = get_pubsub()
+        get_metrics().register_stats('connections', self.counts)
+
+    @property
+    def active_connections(self) -> List[WebSocket]:
+        return list(self.connections)
 #链接websocket的函数
-    async def connect(self, websocket: WebSocket):
+    async def connect(self, websocket: WebSocket, session_id: Optional[str] = None,
+                      user_id: Optional[str] = None):
         await websocket.accept()
-        self.active_connections.append(websocket)
+        self.connections[websocket] = set()
+        self.outbound[websocket] = OutboundQueue(websocket)
+        if session_id:
+            await self.join(websocket, session_group(session_id))
+        if user_id:
+            await self.join(websocket, user_group(user_id))
 #断开websocket的函数
     async def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        for group in list(self.connections.get(websocket, ())):
+            await self.leave(websocket, group)
+        self.connections.pop(websocket, None)
+        outbound = self.outbound.pop(websocket, None)
+        if outbound is not None:
+            outbound.close()
         print(f"Client #{id(websocket)} left the chat")
-        # await self.broadcast_message(f"Client #{id(websocket)} left the chat")
+#将连接加入分组,例如一个用户的所有设备或一个角色的房间
+    async def join(self, websocket: WebSocket, group: str):
+        if websocket not in self.connections:
+            return
+        self.connections[websocket].add(group)
+        if group not in self.groups:
+            self.groups[group] = set()
+            await self.pubsub.subscribe(group, functools.partial(self.send_to_group, group))
+        self.groups[group].add(websocket)
+#将连接移出分组
+    async def leave(self, websocket: WebSocket, group: str):
+        self.connections.get(websocket, set()).discard(group)
+        members = self.groups.get(group)
+        if members is not None:
+            members.discard(websocket)
+            if not members:
+                del self.groups[group]
+                await self.pubsub.unsubscribe(group)
+#获取连接的发送队列,可以代替websocket传给text to speech
+    def get_sender(self, websocket: WebSocket):
+        return self.outbound.get(websocket, websocket)
 #发送消息的函数
     async def send_message(self, message: str, websocket: WebSocket):
-        if websocket.application_state == WebSocketState.CONNECTED:
-            await websocket.send_text(message)
+        sender = self.get_sender(websocket)
+        if sender.application_state == WebSocketState.CONNECTED:
+            await sender.send_text(message)
+#发送LLM token的函数,相邻的token会合并成一帧
+    async def send_token(self, token: str, websocket: WebSocket):
+        sender = self.get_sender(websocket)
+        if isinstance(sender, OutboundQueue):
+            await sender.send_token(token)
+        else:
+            await self.send_message(token, websocket)
+#向一个分组发送消息的函数, 只发送给本worker上的连接
+    async def send_to_group(self, group: str, message: str,
+                            exclude: Optional[WebSocket] = None):
+        await self._fan_out(self.groups.get(group, ()), message, exclude)
+#向一个分组发送消息的函数, 通过pub/sub送达所有worker上的连接
+    async def publish(self, group: str, message: str):
+        await self.pubsub.publish(group, message)
 #广播消息的函数
-    async def broadcast_message(self, message: str):
-        for connection in self.active_connections:
-            if connection.application_state == WebSocketState.CONNECTED:
-                await connection.send_text(message)
+    async def broadcast_message(self, message: str, exclude: Optional[WebSocket] = None):
+        await self._fan_out(self.connections, message, exclude)
+#并发发送,每个连接有超时,慢连接不会阻塞其他连接
+    async def _fan_out(self, websockets, message: str, exclude: Optional[WebSocket]):
+        targets = [websocket for websocket in websockets if websocket is not exclude]
+        results = await asyncio.gather(
+            *[asyncio.wait_for(self.send_message(message, websocket), SEND_TIMEOUT)
+              for websocket in targets],
+            return_exceptions=True)
+        for websocket, result in zip(targets, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Failed to send to client #{id(websocket)}: {result!r}")
+#当前连接数,用于监控和自动扩缩容
+    def counts(self) -> dict:
+        return {
+            'connections': len(self.connections),
+            'sessions': sum(1 for group in self.groups if group.startswith('session:')),
+            'users': sum(1 for group in self.groups if group.startswith('user:')),
+            'characters': {group.split(':', 1)[1]: len(members)
+                           for group, members in self.groups.items()
+                           if group.startswith('character:')},
+        }
 
 #获取connection manager的函数
 def get_connection_manager():
     return ConnectionManager.get_instance()
 
-#构建一个timer类,用于计时
-class Timer(Singleton):
-    def __init__(self):
-        self.start_time: dict[str, float] = {}
-        self.elapsed_time = {}
-        self.logger = get_logger("Timer")
-#开始计时的函数
-    def start(self, id: str):
-        self.start_time[id] = perf_counter()
-#记录时间的函数
-    def log(self, id: str, callback: Optional[Callable] = None):
-        if id in self.start_time:
-            elapsed_time = perf_counter() - self.start_time[id]
-            del self.start_time[id]
-            if id in self.elapsed_time:
-                self.elapsed_time[id].append(elapsed_time)
-            else:
-                self.elapsed_time[id] = [elapsed_time]
-            if callback:
-                callback()
-#报告时间的函数
-    def report(self):
-        for id, t in self.elapsed_time.items():
-            self.logger.info(
-                f"{id:<30s}: {sum(t)/len(t):.3f}s [{min(t):.3f}s - {max(t):.3f}s] "
-                f"({len(t)} samples)"
-            )
-#重置时间的函数
-    def reset(self):
-        self.start_time = {}
-        self.elapsed_time = {}
-
-#获取timer的函数
-def get_timer() -> Timer:
-    return Timer.get_instance()
-
-#计时decorator
+#计时decorator, 运行时间记录到/metrics的histogram中
 def timed(func):
     if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
         async def async_wrapper(*args, **kwargs):
-            timer = get_timer()
-            timer.start(func.__qualname__)
-            result = await func(*args, **kwargs)
-            timer.log(func.__qualname__)
-            return result
+            with span(func.__qualname__):
+                return await func(*args, **kwargs)
         return async_wrapper
     else:
+        @functools.wraps(func)
         def sync_wrapper(*args, **kwargs):
-            timer = get_timer()
-            timer.start(func.__qualname__)
-            result = func(*args, **kwargs)
-            timer.log(func.__qualname__)
-            return result
+            with span(func.__qualname__):
+                return func(*args, **kwargs)
         return sync_wrapper
@@ -0,0 +1,99 @@
+# This file tracks the loading of the heavy components (character catalog, speech engines) at
+# startup. With LAZY_STARTUP enabled they are loaded in background threads, so the server can
+# accept connections right away and report its progress through /ready.
+import asyncio
+import os
+from time import perf_counter
+from typing import Callable
+
+from fastapi import HTTPException, WebSocketException, status as http_status
+
+from realtime_ai_character.logger import get_logger
+from realtime_ai_character.utils import Singleton
+
+logger = get_logger(__name__)
+
+LAZY_STARTUP = os.getenv('LAZY_STARTUP', '').lower() in ('true', '1')
+# seconds a request arriving during startup waits for the components before giving up
+STARTUP_WAIT_TIMEOUT = float(os.getenv('STARTUP_WAIT_TIMEOUT', 300))
+
+
+class WarmupManager(Singleton):
+    def __init__(self):
+        self.loaders: dict[str, Callable] = {}
+        self.components: dict[str, dict] = {}
+        self.finished = asyncio.Event()
+        self.task = None
+
+    def add(self, name: str, load: Callable):
+        """Register a blocking function loading a component."""
+        self.loaders[name] = load
+        self.components[name] = {'status': 'pending', 'elapsed': None, 'error': None}
+
+    def load(self):
+        """Load every component on the calling thread, raising on the first failure."""
+        for name in self.loaders:
+            self._load(name)
+        self.finished.set()
+
+    def start(self):
+        """Load every component in background threads. Must be called from the event loop."""
+        self.task = asyncio.create_task(self._load_in_background())
+
+    async def _load_in_background(self):
+        await asyncio.gather(*[asyncio.to_thread(self._load, name) for name in self.loaders],
+                             return_exceptions=True)
+        self.finished.set()
+        if self.is_ready():
+            logger.info('All components are ready')
+
+    def _load(self, name: str):
+        state = self.components[name]
+        state['status'] = 'loading'
+        start = perf_counter()
+        try:
+            self.loaders[name]()
+        except Exception as e:
+            state['status'] = 'failed'
+            state['error'] = str(e)
+            logger.error(f'Failed to load {name}: {e}')
+            raise
+        finally:
+            state['elapsed'] = round(perf_counter() - start, 3)
+        state['status'] = 'ready'
+        logger.info(f'Loaded {name} in {state["elapsed"]:.1f}s')
+
+    def is_ready(self) -> bool:
+        return all(state['status'] == 'ready' for state in self.components.values())
+
+    def progress(self) -> dict:
+        return {
+            'ready': self.is_ready(),
+            'components': self.components,
+        }
+
+    async def wait_until_ready(self, timeout: float = STARTUP_WAIT_TIMEOUT) -> bool:
+        """Wait for the components to finish loading. Returns whether all of them loaded."""
+        if not self.finished.is_set():
+            try:
+                await asyncio.wait_for(self.finished.wait(), timeout)
+            except asyncio.TimeoutError:
+                return False
+        return self.is_ready()
+
+
+def get_warmup_manager() -> WarmupManager:
+    return WarmupManager.get_instance()
+
+
+async def wait_for_startup():
+    """Dependency holding HTTP requests until the components are loaded."""
+    if not await get_warmup_manager().wait_until_ready():
+        raise HTTPException(status_code=http_status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail='Server is starting up, please retry later')
+
+
+async def wait_for_startup_websocket():
+    """Dependency holding websocket connections until the components are loaded."""
+    if not await get_warmup_manager().wait_until_ready():
+        raise WebSocketException(code=1013, reason='Server is starting up')
@@ -1,8 +1,10 @@
 import asyncio
+import functools
 import os
 import uuid
 
 from dataclasses import dataclass
+from typing import Optional
 from fastapi import APIRouter, Depends, HTTPException, Path, WebSocket, WebSocketDisconnect, Query
 from firebase_admin import auth
 from firebase_admin.exceptions import FirebaseError
@@ -19,11 +21,17 @@ from realtime_ai_character.memory.memory_manager import (MemoryManager, get_memo
 from realtime_ai_character.database.connection import get_db
 from realtime_ai_character.llm import get_llm, LLM
 from realtime_ai_character.llm.base import AsyncCallbackAudioHandler, AsyncCallbackTextHandler
+from realtime_ai_character.llm.context_window import RollingSummary
+from realtime_ai_character.llm.speculation import SpeculativeReply, Speculator
 from realtime_ai_character.logger import get_logger
 from realtime_ai_character.models.interaction import Interaction
 from realtime_ai_character.models.quivr_info import QuivrInfo
 from realtime_ai_character.utils import (ConversationHistory, build_history,
-                                         get_connection_manager, get_timer)
+                                         character_group, get_connection_manager, user_group)
+from realtime_ai_character.session_store import get_session_store
+from realtime_ai_character.tracing import Trace, span, use_trace
+from realtime_ai_character.turn_scheduler import BARGE_IN, TurnScheduler
+from realtime_ai_character.warmup import wait_for_startup_websocket
 
 logger = get_logger(__name__)
 
@@ -31,7 +39,6 @@ router = APIRouter()
 
 manager = get_connection_manager()
 
-timer = get_timer()
 
 GREETING_TXT_MAP = {
     "en-US": "Hi, my friend, what brings you here today?",
@@ -101,7 +108,9 @@ async def check_session_auth(session_id: str, user_id: str, db: Session) -> Sess
             is_authenticated_user=False,
     )
 
-@router.websocket("/ws/{session_id}")
+# wait_for_startup_websocket is resolved before the other dependencies, so connections arriving
+# during a lazy startup wait for the components instead of loading them on the event loop.
+@router.websocket("/ws/{session_id}", dependencies=[Depends(wait_for_startup_websocket)])
 async def websocket_endpoint(websocket: WebSocket,
                              session_id: str = Path(...),
                              api_key: str = Query(None),
@@ -111,6 +120,11 @@ async def websocket_endpoint(websocket: WebSocket,
                              token: str = Query(None),
                              character_id: str = Query(None),
                              platform: str = Query(None),
+                             # format of the raw PCM audio sent by non-web clients
+                             sample_rate: int = Query(default=44100),
+                             channels: int = Query(default=1),
+                             # stream raw PCM frames continuously instead of whole utterances
+                             stream_audio: bool = Query(default=False),
                              use_search: bool = Query(default=False),
                              use_quivr: bool = Query(default=False),
                              use_multion: bool = Query(default=False),
@@ -139,19 +153,22 @@ async def websocket_endpoint(websocket: WebSocket,
         return
 
     llm = get_llm(model=llm_model)
-    await manager.connect(websocket)
+    await manager.connect(websocket, session_id=session_id, user_id=user_id)
     try:
         main_task = asyncio.create_task(
             handle_receive(websocket, session_id, user_id, db, llm, catalog_manager,
                            memory_manager, character_id, platform, use_search, use_quivr,
                            use_multion, speech_to_text, default_text_to_speech, language,
-                           session_auth_result.is_existing_session))
+                           session_auth_result.is_existing_session, sample_rate, channels,
+                           stream_audio))
 
         await asyncio.gather(main_task)
 
     except WebSocketDisconnect:
         await manager.disconnect(websocket)
-        await manager.broadcast_message(f"User #{user_id} left the chat")
+        # only the user's other connections are told, not everyone
+        # reaches the user's connections on every worker
+        await manager.publish(user_group(user_id), f"User #{user_id} left the chat")
 
 
 async def handle_receive(websocket: WebSocket, session_id: str, user_id: str, db: Session,
@@ -159,12 +176,28 @@ async def handle_receive(websocket: WebSocket, session_id: str, user_id: str, db
                          character_id: str, platform: str, use_search: bool, use_quivr: bool,
                          use_multion: bool, speech_to_text: SpeechToText,
                          default_text_to_speech: TextToSpeech,
-                         language: str, load_from_existing_session: bool = False):
+                         language: str, load_from_existing_session: bool = False,
+                         sample_rate: int = 44100, channels: int = 1,
+                         stream_audio: bool = False):
+    speech_stream = None
+    stream_finals = None
+    turns = None
+    speculator = Speculator(llm)
+    # folds old turns into a summary in the background, see llm/context_window.py
+    rolling_summary = RollingSummary(llm.chat_model, llm.context_window.count_tokens)
+    session_store = get_session_store()
     try:
         conversation_history = ConversationHistory()
         if load_from_existing_session:
             logger.info(f"User #{user_id} is loading from existing session {session_id}")
-            await asyncio.to_thread(conversation_history.load_from_db, session_id=session_id, db=db)
+            # the session state saved after each turn, possibly by another worker, avoids
+            # replaying the history from the database
+            stored_history = await session_store.load(session_id)
+            if stored_history is not None:
+                conversation_history = stored_history
+            else:
+                await asyncio.to_thread(conversation_history.load_from_db,
+                                        session_id=session_id, db=db)
 
         # 0. Receive client platform info (web, mobile, terminal)
         if not platform:
@@ -215,51 +248,181 @@ async def handle_receive(websocket: WebSocket, session_id: str, user_id: str, db
         else:
             text_to_speech = default_text_to_speech
 
+        await manager.join(websocket, character_group(character_id))
+
         conversation_history.system_prompt = character.llm_system_prompt
         user_input_template = character.llm_user_prompt
         logger.info(
             f"User #{user_id} selected character: {character.name}")
 
         tts_event = asyncio.Event()
-        tts_task = None
-        previous_transcript = None
         token_buffer = []
+        # Outgoing messages and audio go through the connection's send queue.
+        sender = manager.get_sender(websocket)
+        # Replies run as turns, so messages keep being read while the character talks.
+        # Audio still queued for an interrupted reply is discarded.
+        turns = TurnScheduler(tts_event, on_interrupt=getattr(sender, 'clear_audio', None))
 
         # Greet the user
         greeting_text = GREETING_TXT_MAP[language]
         await manager.send_message(message=greeting_text, websocket=websocket)
-        tts_task = asyncio.create_task(
-            text_to_speech.stream(
-                text=greeting_text,
-                websocket=websocket,
-                tts_event=tts_event,
-                voice_id=character.voice_id,
-                first_sentence=True,
-                language=language
-            ))
+        await turns.submit(lambda: text_to_speech.stream(
+            text=greeting_text,
+            websocket=sender,
+            tts_event=tts_event,
+            voice_id=character.voice_id,
+            first_sentence=True,
+            language=language
+        ))
         # Send end of the greeting so the client knows when to start listening
         await manager.send_message(message='[end]\n', websocket=websocket)
 
         async def on_new_token(token):
-            return await manager.send_message(message=token,
-                                              websocket=websocket)
-
-        async def stop_audio():
-            if tts_task and not tts_task.done():
-                tts_event.set()
-                tts_task.cancel()
-                if previous_transcript:
-                    conversation_history.user.append(previous_transcript)
-                    conversation_history.ai.append(' '.join(token_buffer))
+            return await manager.send_token(token, websocket=websocket)
+
+        async def get_quivr_info():
+            if not use_quivr:
+                return None
+            return await asyncio.to_thread(
+                db.query(QuivrInfo).filter(QuivrInfo.user_id == user_id).first)
+
+        async def speculate(transcript):
+            # start a held back reply from an interim transcript, see llm/speculation.py
+            if not speculator.will_speculate(transcript, useMultiOn=use_multion):
+                return
+            if turns.policy == BARGE_IN:
+                # the user is talking over the reply, it will be interrupted anyway. Stop it
+                # first so the speculative reply sees the interrupted exchange in the history
+                await turns.interrupt()
+            elif turns.busy:
+                return
+            quivr_info = await get_quivr_info()
+            speculator.speculate(
+                transcript,
+                history=build_history(conversation_history),
+                user_input_template=user_input_template,
+                character=character,
+                useSearch=use_search,
+                useQuivr=use_quivr,
+                useMultiOn=use_multion,
+                quivrApiKey=quivr_info.quivr_api_key if quivr_info else None,
+                quivrBrainId=quivr_info.quivr_brain_id if quivr_info else None)
+
+        async def reply(user_input: str, action_type: str, message_id: Optional[str],
+                        speculation: Optional[SpeculativeReply], tools: list[str], trace: Trace):
+            # the latency spans of this turn, see tracing.py
+            use_trace(trace)
+            finished = False
+
+            async def on_reply_end(response):
+                nonlocal finished
+                finished = True
+                # Send response to client, [=] indicates the response is done
+                if action_type == 'audio':
+                    await manager.send_message(message='[=]', websocket=websocket)
+                else:
+                    await manager.send_message(message=f'[end={message_id}]\n',
+                                               websocket=websocket)
+                # Update conversation history
+                conversation_history.user.append(user_input)
+                conversation_history.ai.append(response)
+                token_buffer.clear()
+                await session_store.save(session_id, conversation_history)
+                rolling_summary.update(conversation_history)
+                # Persist interaction in the database
+                interaction = Interaction(user_id=user_id,
+                            session_id=session_id,
+                            client_message_unicode=user_input,
+                            server_message_unicode=response,
+                            platform=platform,
+                            action_type=action_type,
+                            character_id=character_id,
+                            tools=','.join(tools),
+                            language=language,
+                            message_id=message_id,
+                            llm_config=llm.get_config())
+                await asyncio.to_thread(interaction.save, db)
+
+            callback = AsyncCallbackTextHandler(on_new_token, token_buffer, on_reply_end)
+            audioCallback = AsyncCallbackAudioHandler(
+                text_to_speech, sender, tts_event, character.voice_id)
+            try:
+                # Send "thinking" status over websocket
+                if use_search or use_quivr:
+                    await manager.send_message(message='[thinking]\n',
+                                               websocket=websocket)
+                # Send message to LLM, or commit the reply speculated from the interim
+                # transcript if it matches
+                if speculation is not None:
+                    await speculation.commit(callback, audioCallback)
+                    return
+                quivr_info = await get_quivr_info()
+                await llm.achat(
+                    history=build_history(conversation_history),
+                    user_input=user_input,
+                    user_input_template=user_input_template,
+                    callback=callback,
+                    audioCallback=audioCallback,
+                    character=character,
+                    useSearch=use_search,
+                    useQuivr=use_quivr,
+                    quivrApiKey=quivr_info.quivr_api_key if quivr_info else None,
+                    quivrBrainId=quivr_info.quivr_brain_id if quivr_info else None,
+                    useMultiOn=use_multion,
+                    metadata={"message_id": message_id} if message_id else None)
+            except asyncio.CancelledError:
+                # stop the pending sentences, their TTS streams close as the tasks unwind
+                audioCallback.cancel()
+                if not finished:
+                    # keep the interrupted exchange in the history
+                    conversation_history.user.append(user_input)
+                    conversation_history.ai.append(''.join(token_buffer))
                     token_buffer.clear()
+                    await session_store.save(session_id, conversation_history)
+                raise
+
+        async def start_reply(user_input: str, action_type: str, message_id=None):
+            tools = []
+            if use_search:
+                tools.append('search')
+            if use_quivr:
+                tools.append('quivr')
+            if use_multion:
+                tools.append('multion')
+            trace = Trace('llm_first_token', 'reply_first_audio')
+            speculation = speculator.claim(user_input)
+            await turns.submit(functools.partial(
+                reply, user_input, action_type, message_id, speculation, tools, trace))
+
+        async def on_transcript(transcript: str):
+            # ignore audio that picks up background noise
+            if (not transcript or len(transcript) < 2):
+                return
+
+            # 2. Send transcript to client
+            await manager.send_message(
+                message=f'[+]You said: {transcript}', websocket=websocket)
+
+            # 3. Start the reply, with barge-in this stops the previous one
+            await start_reply(transcript, 'audio')
+
+        async def read_stream_finals():
+            # final transcripts are ready once the user stops talking, the client may not send
+            # any more audio after that
+            while True:
+                event = await speech_stream.finals.get()
                 try:
-                    await tts_task
-                except asyncio.CancelledError:
-                    pass
-                tts_event.clear()
+                    await on_transcript(event.text)
+                except Exception as e:
+                    logger.error(f'Failed to handle the final transcript: {e}')
 
         speech_recognition_interim = False
         current_speech = ''
+        if stream_audio:
+            speech_stream = speech_to_text.create_stream(
+                sample_rate=sample_rate, channels=channels, prompt=character.name,
+                language=language)
+            stream_finals = asyncio.create_task(read_stream_finals())
 
         while True:
             data = await websocket.receive()
@@ -267,7 +430,6 @@ async def handle_receive(websocket: WebSocket, session_id: str, user_id: str, db
                 raise WebSocketDisconnect('disconnected')
             # handle text message
             if 'text' in data:
-                timer.start("LLM First Token")
                 msg_data = data['text']
                 # Handle client side commands
                 if msg_data.startswith('[!'):
@@ -280,18 +442,7 @@ async def handle_receive(websocket: WebSocket, session_id: str, user_id: str, db
                 # 0. itermidiate transcript starts with [&]
                 if msg_data.startswith('[&]'):
                     logger.info(f'intermediate transcript: {msg_data}')
-                    if not os.getenv('EXPERIMENT_CONVERSATION_UTTERANCE', ''):
-                        continue
-                    asyncio.create_task(stop_audio())
-                    asyncio.create_task(
-                        llm.achat_utterances(
-                            history=build_history(conversation_history),
-                            user_input=msg_data,
-                            callback=AsyncCallbackTextHandler(
-                                on_new_token, []),
-                            audioCallback=AsyncCallbackAudioHandler(
-                                text_to_speech, websocket, tts_event,
-                                character.voice_id)))
+                    await speculate(msg_data[3:])
                     continue
                 # 1. Whether client will send speech interim audio clip in the next message.
                 if msg_data.startswith('[&Speech]'):
@@ -299,6 +450,10 @@ async def handle_receive(websocket: WebSocket, session_id: str, user_id: str, db
                     continue
 
                 # 2. If client finished speech, use the sentence as input.
+                if msg_data.startswith('[SpeechFinished]') and speech_stream is not None:
+                    # push-to-talk released, the final transcript comes through the stream
+                    speech_stream.flush()
+                    continue
                 if msg_data.startswith('[SpeechFinished]'):
                     msg_data = current_speech
                     logger.info(f"Full transcript: {current_speech}")
@@ -312,75 +467,29 @@ async def handle_receive(websocket: WebSocket, session_id: str, user_id: str, db
                         message=f'[+]You said: {current_speech}', websocket=websocket)
                     current_speech = ''
 
-                # 2. Send "thinking" status over websocket
-                if use_search or use_quivr:
-                    await manager.send_message(message='[thinking]\n',
-                                               websocket=websocket)
-
-                # 3. Send message to LLM
-                if use_quivr:
-                    quivr_info = await asyncio.to_thread(
-                        db.query(QuivrInfo).filter(QuivrInfo.user_id == user_id).first)
-                else:
-                    quivr_info = None
-                message_id = str(uuid.uuid4().hex)[:16]
-                response = await llm.achat(
-                    history=build_history(conversation_history),
-                    user_input=msg_data,
-                    user_input_template=user_input_template,
-                    callback=AsyncCallbackTextHandler(on_new_token,
-                                                      token_buffer),
-                    audioCallback=AsyncCallbackAudioHandler(
-                        text_to_speech, websocket, tts_event, character.voice_id),
-                    character=character,
-                    useSearch=use_search,
-                    useQuivr=use_quivr,
-                    quivrApiKey=quivr_info.quivr_api_key if quivr_info else None,
-                    quivrBrainId=quivr_info.quivr_brain_id if quivr_info else None,
-                    useMultiOn=use_multion,
-                    metadata={"message_id": message_id})
-
-                # 3. Send response to client
-                await manager.send_message(message=f'[end={message_id}]\n',
-                                           websocket=websocket)
-
-                # 4. Update conversation history
-                conversation_history.user.append(msg_data)
-                conversation_history.ai.append(response)
-                token_buffer.clear()
-                # 5. Persist interaction in the database
-                tools = []
-                if use_search:
-                    tools.append('search')
-                if use_quivr:
-                    tools.append('quivr')
-                if use_multion:
-                    tools.append('multion')
-                interaction = Interaction(user_id=user_id,
-                            session_id=session_id,
-                            client_message_unicode=msg_data,
-                            server_message_unicode=response,
-                            platform=platform,
-                            action_type='text',
-                            character_id=character_id,
-                            tools=','.join(tools),
-                            language=language,
-                            message_id=message_id,
-                            llm_config=llm.get_config())
-                await asyncio.to_thread(interaction.save, db)
+                # 3. Start the reply, the next message is read while it runs
+                await start_reply(msg_data, 'text', message_id=str(uuid.uuid4().hex)[:16])
 
             # handle binary message(audio)
             elif 'bytes' in data:
                 binary_data = data['bytes']
+                # 0. Streaming speech recognition: send partial transcripts as they become
+                # stable, the final transcripts are handled by read_stream_finals.
+                if speech_stream is not None:
+                    for event in await speech_stream.feed(binary_data):
+                        await manager.send_message(message=f'[+&]{event.text}',
+                                                   websocket=websocket)
+                    continue
                 # 0. Handle interim speech.
-                if speech_recognition_interim:
+                elif speech_recognition_interim:
                     interim_transcript: str = (
-                        await asyncio.to_thread(
-                            speech_to_text.transcribe,
+                        await speech_to_text.atranscribe(
                             binary_data,
                             platform=platform,
                             prompt=current_speech,
                             suppress_tokens=[0, 11, 13, 30],
+                            sample_rate=sample_rate,
+                            channels=channels,
                         )
                     ).strip()
                     speech_recognition_interim = False
@@ -389,91 +498,27 @@ async def handle_receive(websocket: WebSocket, session_id: str, user_id: str, db
                         continue
                     logger.info(f"Speech interim: {interim_transcript}")
                     current_speech = current_speech + ' ' + interim_transcript
+                    await speculate(current_speech)
                     continue
-
-                # 1. Transcribe audio
-                transcript: str = (await asyncio.to_thread(speech_to_text.transcribe,
-                    binary_data, platform=platform,
-                    prompt=character.name)).strip()
-
-                # ignore audio that picks up background noise
-                if (not transcript or len(transcript) < 2):
-                    continue
-
-                # start counting time for LLM to generate the first token
-                timer.start("LLM First Token")
-
-                # 2. Send transcript to client
-                await manager.send_message(
-                    message=f'[+]You said: {transcript}', websocket=websocket)
-
-                # 3. stop the previous audio stream, if new transcript is received
-                await stop_audio()
-
-                previous_transcript = transcript
-
-                async def tts_task_done_call_back(response):
-                    # Send response to client, [=] indicates the response is done
-                    await manager.send_message(message='[=]',
-                                               websocket=websocket)
-                    # Update conversation history
-                    conversation_history.user.append(transcript)
-                    conversation_history.ai.append(response)
-                    token_buffer.clear()
-                    # Persist interaction in the database
-                    tools = []
-                    if use_search:
-                        tools.append('search')
-                    if use_quivr:
-                        tools.append('quivr')
-                    if use_multion:
-                        tools.append('multion')
-                    interaction = Interaction(user_id=user_id,
-                                session_id=session_id,
-                                client_message_unicode=transcript,
-                                server_message_unicode=response,
-                                platform=platform,
-                                action_type='audio',
-                                character_id=character_id,
-                                tools=','.join(tools),
-                                language=language,
-                                llm_config=llm.get_config())
-                    await asyncio.to_thread(interaction.save, db)
-
-                # 4. Send "thinking" status over websocket
-                if use_search or use_quivr:
-                    await manager.send_message(message='[thinking]\n',
-                                               websocket=websocket)
-
-                # 5. Send message to LLM
-                if use_quivr:
-                    quivr_info = await asyncio.to_thread(
-                        db.query(QuivrInfo).filter(QuivrInfo.user_id == user_id).first)
                 else:
-                    quivr_info = None
-                tts_task = asyncio.create_task(
-                    llm.achat(history=build_history(conversation_history),
-                              user_input=transcript,
-                              user_input_template=user_input_template,
-                              callback=AsyncCallbackTextHandler(
-                                  on_new_token, token_buffer,
-                                  tts_task_done_call_back),
-                              audioCallback=AsyncCallbackAudioHandler(
-                                  text_to_speech, websocket, tts_event,
-                                  character.voice_id),
-                              character=character,
-                              useSearch=use_search,
-                              useQuivr=use_quivr,
-                              useMultiOn=use_multion,
-                              quivrApiKey=quivr_info.quivr_api_key if quivr_info else None,
-                              quivrBrainId=quivr_info.quivr_brain_id if quivr_info else None))
-                
-            # log latency info
-            timer.report()
-
+                    # 1. Transcribe audio
+                    with span('stt'):
+                        transcript: str = (await speech_to_text.atranscribe(
+                            binary_data, platform=platform,
+                            prompt=character.name, sample_rate=sample_rate,
+                            channels=channels)).strip()
+                    await on_transcript(transcript)
     except WebSocketDisconnect:
         logger.info(f"User #{user_id} closed the connection")
-        timer.reset()
         await manager.disconnect(websocket)
         await memory_manager.process_session(session_id)
         return
+    finally:
+        if stream_finals is not None:
+            stream_finals.cancel()
+        if turns is not None:
+            await turns.close()
+        await speculator.close()
+        await rolling_summary.close()
+        if speech_stream is not None:
+            await speech_stream.close()
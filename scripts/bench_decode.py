@@ -0,0 +1,118 @@
+"""
+Measure decoding a webm/opus recording, as sent by the web client, into the 16 kHz float32
+audio given to Whisper. Compares the in-process PyAV decoder (whisper.decode_webm) with the
+previous path: pydub running ffmpeg to convert to WAV, then faster-whisper decoding the WAV.
+
+For each utterance it reports the median wall time, the median CPU time, including the CPU
+of child processes such as ffmpeg, and the peak and retained memory seen by tracemalloc in a
+separate run. tracemalloc sees Python and numpy allocations, not the buffers libav or the
+ffmpeg process allocate for themselves.
+
+Clips are synthesized with PyAV unless recordings are given with --files. The pydub path needs
+the ffmpeg binary on PATH and is skipped without it.
+
+    python scripts/bench_decode.py [--seconds 1 5 15] [--files a.webm ...] [--repeat 5]
+"""
+import argparse
+import io
+import os
+import shutil
+import statistics
+import sys
+import tracemalloc
+from time import perf_counter, process_time
+
+import av
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from realtime_ai_character.audio.speech_to_text.pcm import SAMPLE_RATE  # noqa: E402
+from realtime_ai_character.audio.speech_to_text.whisper import decode_webm  # noqa: E402
+
+
+def synthesize_webm(seconds: float, rate: int = 48000) -> bytes:
+    """Mono opus in webm, in 20ms frames like MediaRecorder, of a tone with some noise."""
+    output = io.BytesIO()
+    with av.open(output, 'w', format='webm') as container:
+        stream = container.add_stream('libopus', rate=rate)
+        stream.layout = 'mono'
+        t = np.arange(int(rate * seconds)) / rate
+        noise = np.random.default_rng(0).standard_normal(len(t))
+        audio = (0.3 * np.sin(2 * np.pi * 220 * t) + 0.05 * noise).astype(np.float32)
+        frame_size = rate // 50
+        for start in range(0, len(audio), frame_size):
+            frame = av.AudioFrame.from_ndarray(audio[None, start:start + frame_size],
+                                               format='flt', layout='mono')
+            frame.sample_rate = rate
+            frame.pts = start
+            container.mux(stream.encode(frame))
+        container.mux(stream.encode(None))
+    return output.getvalue()
+
+
+def decode_pydub(webm_data: bytes) -> np.ndarray:
+    from faster_whisper.audio import decode_audio
+    from pydub import AudioSegment
+    wav_data = io.BytesIO()
+    AudioSegment.from_file(io.BytesIO(webm_data), format='webm').export(wav_data, format='wav')
+    wav_data.seek(0)
+    return decode_audio(wav_data, sampling_rate=SAMPLE_RATE)
+
+
+def cpu_time() -> float:
+    """CPU seconds of this process and of its finished child processes."""
+    times = os.times()
+    return process_time() + times.children_user + times.children_system
+
+
+def measure(decode, webm_data: bytes, repeat: int) -> dict:
+    """Median wall and CPU seconds per decode, then memory of one decode under tracemalloc."""
+    wall, cpu = [], []
+    for _ in range(repeat):
+        started, cpu_started = perf_counter(), cpu_time()
+        audio = decode(webm_data)
+        wall.append(perf_counter() - started)
+        cpu.append(cpu_time() - cpu_started)
+    # traced apart, tracemalloc slows the allocations down
+    tracemalloc.start()
+    audio = decode(webm_data)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'duration': len(audio) / SAMPLE_RATE, 'wall': statistics.median(wall),
+            'cpu': statistics.median(cpu), 'peak': peak, 'retained': retained}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--seconds', type=float, nargs='+', default=[1, 5, 15])
+    parser.add_argument('--files', nargs='*', default=[])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    clips = []
+    for path in args.files:
+        with open(path, 'rb') as f:
+            clips.append((os.path.basename(path), f.read()))
+    if not args.files:
+        clips = [(f'{seconds:g}s tone', synthesize_webm(seconds)) for seconds in args.seconds]
+
+    decoders = {'pyav': decode_webm}
+    if shutil.which('ffmpeg'):
+        decoders['pydub+ffmpeg'] = decode_pydub
+    else:
+        print('ffmpeg not found, skipping the pydub path')
+
+    print(f'{"clip":<16} {"decoder":<14} {"audio":>8} {"wall":>10} {"cpu":>10} '
+          f'{"x realtime":>11} {"peak":>10} {"retained":>10}')
+    for name, webm_data in clips:
+        for decoder, decode in decoders.items():
+            result = measure(decode, webm_data, args.repeat)
+            print(f'{name:<16} {decoder:<14} {result["duration"]:>7.2f}s '
+                  f'{result["wall"] * 1e3:>8.2f}ms {result["cpu"] * 1e3:>8.2f}ms '
+                  f'{result["duration"] / result["wall"]:>10.0f}x '
+                  f'{result["peak"] / 1024:>8.0f}KB {result["retained"] / 1024:>8.0f}KB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Time building the prompt of every turn of a long session: the history messages plus fitting
+them in the token budget, as done before each LLM request. Compares the cached message list
+of ConversationHistory with rebuilding all the messages (the original build_history) and with
+copying cached turns into a new list.
+
+    python scripts/bench_history.py [--turns 500] [--budget 4000] [--repeat 5]
+"""
+import argparse
+import os
+import sys
+from time import perf_counter
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain.schema import AIMessage, HumanMessage, SystemMessage  # noqa: E402
+
+from realtime_ai_character.llm.context_window import (ContextWindow,  # noqa: E402
+                                                      estimate_tokens)
+from realtime_ai_character.utils import ConversationHistory  # noqa: E402
+
+USER_MESSAGE = 'Tell me more about the time you spent in Paris, what did you do there?'
+AI_MESSAGE = ('I spent most of my days walking along the Seine and writing in small cafes. '
+              'The evenings were for friends, long dinners and arguments about art.')
+
+
+def rebuild(history: ConversationHistory):
+    """The original build_history: every message of the session is created again."""
+    messages = [SystemMessage(content=history.system_prompt)]
+    for user_message, ai_message in zip(history.user, history.ai):
+        messages.append(HumanMessage(content=user_message))
+        messages.append(AIMessage(content=ai_message))
+    return messages
+
+
+class CopiedTurns:
+    """Cached turn messages copied behind the system prompt for every request."""
+
+    def __init__(self):
+        self.turns = []
+
+    def __call__(self, history: ConversationHistory):
+        for user_message, ai_message in zip(history.user[len(self.turns) // 2:],
+                                            history.ai[len(self.turns) // 2:]):
+            self.turns.append(HumanMessage(content=user_message))
+            self.turns.append(AIMessage(content=ai_message))
+        return [SystemMessage(content=history.system_prompt)] + self.turns
+
+
+def run(build, turns: int, window: ContextWindow) -> list[float]:
+    """Seconds spent building the prompt of each turn."""
+    history = ConversationHistory(system_prompt='You are a helpful character.')
+    timings = []
+    for turn in range(turns):
+        message = HumanMessage(content=f'{USER_MESSAGE} ({turn})')
+        started = perf_counter()
+        window.fit(build(history), message)
+        timings.append(perf_counter() - started)
+        history.user.append(message.content)
+        history.ai.append(AI_MESSAGE)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--turns', type=int, default=500)
+    parser.add_argument('--budget', type=int, default=4000,
+                        help='token budget of the prompt, 0 sends the whole history')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    window = ContextWindow(estimate_tokens, budget=args.budget)
+
+    variants = {
+        'rebuild': lambda: rebuild,
+        'copy': CopiedTurns,
+        'cached': lambda: ConversationHistory.messages,
+    }
+    checkpoints = [n for n in (1, 100, 250, 500, 1000) if n <= args.turns]
+    print(f'{"":<8} {"total":>10} ' + ' '.join(f'{f"turn {n}":>10}' for n in checkpoints))
+    for name, make in variants.items():
+        # best of the repeats, per turn
+        best = None
+        for _ in range(args.repeat):
+            timings = run(make(), args.turns, window)
+            best = timings if best is None else [min(a, b) for a, b in zip(best, timings)]
+        print(f'{name:<8} {sum(best) * 1e3:>8.2f}ms ' +
+              ' '.join(f'{best[n - 1] * 1e6:>8.1f}us' for n in checkpoints))
+
+
+if __name__ == '__main__':
+    main()
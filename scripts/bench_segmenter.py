@@ -0,0 +1,97 @@
+"""
+Replay recorded LLM token streams through the TTS sentence segmenter and report how long
+after the first token the first chunk is ready for text to speech, compared with the
+splitter AsyncCallbackAudioHandler used before (flush only on a token that is exactly
+'.', '?' or '!').
+
+Each line of the streams file is {"tokens": [[seconds since previous token, token], ...]}.
+Time is simulated from the recorded delays, so the results do not depend on the machine,
+and the CPU time spent segmenting is reported separately.
+
+    python scripts/bench_segmenter.py [--streams scripts/data/token_streams.jsonl]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+from time import perf_counter
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from realtime_ai_character.audio.text_to_speech.sentence_segmenter import (  # noqa: E402
+    SentenceSegmenter)
+
+DEFAULT_STREAMS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data',
+                               'token_streams.jsonl')
+
+
+class TokenSplitter:
+    """The previous splitter of AsyncCallbackAudioHandler."""
+
+    def __init__(self):
+        self.current_sentence = ''
+
+    def feed(self, token: str) -> list[str]:
+        if token not in {'.', '?', '!'}:
+            self.current_sentence += token
+            return []
+        sentence, self.current_sentence = self.current_sentence, ''
+        return [sentence]
+
+    def flush(self) -> list[str]:
+        sentence, self.current_sentence = self.current_sentence, ''
+        return [sentence] if sentence else []
+
+
+def replay(splitter, tokens) -> tuple[float, int, float]:
+    """Return (seconds to the first chunk, number of chunks, CPU seconds spent splitting)."""
+    elapsed = 0.0
+    first_chunk = None
+    chunks = 0
+    cpu = 0.0
+    for i, (delay, token) in enumerate(tokens):
+        if i:
+            elapsed += delay
+        started = perf_counter()
+        ready = splitter.feed(token)
+        cpu += perf_counter() - started
+        if ready and first_chunk is None:
+            first_chunk = elapsed
+        chunks += len(ready)
+    started = perf_counter()
+    ready = splitter.flush()
+    cpu += perf_counter() - started
+    if ready and first_chunk is None:
+        first_chunk = elapsed
+    return first_chunk or 0.0, chunks + len(ready), cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--streams', default=DEFAULT_STREAMS)
+    args = parser.parse_args()
+    with open(args.streams, encoding='utf-8') as f:
+        streams = [json.loads(line)['tokens'] for line in f if line.strip()]
+
+    results = {'old splitter': [], 'segmenter': []}
+    print(f'{"stream":>6} {"tokens":>6} {"old first":>10} {"new first":>10} '
+          f'{"old chunks":>10} {"new chunks":>10}')
+    for n, tokens in enumerate(streams):
+        old = replay(TokenSplitter(), tokens)
+        new = replay(SentenceSegmenter(), tokens)
+        results['old splitter'].append(old)
+        results['segmenter'].append(new)
+        print(f'{n:>6} {len(tokens):>6} {old[0]:>9.3f}s {new[0]:>9.3f}s {old[1]:>10} {new[1]:>10}')
+
+    print()
+    for name, runs in results.items():
+        firsts = [run[0] for run in runs]
+        cpu_per_token = sum(run[2] for run in runs) / sum(len(tokens) for tokens in streams)
+        print(f'{name:<13} time to first chunk: mean {statistics.mean(firsts):.3f}s, '
+              f'median {statistics.median(firsts):.3f}s, max {max(firsts):.3f}s; '
+              f'{cpu_per_token * 1e6:.1f}us CPU per token')
+
+
+if __name__ == '__main__':
+    main()
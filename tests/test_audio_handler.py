@@ -0,0 +1,49 @@
+import asyncio
+
+from realtime_ai_character.llm.base import AsyncCallbackAudioHandler
+
+
+class RecordingTTS:
+    """Sends one chunk per sentence and records the order sentences start in."""
+
+    def __init__(self):
+        self.started = []
+
+    async def stream(self, text, websocket, tts_event, voice_id, first_sentence, language):
+        self.started.append(text)
+        await websocket.send_bytes(text.encode())
+
+
+class SlowWebsocket:
+    """Playing a sentence takes until the test lets it go."""
+
+    def __init__(self):
+        self.sent = []
+        self.next = asyncio.Event()
+
+    async def send_bytes(self, data: bytes):
+        self.sent.append(data.decode())
+        await self.next.wait()
+        self.next.clear()
+
+
+def test_synthesis_stays_lookahead_sentences_ahead_of_playback():
+    async def scenario():
+        tts, websocket = RecordingTTS(), SlowWebsocket()
+        handler = AsyncCallbackAudioHandler(tts, websocket, lookahead=2)
+        handler.is_reply = True
+        for i in range(6):
+            handler._enqueue_sentence(f'sentence {i}')
+        started = []
+        for _ in range(6):
+            for _ in range(10):
+                await asyncio.sleep(0)
+            started.append((len(websocket.sent), len(tts.started)))
+            websocket.next.set()
+        await handler.on_llm_end()
+        return started, websocket.sent
+
+    started, sent = asyncio.run(scenario())
+    # while sentence n plays, sentences up to n + 2 are synthesized, not the whole reply
+    assert started == [(1, 3), (2, 4), (3, 5), (4, 6), (5, 6), (6, 6)]
+    assert sent == [f'sentence {i}' for i in range(6)]
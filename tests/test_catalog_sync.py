@@ -0,0 +1,101 @@
+import os
+
+import pytest
+
+# clients are created when the modules are imported, they are never called here
+os.environ.setdefault('OPENAI_API_KEY', 'test')
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+pytest.importorskip('llama_index')
+catalog_manager = pytest.importorskip('realtime_ai_character.character_catalog.catalog_manager')
+
+
+class FakeCollection:
+    def __init__(self):
+        self.rows = {}  # chunk id -> metadata
+
+    def add(self, ids, embeddings, metadatas, documents):
+        for chunk_id, metadata in zip(ids, metadatas):
+            self.rows[chunk_id] = dict(metadata)
+
+    def update(self, ids, metadatas):
+        for chunk_id, metadata in zip(ids, metadatas):
+            self.rows[chunk_id].update(metadata)
+
+
+class FakeChroma:
+    """The part of the LangChain Chroma store used by sync_data."""
+
+    def __init__(self, embeddings):
+        self._collection = FakeCollection()
+        self.embeddings = embeddings
+
+    def get(self, include):
+        rows = self._collection.rows
+        return {'ids': list(rows), 'metadatas': [dict(metadata) for metadata in rows.values()]}
+
+    def delete(self, ids):
+        for chunk_id in ids:
+            self._collection.rows.pop(chunk_id, None)
+
+
+class FlakyEmbeddings:
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.embedded = 0
+
+    def embed_documents(self, texts):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError('embedding API unavailable')
+        self.embedded += len(texts)
+        return [[0.0] * 4 for _ in texts]
+
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    # one chunk per batch, so a failed batch loses a single chunk
+    monkeypatch.setattr(catalog_manager, 'EMBEDDING_BATCH_SIZE', 1)
+    data = tmp_path / 'data'
+    data.mkdir()
+    (data / 'facts.txt').write_text(
+        '\n'.join(f'Fact number {i}: ' + 'the character likes long walks. ' * 3
+                  for i in range(20)))
+    manager = catalog_manager.CatalogManager.__new__(catalog_manager.CatalogManager)
+    manager.data_paths = {'Alice': data}
+    manager.db = FakeChroma(FlakyEmbeddings(failures=1))
+    return manager
+
+
+def test_failed_batch_is_embedded_again_on_the_next_sync(manager):
+    rows = manager.db._collection.rows
+    data_hash = catalog_manager.hash_directory(manager.data_paths['Alice'])
+
+    manager.sync_data()
+    chunks = len(manager.load_data('Alice', manager.data_paths['Alice']))
+    assert chunks > 2
+    assert len(rows) == chunks - 1
+    # the character is incomplete, its chunks do not claim the current data
+    assert all(metadata.get('data_hash') != data_hash for metadata in rows.values())
+
+    manager.sync_data()
+    assert manager.db.embeddings.embedded == chunks
+    assert len(rows) == chunks
+    assert all(metadata['data_hash'] == data_hash for metadata in rows.values())
+
+    # complete now, nothing is embedded again
+    manager.sync_data()
+    assert manager.db.embeddings.embedded == chunks
+
+
+def test_changed_data_keeps_the_stored_chunks(manager):
+    manager.db.embeddings.failures = 0
+    manager.sync_data()
+    embedded = manager.db.embeddings.embedded
+    with open(manager.data_paths['Alice'] / 'facts.txt', 'a') as f:
+        f.write('\nA new fact about the character.')
+
+    manager.sync_data()
+    data_hash = catalog_manager.hash_directory(manager.data_paths['Alice'])
+    rows = manager.db._collection.rows
+    assert manager.db.embeddings.embedded - embedded <= 2
+    assert all(metadata['data_hash'] == data_hash for metadata in rows.values())
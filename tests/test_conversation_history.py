@@ -0,0 +1,41 @@
+import pytest
+from langchain.schema import HumanMessage
+
+from realtime_ai_character.utils import ConversationHistory
+
+
+def test_messages_cannot_be_changed_by_the_caller():
+    history = ConversationHistory(system_prompt='You are a character.',
+                                  user=['hello'], ai=['hi'])
+    messages = history.messages()
+    with pytest.raises((TypeError, AttributeError)):
+        messages.append(HumanMessage(content='injected'))
+    prompt = [*messages, HumanMessage(content='how are you?')]
+    prompt.pop(0)
+    assert [m.content for m in history.messages()] == ['You are a character.', 'hello', 'hi']
+
+
+def test_messages_are_extended_with_new_turns():
+    history = ConversationHistory(system_prompt='You are a character.')
+    first = history.messages()
+    history.user.append('hello')
+    history.ai.append('hi')
+    second = history.messages()
+    assert [m.content for m in first] == ['You are a character.']
+    assert [m.content for m in second] == ['You are a character.', 'hello', 'hi']
+    # cached while nothing changes
+    assert history.messages() is second
+
+
+def test_fit_takes_the_cached_messages():
+    context_window = pytest.importorskip('realtime_ai_character.llm.context_window')
+    history = ConversationHistory(system_prompt='You are a character.',
+                                  user=[f'user {i}' for i in range(20)],
+                                  ai=[f'ai {i}' for i in range(20)])
+    message = HumanMessage(content='and now?')
+    window = context_window.ContextWindow(lambda text: len(text.split()), budget=40)
+    prompt = window.fit(history.messages(), message)
+    assert prompt[0].content == 'You are a character.' and prompt[-1] is message
+    assert prompt[1].content.startswith('user') and len(prompt) < 42
+    unbounded = context_window.ContextWindow(len, budget=0).fit(history.messages(), message)
+    assert len(unbounded) == 42
@@ -0,0 +1,107 @@
+import asyncio
+
+from starlette.websockets import WebSocketState
+
+from realtime_ai_character.outbound_queue import DISCONNECT, DROP, OutboundQueue
+
+
+class RecordingWebSocket:
+    """Records what is sent, each send takes `delay` seconds like a slow client."""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.sent = []
+        self.closed_with = None
+        self.application_state = WebSocketState.CONNECTED
+
+    async def send_text(self, message: str):
+        await asyncio.sleep(self.delay)
+        self.sent.append(message)
+
+    async def send_bytes(self, data: bytes):
+        await asyncio.sleep(self.delay)
+        self.sent.append(data)
+
+    async def close(self, code: int = 1000, reason: str = ''):
+        self.closed_with = code
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_tokens_are_coalesced_and_flushed_by_a_control_frame():
+    async def scenario():
+        websocket = RecordingWebSocket()
+        queue = OutboundQueue(websocket, flush_interval=10)
+        for token in ('Hello', ' ', 'world'):
+            await queue.send_token(token)
+        await queue.send_text('[end]\n')
+        await asyncio.sleep(0.01)
+        return websocket.sent
+
+    assert run(scenario()) == ['Hello world', '[end]\n']
+
+
+def test_tokens_after_a_control_frame_are_held_from_their_own_arrival():
+    async def scenario():
+        websocket = RecordingWebSocket()
+        queue = OutboundQueue(websocket, flush_interval=0.05)
+        await queue.send_token('a')
+        await queue.send_text('[end]\n')
+        await asyncio.sleep(0.1)
+        await queue.send_token('b')
+        await asyncio.sleep(0.01)
+        await queue.send_token('c')
+        # still within the flush interval of 'b'
+        held = list(websocket.sent)
+        await asyncio.sleep(0.1)
+        return held, websocket.sent
+
+    held, sent = run(scenario())
+    assert held == ['a', '[end]\n']
+    assert sent == ['a', '[end]\n', 'bc']
+
+
+def test_end_of_turn_follows_the_audio_of_the_turn():
+    async def scenario():
+        websocket = RecordingWebSocket(delay=0.001)
+        queue = OutboundQueue(websocket, flush_interval=0)
+        await queue.send_bytes(b'audio 1')
+        await queue.send_bytes(b'audio 2')
+        await queue.send_text('[end=1]\n')
+        # the next turn: its text may go ahead of its audio
+        await queue.send_bytes(b'audio 3')
+        await queue.send_token('next')
+        await asyncio.sleep(0.05)
+        return websocket.sent
+
+    sent = run(scenario())
+    assert sent.index('[end=1]\n') > sent.index(b'audio 2')
+    assert sent.index('next') < sent.index(b'audio 3')
+
+
+def test_drop_policy_discards_audio_first():
+    async def scenario():
+        websocket = RecordingWebSocket(delay=1)
+        queue = OutboundQueue(websocket, max_buffer=10, policy=DROP)
+        await queue.send_bytes(b'x' * 8)
+        await queue.send_bytes(b'y' * 8)
+        await queue.send_text('[end]\n')
+        return queue
+
+    queue = run(scenario())
+    assert not queue.closed and queue.dropped_bytes == 16
+
+
+def test_text_alone_over_the_limit_disconnects_with_either_policy():
+    for policy in (DROP, DISCONNECT):
+        async def scenario():
+            websocket = RecordingWebSocket(delay=1)
+            queue = OutboundQueue(websocket, max_buffer=10, policy=policy)
+            await queue.send_text('[+]You said: hello there')
+            await asyncio.sleep(0)
+            return queue, websocket
+
+        queue, websocket = run(scenario())
+        assert queue.closed and websocket.closed_with == 1008
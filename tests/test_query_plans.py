@@ -0,0 +1,75 @@
+"""
+The hot queries must be served by an index. Runs on SQLite, and on PostgreSQL as well when
+TEST_POSTGRES_URL points to a scratch database (its tables are created and dropped).
+"""
+import os
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from realtime_ai_character.database.base import Base
+from realtime_ai_character.models.character import Character
+from realtime_ai_character.models.conversation import Conversation
+from realtime_ai_character.models.interaction import Interaction
+from realtime_ai_character.models.memory import Memory
+from realtime_ai_character.models.quivr_info import QuivrInfo
+
+TABLES = [model.__table__ for model in (Interaction, Memory, QuivrInfo, Character, Conversation)]
+
+# query -> index it must use
+HOT_QUERIES = {
+    # session auth check
+    "SELECT * FROM interactions WHERE session_id = 's' LIMIT 1":
+        'ix_interactions_session_id_timestamp',
+    # history load and /session_history
+    "SELECT client_message_unicode, server_message_unicode FROM interactions "
+    "WHERE session_id = 's' ORDER BY timestamp DESC, id DESC LIMIT 200":
+        'ix_interactions_session_id_timestamp',
+    # interactions of a user
+    "SELECT session_id, row_number() OVER (PARTITION BY session_id ORDER BY timestamp DESC) "
+    "FROM interactions WHERE user_id = 'u'":
+        'ix_interactions_user_id_timestamp',
+    "SELECT * FROM memory WHERE user_id = 'u'": 'ix_memory_user_id',
+    "SELECT * FROM quivr_info WHERE user_id = 'u'": 'ix_quivr_info_user_id',
+    "SELECT * FROM characters WHERE author_id = 'u'": 'ix_characters_author_id',
+    # /conversations
+    "SELECT * FROM conversations WHERE user_id = 'u' "
+    "ORDER BY last_timestamp DESC, session_id DESC LIMIT 20":
+        'ix_conversations_user_id_last_timestamp',
+}
+
+
+def sqlite_plan(connection, query: str) -> str:
+    return '\n'.join(row[-1] for row in connection.execute(text(f'EXPLAIN QUERY PLAN {query}')))
+
+
+def postgres_plan(connection, query: str) -> str:
+    # the test tables are empty, make the planner use an index whenever it can
+    connection.execute(text('SET enable_seqscan = off'))
+    return '\n'.join(row[0] for row in connection.execute(text(f'EXPLAIN {query}')))
+
+
+ENGINES = [pytest.param(('sqlite://', sqlite_plan), id='sqlite')]
+if os.getenv('TEST_POSTGRES_URL'):
+    ENGINES.append(pytest.param((os.getenv('TEST_POSTGRES_URL'), postgres_plan),
+                               id='postgres'))
+
+
+@pytest.fixture(params=ENGINES)
+def database(request):
+    url, plan = request.param
+    engine = create_engine(url)
+    Base.metadata.create_all(engine, tables=TABLES)
+    try:
+        with engine.connect() as connection:
+            yield connection, plan
+    finally:
+        Base.metadata.drop_all(engine, tables=TABLES)
+        engine.dispose()
+
+
+@pytest.mark.parametrize('query,index', HOT_QUERIES.items(), ids=list(range(len(HOT_QUERIES))))
+def test_hot_query_uses_index(database, query, index):
+    connection, plan = database
+    query_plan = plan(connection, query)
+    assert index in query_plan, query_plan
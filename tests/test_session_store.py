@@ -0,0 +1,83 @@
+import asyncio
+import json
+
+import pytest
+
+from realtime_ai_character.session_store import (InMemorySessionStore, NullSessionStore,
+                                                 RedisSessionStore, dump_history)
+from realtime_ai_character.utils import ConversationHistory
+
+
+def make_history(turns: int, summarized: int = 0) -> ConversationHistory:
+    return ConversationHistory(system_prompt='You are a character.',
+                               user=[f'user {i}' for i in range(turns)],
+                               ai=[f'ai {i}' for i in range(turns)],
+                               summary='summary' if summarized else '',
+                               summarized=summarized)
+
+
+def test_dump_keeps_only_the_tail():
+    data = json.loads(dump_history(make_history(10, summarized=7), turns=4))
+    assert data == {'user': ['user 6', 'user 7', 'user 8', 'user 9'],
+                    'ai': ['ai 6', 'ai 7', 'ai 8', 'ai 9'],
+                    'summary': 'summary', 'summarized': 1}
+    # the system prompt is set from the character when the session is resumed
+    assert 'system_prompt' not in data
+
+
+def test_dump_summary_before_the_tail():
+    data = json.loads(dump_history(make_history(10, summarized=3), turns=4))
+    assert data['summarized'] == 0 and data['user'][0] == 'user 6'
+
+
+def test_null_store_keeps_nothing():
+    async def run():
+        store = NullSessionStore()
+        await store.save('s', make_history(3))
+        return await store.load('s')
+
+    assert asyncio.run(run()) is None
+
+
+def test_in_memory_store_evicts_least_recent():
+    async def run():
+        store = InMemorySessionStore(ttl=60, max_sessions=2)
+        for session_id in ('a', 'b', 'c'):
+            await store.save(session_id, make_history(2))
+        return [await store.load(session_id) for session_id in ('a', 'b', 'c')]
+
+    a, b, c = asyncio.run(run())
+    assert a is None
+    assert b.user == ['user 0', 'user 1'] and c.ai == ['ai 0', 'ai 1']
+
+
+def test_in_memory_store_expires():
+    async def run():
+        store = InMemorySessionStore(ttl=-1)
+        await store.save('s', make_history(2))
+        return await store.load('s')
+
+    assert asyncio.run(run()) is None
+
+
+def test_redis_store_round_trip():
+    aioredis = pytest.importorskip('fakeredis.aioredis')
+
+    async def run():
+        client = aioredis.FakeRedis(decode_responses=True)
+        store = RedisSessionStore(client=client, prefix='test:', ttl=60)
+        history = make_history(300, summarized=150)
+        await store.save('s', history)
+        ttl = await client.ttl('test:session:s')
+        loaded = await store.load('s')
+        await store.delete('s')
+        return history, ttl, loaded, await store.load('s')
+
+    history, ttl, loaded, deleted = asyncio.run(run())
+    assert 0 < ttl <= 60
+    assert loaded.user == history.user[-200:] and loaded.ai == history.ai[-200:]
+    assert loaded.summary == 'summary' and loaded.summarized == 50
+    # once the system prompt is set, as when the session is resumed, the prompt is the same
+    loaded.system_prompt = history.system_prompt
+    assert [m.content for m in loaded.messages()] == [m.content for m in history.messages()]
+    assert deleted is None
@@ -0,0 +1,29 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from realtime_ai_character.utils import Singleton
+
+
+class SlowComponent(Singleton):
+    constructed = 0
+
+    def __init__(self):
+        type(self).constructed += 1
+        time.sleep(0.1)
+
+
+def test_concurrent_access_during_construction_builds_one_instance():
+    started = threading.Event()
+
+    def warm_up():
+        started.set()
+        SlowComponent.initialize()
+
+    with ThreadPoolExecutor(max_workers=5) as pool:
+        pool.submit(warm_up)
+        started.wait()
+        instances = list(pool.map(lambda _: SlowComponent.get_instance(), range(4)))
+
+    assert SlowComponent.constructed == 1
+    assert all(instance is instances[0] for instance in instances)
@@ -0,0 +1,44 @@
+import asyncio
+
+from realtime_ai_character.llm.speculation import Speculator, config
+
+
+class IdleLLM:
+    """Replies that never finish, the test only looks at when they are started."""
+
+    def __init__(self):
+        self.started = 0
+
+    async def achat(self, **kwargs):
+        self.started += 1
+        await asyncio.Event().wait()
+
+
+def test_will_speculate_matches_speculate():
+    async def scenario():
+        llm = IdleLLM()
+        speculator = Speculator(llm, enabled=True)
+        results = []
+        for transcript in ['hi', 'tell me about', 'Tell me about!', 'tell me about paris',
+                           'tell me about rome', 'tell me about london']:
+            will = speculator.will_speculate(transcript)
+            results.append((will, speculator.speculate(transcript)))
+            await asyncio.sleep(0)
+        multion = speculator.will_speculate('book me a table', useMultiOn=True)
+        await speculator.close()
+        return results, multion, llm.started
+
+    results, multion, started = asyncio.run(scenario())
+    # too short, then a new transcript, the same one again, and new ones up to max_attempts
+    expected = [False, True, False] + [True] * (config.max_attempts - 1)
+    expected += [False] * (len(results) - len(expected))
+    assert [will for will, _ in results] == expected
+    assert all(will == started for will, started in results)
+    assert started == config.max_attempts
+    assert not multion
+
+
+def test_disabled_speculator_never_starts():
+    speculator = Speculator(IdleLLM(), enabled=False)
+    assert not speculator.will_speculate('tell me about paris')
+    assert not speculator.speculate('tell me about paris')
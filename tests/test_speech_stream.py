@@ -0,0 +1,93 @@
+import asyncio
+from time import perf_counter
+
+import numpy as np
+
+from realtime_ai_character.audio.speech_to_text.pcm import SAMPLE_RATE, float32_to_pcm16
+from realtime_ai_character.audio.speech_to_text.streaming import SpeechStream, config
+
+
+class SlowEngine:
+    """Transcribes everything as 'hello there', after `delay` seconds."""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.calls = 0
+
+    async def atranscribe(self, audio_bytes, **kwargs) -> str:
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return 'hello there'
+
+
+def frames(seconds: float, amplitude: float, frame_ms: int = 20) -> list[bytes]:
+    samples = SAMPLE_RATE * frame_ms // 1000
+    t = np.arange(int(SAMPLE_RATE * seconds)) / SAMPLE_RATE
+    audio = (amplitude * np.sin(2 * np.pi * 220 * t)).astype(np.float32)
+    return [float32_to_pcm16(audio[i:i + samples]) for i in range(0, len(audio), samples)]
+
+
+def test_final_transcription_does_not_block_feed():
+    async def scenario():
+        engine = SlowEngine(delay=0.5)
+        stream = SpeechStream(engine, sample_rate=SAMPLE_RATE)
+        slowest = 0.0
+        utterance = frames(1.0, 0.3) + frames(config.speech_end_ms / 1000 + 0.1, 0.0)
+        for frame in utterance + frames(1.0, 0.0):
+            started = perf_counter()
+            events = await stream.feed(frame)
+            slowest = max(slowest, perf_counter() - started)
+            assert not any(event.is_final for event in events)
+            await asyncio.sleep(0.02)
+        finals = []
+        while not stream.finals.empty():
+            finals.append(stream.finals.get_nowait().text)
+        await stream.close()
+        return slowest, finals
+
+    slowest, finals = asyncio.run(scenario())
+    assert slowest < 0.1
+    assert finals == ['hello there']
+
+
+def test_final_transcript_comes_after_the_last_frame():
+    async def scenario():
+        stream = SpeechStream(SlowEngine(delay=0.2), sample_rate=SAMPLE_RATE)
+        for frame in frames(1.0, 0.3) + frames(config.speech_end_ms / 1000 + 0.1, 0.0):
+            await stream.feed(frame)
+        # no frame follows the end of speech
+        final = await asyncio.wait_for(stream.finals.get(), timeout=2)
+        await stream.close()
+        return final
+
+    assert asyncio.run(scenario()).text == 'hello there'
+
+
+def test_final_transcript_comes_without_more_audio():
+    async def scenario():
+        stream = SpeechStream(SlowEngine(delay=0.2), sample_rate=SAMPLE_RATE)
+        # push-to-talk: the client stops sending as soon as the user releases the button
+        for frame in frames(1.0, 0.3):
+            await stream.feed(frame)
+        stream.flush()
+        final = await asyncio.wait_for(stream.finals.get(), timeout=2)
+        await stream.close()
+        return final
+
+    final = asyncio.run(scenario())
+    assert final.is_final and final.text == 'hello there'
+
+
+def test_close_cancels_a_pending_final_transcription():
+    async def scenario():
+        engine = SlowEngine(delay=10)
+        stream = SpeechStream(engine, sample_rate=SAMPLE_RATE)
+        for frame in frames(0.5, 0.3) + frames(config.speech_end_ms / 1000 + 0.1, 0.0):
+            await stream.feed(frame)
+        pending = list(stream._final_tasks)
+        await stream.close()
+        await asyncio.sleep(0)
+        return pending
+
+    pending = asyncio.run(scenario())
+    assert pending and all(task.cancelled() for task in pending)
@@ -0,0 +1,62 @@
+import asyncio
+import time
+
+import pytest
+
+from realtime_ai_character.audio.speech_to_text.scheduler import (TranscriptionRejected,
+                                                                  TranscriptionScheduler)
+
+
+def test_requests_run_in_order_of_free_workers():
+    async def scenario():
+        scheduler = TranscriptionScheduler(lambda audio: audio.upper(), workers=2, max_queue=8,
+                                           deadline=5)
+        results = await asyncio.gather(*(scheduler.submit(f'a{i}') for i in range(6)))
+        scheduler.shutdown()
+        return results, scheduler.stats()
+
+    results, stats = asyncio.run(scenario())
+    assert results == [f'A{i}' for i in range(6)]
+    assert stats['completed'] == 6 and stats['running'] == 0
+
+
+def test_full_queue_is_rejected():
+    async def scenario():
+        scheduler = TranscriptionScheduler(lambda audio: time.sleep(0.1), workers=1,
+                                           max_queue=1, deadline=5)
+        results = await asyncio.gather(*(scheduler.submit(b'') for _ in range(3)),
+                                       return_exceptions=True)
+        scheduler.shutdown()
+        return results
+
+    results = asyncio.run(scenario())
+    assert sum(isinstance(result, TranscriptionRejected) for result in results) == 1
+
+
+def test_expired_waits_do_not_leak_worker_slots():
+    async def scenario():
+        # deadlines close to the run time, so slots are often freed as a wait expires
+        scheduler = TranscriptionScheduler(lambda audio: time.sleep(0.002), workers=2,
+                                           max_queue=1000, deadline=0.003)
+        for _ in range(20):
+            await asyncio.gather(*(scheduler.submit(b'') for _ in range(20)),
+                                 return_exceptions=True)
+        await asyncio.sleep(0.05)
+        free = scheduler._slots._value
+        scheduler.shutdown()
+        return free, scheduler.stats()
+
+    free, stats = asyncio.run(scenario())
+    assert stats['expired'] > 0
+    assert stats['running'] == 0 and free == 2
+
+
+def test_rejected_request_is_reported():
+    async def scenario():
+        scheduler = TranscriptionScheduler(lambda audio: time.sleep(0.2), workers=1,
+                                           max_queue=4, deadline=0.01)
+        with pytest.raises(TranscriptionRejected):
+            await asyncio.gather(scheduler.submit(b''), scheduler.submit(b''))
+        scheduler.shutdown()
+
+    asyncio.run(scenario())